@@ -0,0 +1,186 @@
+"""
+Admission form PDFs. The student page is drawn per student; the terms and
+parents' certificate page is identical for everyone, so it is drawn once per
+document as a reusable form and stamped onto every second page.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+
+from photo_cache import print_path
+from settings import load_settings
+
+LOGO_PATH = "logo.png"
+
+TERMS_CONTENT = """
+TERMS & CONDITIONS
+
+Note: Parents are requested to carefully read the following before signing the form.
+
+1. Admission Fee Challan will be issued by the school. No cash payment will be accepted.
+2. Parents are requested to submit copies of admission fee challan in the school.
+3. Fees are charged on monthly basis, except at the time of admission or summer vacations (i.e. June & July).
+4. Monthly tuition fee is payable in advance by the 10th of each month. After due date a daily fine of Rs. 10/- will be charged.
+5. Final date of payment of monthly tuition fee is the last day of each month thereafter name of the student will be struck off.
+6. Original school leaving certificate will only be issued against written request.
+7. School management takes utmost care about safety of all the children. School management shall take no responsibility in case of any accident.
+8. Parents are requested to cooperate with the school management and admissions are made on the basis of merit.
+9. In case, the child remains absent from school for consecutive five days without intimation, the name of the child will be struck off.
+
+CERTIFICATE FROM THE PARENTS
+
+1. I certified that the particulars, especially date of birth given is correct to the best of my knowledge or belief.
+2. I have read and understood above instructions, rules about payment of fees and will abide by them.
+3. I understand that the admission will be provisional.
+4. I understand that the annual re-admission of this section will be determined through periodical evaluation by the Headmistress.
+"""
+
+TERMS_FORM = "admission_terms"
+
+def draw_student_page(c, s, photo_path=None, campus="Ali Pur Chattha Campus"):
+    """Draws page 1 of the admission form for a database.Student row."""
+    w, h = A4
+    margin = 40
+    try:
+        if os.path.exists(LOGO_PATH):
+            c.drawImage(LOGO_PATH, margin, h - 100, width=80, height=80, mask='auto', preserveAspectRatio=True)
+    except: pass
+
+    c.setFont("Helvetica-Bold", 18)
+    c.setFillColorRGB(0, 0.2, 0.4)
+    c.drawString(margin + 100, h - 50, "INTERNATIONAL ISLAMIC UNIVERSITY")
+    c.drawString(margin + 100, h - 75, "ISLAMABAD SCHOOLS")
+    c.setFont("Helvetica", 12)
+    c.setFillColor(colors.black)
+    c.drawString(margin + 100, h - 95, campus)
+    c.setFont("Helvetica-Oblique", 10)
+    c.drawString(margin + 100, h - 110, "Student Admission Form")
+
+    photo_x = w - margin - 100
+    photo_y = h - 140
+    c.rect(photo_x, photo_y, 100, 120)
+    photo_path = photo_path or s.photo_path
+    if photo_path and os.path.exists(photo_path):
+        try: c.drawImage(photo_path, photo_x, photo_y, width=100, height=120, preserveAspectRatio=True)
+        except: c.drawString(photo_x + 10, photo_y + 60, "Photo Error")
+    else:
+        c.setFont("Helvetica", 8)
+        c.drawCentredString(photo_x + 50, photo_y + 60, "Passport Size Photo")
+
+    y_pos = h - 160
+    def draw_section_header(title, y):
+        c.setFillColorRGB(0.9, 0.9, 0.9)
+        c.rect(margin, y, w - 2*margin, 20, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(margin + 10, y + 6, title)
+        return y - 25
+
+    def draw_field_row(labels_values, y):
+        x_curr = margin
+        col_width = (w - 2*margin) / len(labels_values)
+        for lbl, val in labels_values:
+            c.setFont("Helvetica-Bold", 9)
+            c.drawString(x_curr, y, lbl)
+            c.setFont("Helvetica", 10)
+            val_str = str(val) if val else ""
+            c.drawString(x_curr, y - 15, val_str)
+            c.setStrokeColor(colors.lightgrey)
+            c.line(x_curr, y - 18, x_curr + col_width - 20, y - 18)
+            x_curr += col_width
+        return y - 35
+
+    y_pos = draw_section_header("STUDENT INFORMATION", y_pos)
+    y_pos = draw_field_row([("Full Name:", s.full_name), ("Date of Birth:", s.date_of_birth)], y_pos)
+    y_pos = draw_field_row([("Place of Birth:", s.place_of_birth), ("Admission Date:", s.admission_date)], y_pos)
+    y_pos = draw_field_row([("Class Admitted:", s.class_into_which_admission_is_sought), ("Student ID:", s.student_id)], y_pos)
+    y_pos -= 10
+    y_pos = draw_section_header("PREVIOUS EDUCATION", y_pos)
+    y_pos = draw_field_row([("Last School Attended:", s.last_school_attended)], y_pos)
+    y_pos = draw_field_row([("Reason for Leaving:", s.reason_for_leaving_last_school)], y_pos)
+    y_pos -= 10
+    y_pos = draw_section_header("PARENT / GUARDIAN INFORMATION", y_pos)
+    y_pos = draw_field_row([("Father's Name:", s.father_name), ("Occupation:", s.father_occupation)], y_pos)
+    y_pos = draw_field_row([("Father's Office Address:", s.father_office_address)], y_pos)
+    y_pos -= 5
+    y_pos = draw_field_row([("Mother's Name:", s.mother_name), ("Occupation:", s.mother_occupation)], y_pos)
+    y_pos = draw_field_row([("Mother's Office Address:", s.mother_office_address)], y_pos)
+    if s.guardian_name: y_pos = draw_field_row([("Guardian Name:", s.guardian_name)], y_pos)
+    y_pos -= 10
+    y_pos = draw_section_header("CONTACT DETAILS", y_pos)
+    y_pos = draw_field_row([("Residential Address:", s.residential_address)], y_pos)
+    y_pos = draw_field_row([("Emergency Contact:", s.contact_details)], y_pos)
+    y_pos -= 10
+    y_pos = draw_section_header("ADDITIONAL INFORMATION", y_pos)
+    y_pos = draw_field_row([("Siblings in School:", s.brothers_sisters_applicant)], y_pos)
+    y_pos = draw_field_row([("Medical Information:", s.medical_info)], y_pos)
+
+    c.setStrokeColor(colors.black)
+    y_pos -= 20
+    c.rect(margin, y_pos - 60, w - 2*margin, 60)
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(margin + 10, y_pos - 20, "FOR OFFICE USE ONLY")
+    c.setFont("Helvetica", 9)
+    c.drawString(margin + 10, y_pos - 45, "Status: " + (s.status or ""))
+    c.drawString(margin + 200, y_pos - 45, "Approved By: __________________")
+    c.drawString(margin + 400, y_pos - 45, "Date: __________________")
+
+    c.setFont("Helvetica-Oblique", 8)
+    c.drawCentredString(w/2, 30, "This is a computer generated document.")
+
+def draw_terms_page(c):
+    """Stamps the static terms page, laying it out only the first time per canvas."""
+    if not getattr(c, "_terms_form_ready", False):
+        w, h = A4
+        margin = 40
+        c.beginForm(TERMS_FORM)
+        text = c.beginText(margin, h - margin - 20)
+        text.setFont("Helvetica", 10)
+        text.setLeading(14)
+        for line in TERMS_CONTENT.split('\n'): text.textLine(line.strip())
+        c.drawText(text)
+        y_sig = h - margin - 400
+        c.line(margin, y_sig, margin + 200, y_sig)
+        c.drawString(margin, y_sig - 15, "Name of Parent/Guardian")
+        c.line(w - margin - 200, y_sig, w - margin, y_sig)
+        c.drawString(w - margin - 200, y_sig - 15, "Signature of Parent/Guardian")
+        c.endForm()
+        c._terms_form_ready = True
+    c.doForm(TERMS_FORM)
+
+def render_admission_form(s, fname, photo_path=None):
+    c = canvas.Canvas(fname, pagesize=A4)
+    c.setTitle(f"{s.full_name} ({s.student_id}) - Admission Form")
+    draw_student_page(c, s, photo_path, load_settings()["campus_name"])
+    c.showPage()
+    draw_terms_page(c)
+    c.save()
+    return fname
+
+def render_admission_batch(students, fname, workers=None):
+    """
+    Writes one combined PDF for many students. Missing print renditions, the
+    expensive part, are built in worker processes; the pages are then composed
+    in one canvas so the terms page is stored once and referenced by every form.
+    """
+    students = list(students)
+    photo_paths = [s.photo_path for s in students]
+    if any(photo_paths):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            photos = list(pool.map(print_path, photo_paths, chunksize=16))
+    else:
+        photos = [None] * len(students)
+
+    c = canvas.Canvas(fname, pagesize=A4)
+    c.setTitle(f"Admission Forms ({len(students)} students)")
+    campus = load_settings()["campus_name"]
+    for s, photo in zip(students, photos):
+        draw_student_page(c, s, photo, campus)
+        c.showPage()
+        draw_terms_page(c)
+        c.showPage()
+    c.save()
+    return fname
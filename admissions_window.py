@@ -2,9 +2,10 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import datetime
 import os
-import shutil
 import platform
 import subprocess
+import threading
+import queue
 
 # --- Import libraries for PDF and Images ---
 try:
@@ -23,19 +24,17 @@ except ImportError:
     messagebox.showerror("Error", "ReportLab library not found!\nPlease run: pip install reportlab")
 # --- End Imports ---
 
-from database import add_student, get_students, update_student, delete_student, get_student_by_id
+from database import (
+    CLASS_LIST, add_student, get_students, update_student, delete_student, get_student_by_id,
+    get_students_for_forms, set_student_photo, find_duplicate_students
+)
+from photo_cache import ingest_photo_async, preview_path, print_path
+from events import FrameCoalescer, insert_in_order
+from student_import import import_students
+from admission_forms import render_admission_form, render_admission_batch
 
 LOGO_PATH = "logo.png"
-
-# --- DEFINE CLASS LIST HERE ---
-CLASS_LIST = [
-    "Playgroup", 
-    "Nursery", 
-    "Prep",
-    "Grade 1", "Grade 2", "Grade 3", "Grade 4", "Grade 5",
-    "Grade 6", "Grade 7", "Grade 8", "Grade 9", "Grade 10",
-    "O-Level", "A-Level", "Hifz"
-]
+CHANGE_REFRESH_LIMIT = 500 # more student changes than this in one frame and the lists are simply reloaded
 
 # --- COLORS & FONTS ---
 COLOR_PRIMARY = "#003366"     # Navy Blue
@@ -113,6 +112,8 @@ class AdmissionsWindow:
         self._create_treeview()
 
         self.load_students() 
+        # Students added or edited anywhere (another window, an import, the photo ingester) are patched in
+        FrameCoalescer(self.master, self._on_student_changes, ("student",))
 
     def _setup_styles(self):
         style = ttk.Style()
@@ -285,23 +286,19 @@ class AdmissionsWindow:
         
         # Logic to load students when class is selected
         self.class_listbox.bind("<<ListboxSelect>>", self.load_students_by_class)
+        self.loaded_class = None
 
     def load_students_by_class(self, event):
         sel = self.class_listbox.curselection()
-        if not sel: return
-        
-        selected_class = self.class_listbox.get(sel[0])
+        if sel: self.loaded_class = self.class_listbox.get(sel[0])
+        if not self.loaded_class: return
         
         # Clear tree
         for item in self.class_tree.get_children(): 
             self.class_tree.delete(item)
         
-        # Get all students and filter
-        all_students = get_students("") 
-        
-        for s in all_students:
-            if s[4] == selected_class: # Check class match
-                    self.class_tree.insert("", tk.END, values=(s[0], s[1], s[7], s[15]))
+        for s in get_students(class_name=self.loaded_class):
+            self.class_tree.insert("", tk.END, iid=s.student_id, values=(s.student_id, s.full_name, s.father_name, s.contact_details))
 
     def _create_treeview(self):
         # Title for list
@@ -347,9 +344,11 @@ class AdmissionsWindow:
         # Left aligned buttons
         make_btn(btn_bar, "New / Clear", self.clear_form, "#757575").pack(side=tk.LEFT, padx=(0, 5))
         make_btn(btn_bar, "Delete", self.delete_student, COLOR_DANGER).pack(side=tk.LEFT, padx=5)
+        make_btn(btn_bar, "Import", self.import_spreadsheet, "#607D8B").pack(side=tk.LEFT, padx=5)
         
         # Right aligned buttons
-        make_btn(btn_bar, "Print Form", self.print_form, "#2196F3").pack(side=tk.RIGHT, padx=(5, 0))
+        make_btn(btn_bar, "Batch Print", self.open_batch_print, "#607D8B").pack(side=tk.RIGHT, padx=(5, 0))
+        make_btn(btn_bar, "Print Form", self.print_form, "#2196F3").pack(side=tk.RIGHT, padx=5)
         make_btn(btn_bar, "Save Student", self.save_student, COLOR_ACCENT).pack(side=tk.RIGHT, padx=5)
 
     # --- LOGIC FUNCTIONS ---
@@ -380,7 +379,25 @@ class AdmissionsWindow:
         for i in self.tree.get_children(): self.tree.delete(i)
         term = self.search_entry.get()
         for s in get_students(term):
-            self.tree.insert("", tk.END, values=(s[0], s[1], s[4], s[7], s[15]))
+            self.tree.insert("", tk.END, iid=s.student_id, values=(s.student_id, s.full_name, s.class_name, s.father_name, s.contact_details))
+
+    def _on_student_changes(self, changes):
+        """Change bus handler: replaces just the rows of the students that changed."""
+        if changes is None or len(changes) > CHANGE_REFRESH_LIMIT:
+            self.load_students()
+            if self.loaded_class: self.load_students_by_class(None)
+            return
+        ids = {c.entity_id for c in changes}
+        for sid in ids:
+            for tree in (self.tree, self.class_tree):
+                if tree.exists(sid): tree.delete(sid)
+        term = self.search_entry.get().lower()
+        by_id = lambda v: int(v[0])
+        for s in get_students(student_ids=ids):
+            if term in s.full_name.lower():
+                insert_in_order(self.tree, s.student_id, (s.student_id, s.full_name, s.class_name, s.father_name, s.contact_details), by_id)
+            if s.class_name == self.loaded_class:
+                insert_in_order(self.class_tree, s.student_id, (s.student_id, s.full_name, s.father_name, s.contact_details), by_id)
 
     def save_student(self):
         d = self.entries
@@ -396,28 +413,28 @@ class AdmissionsWindow:
             messagebox.showerror("Error", "Name and Class are mandatory.")
             return
 
+        # Warn before admitting a child who may already be on the register
+        dups = find_duplicate_students(data_list[0], data_list[6], data_list[1], data_list[14], exclude_id=self.current_student_id)
+        if dups:
+            lines = [f"ID {sid}: {name} S/O {father} ({dob or '-'}){' - exact match' if exact else ''}" for sid, name, father, dob, _, _, exact in dups[:5]]
+            if not messagebox.askyesno("Possible Duplicate", "This student may already be registered:\n\n" + "\n".join(lines) + "\n\nSave anyway?"):
+                return
+
+        # Photos are normalized and stored by the background ingester, which
+        # writes the final photo_path once the renditions are ready
+        old_photo = None
         if self.current_student_id:
-            old_data = get_student_by_id(self.current_student_id)
-            final_photo = old_data[20]
-            if self.current_photo_path and self.current_photo_path != final_photo:
-                os.makedirs("student_photos", exist_ok=True)
-                ext = os.path.splitext(self.current_photo_path)[1]
-                final_photo = f"student_photos/student_{self.current_student_id}{ext}"
-                shutil.copy(self.current_photo_path, final_photo)
-            update_student(self.current_student_id, *data_list, final_photo)
+            student_id = self.current_student_id
+            old_photo = get_student_by_id(student_id).photo_path
+            update_student(student_id, *data_list, old_photo)
             messagebox.showinfo("Success", "Student Updated")
         else:
-            new_id = add_student(*data_list, None)
-            if self.current_photo_path:
-                os.makedirs("student_photos", exist_ok=True)
-                ext = os.path.splitext(self.current_photo_path)[1]
-                final_photo = f"student_photos/student_{new_id}{ext}"
-                shutil.copy(self.current_photo_path, final_photo)
-                update_student(new_id, *data_list, final_photo)
+            student_id = add_student(*data_list, None)
             messagebox.showinfo("Success", "Student Added")
+        if self.current_photo_path and self.current_photo_path != old_photo:
+            ingest_photo_async(self.current_photo_path, lambda stored, sid=student_id: set_student_photo(sid, stored))
             
-        self.clear_form()
-        self.load_students()
+        self.clear_form() # the list picks the change up from the change bus
 
     def edit_student(self, event=None):
         if not self.current_student_id: return
@@ -425,31 +442,39 @@ class AdmissionsWindow:
         if not s: return
         
         self.clear_form()
-        self.current_student_id = s[0]
-        
-        key_order = ['full_name', 'date_of_birth', 'place_of_birth', 'class', 'last_school', 'reason_for_leaving',
-                     'father_name', 'father_occupation', 'father_address', 'mother_name', 'mother_occupation', 'mother_address',
-                     'guardian', 'res_address', 'contact', 'siblings', 'medical', 'adm_date']
-        
-        for i, key in enumerate(key_order):
+        self.current_student_id = s.student_id
+        
+        # form entry -> Student field
+        key_fields = [('full_name', 'full_name'), ('date_of_birth', 'date_of_birth'), ('place_of_birth', 'place_of_birth'),
+                      ('class', 'class_into_which_admission_is_sought'), ('last_school', 'last_school_attended'),
+                      ('reason_for_leaving', 'reason_for_leaving_last_school'), ('father_name', 'father_name'),
+                      ('father_occupation', 'father_occupation'), ('father_address', 'father_office_address'),
+                      ('mother_name', 'mother_name'), ('mother_occupation', 'mother_occupation'), ('mother_address', 'mother_office_address'),
+                      ('guardian', 'guardian_name'), ('res_address', 'residential_address'), ('contact', 'contact_details'),
+                      ('siblings', 'brothers_sisters_applicant'), ('medical', 'medical_info'), ('adm_date', 'admission_date')]
+        
+        for key, field in key_fields:
+            value = getattr(s, field) or ""
             if key == 'class':
-                 self.entries[key].set(s[i+1] or "")
+                 self.entries[key].set(value)
             else:
                  self.entries[key].delete(0, tk.END)
-                 self.entries[key].insert(0, s[i+1] or "")
+                 self.entries[key].insert(0, value)
             
-        self.status_var.set(s[19] or "Active")
+        self.status_var.set(s.status or "Active")
         
-        photo_path = s[20]
+        photo_path = s.photo_path
         if photo_path and os.path.exists(photo_path):
             self.current_photo_path = photo_path
-            self.show_photo(photo_path)
+            self.show_photo(preview_path(photo_path))
 
     def delete_student(self):
         if self.current_student_id and messagebox.askyesno("Confirm", "Delete this student?"):
-            delete_student(self.current_student_id)
+            try:
+                delete_student(self.current_student_id)
+            except Exception as e:
+                return messagebox.showerror("Error", f"Could not delete student: {e}")
             self.clear_form()
-            self.load_students()
 
     def clear_form(self):
         self.current_student_id = None
@@ -466,136 +491,72 @@ class AdmissionsWindow:
             messagebox.showwarning("Select", "Please select a student to print.")
             return
         s = get_student_by_id(self.current_student_id)
-        fname = f"{s[1].replace(' ', '_')}_AdmissionForm.pdf"
+        fname = f"{s.full_name.replace(' ', '_')}_AdmissionForm.pdf"
         try:
-            c = canvas.Canvas(fname, pagesize=A4)
-            c.setTitle(f"{s[1]} ({s[0]}) - Admission Form")
-            w, h = A4
-            margin = 40
-            try:
-                if os.path.exists(LOGO_PATH):
-                    c.drawImage(LOGO_PATH, margin, h - 100, width=80, height=80, mask='auto', preserveAspectRatio=True)
-            except: pass
-            
-            c.setFont("Helvetica-Bold", 18)
-            c.setFillColorRGB(0, 0.2, 0.4)
-            c.drawString(margin + 100, h - 50, "INTERNATIONAL ISLAMIC UNIVERSITY")
-            c.drawString(margin + 100, h - 75, "ISLAMABAD SCHOOLS")
-            c.setFont("Helvetica", 12)
-            c.setFillColor(colors.black)
-            c.drawString(margin + 100, h - 95, "Ali Pur Chatha Campus")
-            c.setFont("Helvetica-Oblique", 10)
-            c.drawString(margin + 100, h - 110, "Student Admission Form")
-            
-            photo_x = w - margin - 100
-            photo_y = h - 140
-            c.rect(photo_x, photo_y, 100, 120)
-            if s[20] and os.path.exists(s[20]):
-                try: c.drawImage(s[20], photo_x, photo_y, width=100, height=120, preserveAspectRatio=True)
-                except: c.drawString(photo_x + 10, photo_y + 60, "Photo Error")
-            else:
-                c.setFont("Helvetica", 8)
-                c.drawCentredString(photo_x + 50, photo_y + 60, "Passport Size Photo")
-
-            y_pos = h - 160
-            def draw_section_header(title, y):
-                c.setFillColorRGB(0.9, 0.9, 0.9)
-                c.rect(margin, y, w - 2*margin, 20, fill=1, stroke=0)
-                c.setFillColor(colors.black)
-                c.setFont("Helvetica-Bold", 11)
-                c.drawString(margin + 10, y + 6, title)
-                return y - 25
-
-            def draw_field_row(labels_values, y):
-                x_curr = margin
-                col_width = (w - 2*margin) / len(labels_values)
-                for lbl, val in labels_values:
-                    c.setFont("Helvetica-Bold", 9)
-                    c.drawString(x_curr, y, lbl)
-                    c.setFont("Helvetica", 10)
-                    val_str = str(val) if val else ""
-                    c.drawString(x_curr, y - 15, val_str)
-                    c.setStrokeColor(colors.lightgrey)
-                    c.line(x_curr, y - 18, x_curr + col_width - 20, y - 18)
-                    x_curr += col_width
-                return y - 35
-
-            y_pos = draw_section_header("STUDENT INFORMATION", y_pos)
-            y_pos = draw_field_row([("Full Name:", s[1]), ("Date of Birth:", s[2])], y_pos)
-            y_pos = draw_field_row([("Place of Birth:", s[3]), ("Admission Date:", s[18])], y_pos)
-            y_pos = draw_field_row([("Class Admitted:", s[4]), ("Student ID:", s[0])], y_pos)
-            y_pos -= 10
-            y_pos = draw_section_header("PREVIOUS EDUCATION", y_pos)
-            y_pos = draw_field_row([("Last School Attended:", s[5])], y_pos)
-            y_pos = draw_field_row([("Reason for Leaving:", s[6])], y_pos)
-            y_pos -= 10
-            y_pos = draw_section_header("PARENT / GUARDIAN INFORMATION", y_pos)
-            y_pos = draw_field_row([("Father's Name:", s[7]), ("Occupation:", s[8])], y_pos)
-            y_pos = draw_field_row([("Father's Office Address:", s[9])], y_pos)
-            y_pos -= 5
-            y_pos = draw_field_row([("Mother's Name:", s[10]), ("Occupation:", s[11])], y_pos)
-            y_pos = draw_field_row([("Mother's Office Address:", s[12])], y_pos)
-            if s[13]: y_pos = draw_field_row([("Guardian Name:", s[13])], y_pos)
-            y_pos -= 10
-            y_pos = draw_section_header("CONTACT DETAILS", y_pos)
-            y_pos = draw_field_row([("Residential Address:", s[14])], y_pos)
-            y_pos = draw_field_row([("Emergency Contact:", s[15])], y_pos)
-            y_pos -= 10
-            y_pos = draw_section_header("ADDITIONAL INFORMATION", y_pos)
-            y_pos = draw_field_row([("Siblings in School:", s[16])], y_pos)
-            y_pos = draw_field_row([("Medical Information:", s[17])], y_pos)
-
-            c.setStrokeColor(colors.black)
-            y_pos -= 20
-            c.rect(margin, y_pos - 60, w - 2*margin, 60)
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(margin + 10, y_pos - 20, "FOR OFFICE USE ONLY")
-            c.setFont("Helvetica", 9)
-            c.drawString(margin + 10, y_pos - 45, "Status: " + (s[19] or ""))
-            c.drawString(margin + 200, y_pos - 45, "Approved By: __________________")
-            c.drawString(margin + 400, y_pos - 45, "Date: __________________")
-
-            c.setFont("Helvetica-Oblique", 8)
-            c.drawCentredString(w/2, 30, "This is a computer generated document.")
-
-            c.showPage() 
-            text = c.beginText(margin, h - margin - 20)
-            text.setFont("Helvetica", 10)
-            text.setLeading(14)
-            terms_content = """
-            TERMS & CONDITIONS
-            
-            Note: Parents are requested to carefully read the following before signing the form.
-            
-            1. Admission Fee Challan will be issued by the school. No cash payment will be accepted.
-            2. Parents are requested to submit copies of admission fee challan in the school.
-            3. Fees are charged on monthly basis, except at the time of admission or summer vacations (i.e. June & July).
-            4. Monthly tuition fee is payable in advance by the 10th of each month. After due date a daily fine of Rs. 10/- will be charged.
-            5. Final date of payment of monthly tuition fee is the last day of each month thereafter name of the student will be struck off.
-            6. Original school leaving certificate will only be issued against written request.
-            7. School management takes utmost care about safety of all the children. School management shall take no responsibility in case of any accident.
-            8. Parents are requested to cooperate with the school management and admissions are made on the basis of merit.
-            9. In case, the child remains absent from school for consecutive five days without intimation, the name of the child will be struck off.
-            
-            CERTIFICATE FROM THE PARENTS
-            
-            1. I certified that the particulars, especially date of birth given is correct to the best of my knowledge or belief.
-            2. I have read and understood above instructions, rules about payment of fees and will abide by them.
-            3. I understand that the admission will be provisional.
-            4. I understand that the annual re-admission of this section will be determined through periodical evaluation by the Headmistress.
-            """
-            for line in terms_content.split('\n'): text.textLine(line.strip())
-            c.drawText(text)
-            y_sig = h - margin - 400
-            c.line(margin, y_sig, margin + 200, y_sig)
-            c.drawString(margin, y_sig - 15, "Name of Parent/Guardian")
-            c.line(w - margin - 200, y_sig, w - margin, y_sig)
-            c.drawString(w - margin - 200, y_sig - 15, "Signature of Parent/Guardian")
-            c.save()
-            
-            try: 
-                if platform.system() == "Windows": os.startfile(fname)
-                else: subprocess.call(["open", fname])
-            except: pass
+            render_admission_form(s, fname, print_path(s.photo_path))
+            self._open_file(fname)
         except Exception as e:
-            messagebox.showerror("PDF Error", f"Could not create PDF: {e}")
\ No newline at end of file
+            messagebox.showerror("PDF Error", f"Could not create PDF: {e}")
+
+    def _open_file(self, fname):
+        try: 
+            if platform.system() == "Windows": os.startfile(fname)
+            else: subprocess.call(["open", fname])
+        except: pass
+
+    def open_batch_print(self):
+        top = tk.Toplevel(self.master); top.title("Batch Print Admission Forms")
+        top.configure(bg=COLOR_WHITE)
+        frm = tk.Frame(top, bg=COLOR_WHITE, padx=20, pady=20); frm.pack(fill=tk.BOTH, expand=True)
+        tk.Label(frm, text="Class (blank = all):", bg=COLOR_WHITE).grid(row=0, column=0, sticky="w", pady=5)
+        cls_cb = ttk.Combobox(frm, values=[""] + CLASS_LIST, width=20); cls_cb.grid(row=0, column=1, pady=5)
+        tk.Label(frm, text="Admitted from (YYYY-MM-DD):", bg=COLOR_WHITE).grid(row=1, column=0, sticky="w", pady=5)
+        from_e = ttk.Entry(frm, width=22); from_e.grid(row=1, column=1, pady=5)
+        tk.Label(frm, text="Admitted to (YYYY-MM-DD):", bg=COLOR_WHITE).grid(row=2, column=0, sticky="w", pady=5)
+        to_e = ttk.Entry(frm, width=22); to_e.grid(row=2, column=1, pady=5)
+        status = tk.Label(frm, text="", bg=COLOR_WHITE, fg="#666"); status.grid(row=4, column=0, columnspan=2)
+
+        def run():
+            students = get_students_for_forms(cls_cb.get() or None, from_e.get().strip() or None, to_e.get().strip() or None)
+            if not students: return messagebox.showinfo("Batch Print", "No students match.", parent=top)
+            label = (cls_cb.get() or "All").replace(' ', '_')
+            fname = f"Admission_Forms_{label}_{datetime.date.today().strftime('%Y%m%d')}.pdf"
+            status.config(text=f"Rendering {len(students)} forms...")
+            results = queue.Queue()
+            def worker():
+                try: results.put((render_admission_batch(students, fname), None))
+                except Exception as e: results.put((None, e))
+            threading.Thread(target=worker, daemon=True).start()
+            def poll():
+                try: result, error = results.get_nowait()
+                except queue.Empty: return self.master.after(100, poll)
+                status.config(text="")
+                if error: return messagebox.showerror("PDF Error", f"Could not create PDF: {error}", parent=top)
+                top.destroy()
+                self._open_file(result)
+            self.master.after(100, poll)
+
+        make = tk.Button(frm, text="Generate Combined PDF", command=run, bg=COLOR_ACCENT, fg="white", font=("Segoe UI", 10, "bold"), relief=tk.FLAT)
+        make.grid(row=3, column=0, columnspan=2, pady=15)
+
+    def import_spreadsheet(self):
+        f = filedialog.askopenfilename(filetypes=[("Spreadsheets", "*.csv *.xlsx")])
+        if not f: return
+        resume = os.path.exists(f + ".import-progress.json") and messagebox.askyesno(
+            "Import", "This file was imported before.\nContinue after the last imported row?")
+        results = queue.Queue()
+        def worker():
+            try: results.put((import_students(f, resume=resume), None))
+            except Exception as e: results.put((None, e))
+        threading.Thread(target=worker, daemon=True).start()
+        def poll():
+            try: summary, error = results.get_nowait()
+            except queue.Empty: return self.master.after(200, poll)
+            if error: return messagebox.showerror("Import Error", str(error))
+            msg = f"Imported {summary['imported']} students."
+            if summary["errors"]: msg += f"\n{summary['errors']} rows rejected."
+            if summary["warnings"]: msg += f"\n{summary['warnings']} imported rows look like existing students."
+            if summary["error_report"]: msg += f"\nSee:\n{summary['error_report']}"
+            messagebox.showinfo("Import", msg)
+            self.load_students()
+        self.master.after(200, poll)
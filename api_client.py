@@ -0,0 +1,90 @@
+"""
+Client side of api_server.py. When "api_url" (with the server's "api_token")
+is set in the settings, install() swaps the database (and backup) functions
+the windows use for calls to the server, so this terminal never opens
+school.db itself. Row
+types come back as the same namedtuples, and an exception raised by the
+server function is raised here with the same type where that type is a
+builtin or sqlite3 exception (ApiError otherwise).
+"""
+import builtins
+import http.client
+import json
+import sqlite3
+import threading
+import urllib.parse
+
+import database
+import backup
+from events import notify_changes
+from api_server import READ_OPERATIONS, WRITE_OPERATIONS, SOLO_OPERATIONS, BACKUP_OPERATIONS, encode, decode
+
+TIMEOUT = 300 # seconds; bulk generation and snapshots can take a while
+TOKEN = "" # shared secret sent with every call; set by install()
+
+class ApiError(RuntimeError):
+    pass
+
+# One keep-alive connection per thread
+_local = threading.local()
+
+def _connection(url):
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "url", None) != url:
+        parts = urllib.parse.urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=TIMEOUT)
+        _local.conn, _local.url = conn, url
+    return conn
+
+def call(url, name, *args, **kwargs):
+    """Runs database.<name>(*args, **kwargs) on the server and returns its result."""
+    body = json.dumps({"args": encode(args), "kwargs": encode(kwargs)})
+    for attempt in (1, 2):
+        conn = _connection(url)
+        try:
+            conn.request("POST", f"/call/{name}", body, {"Content-Type": "application/json", "Authorization": f"Bearer {TOKEN}"})
+            response = conn.getresponse()
+            payload = json.loads(response.read())
+            break
+        except (ConnectionError, http.client.HTTPException):
+            # The server dropped an idle keep-alive connection; reconnect once
+            conn.close()
+            _local.conn = None
+            if attempt == 2: raise
+    if "error" in payload:
+        error = getattr(sqlite3, payload["error"], None) or getattr(builtins, payload["error"], None)
+        if not (isinstance(error, type) and issubclass(error, Exception)):
+            raise ApiError(f"{payload['error']}: {payload['message']}")
+        raise error(payload["message"])
+    return decode(payload["result"])
+
+def health(url):
+    conn = _connection(url)
+    conn.request("GET", "/health", headers={"Authorization": f"Bearer {TOKEN}"})
+    return json.loads(conn.getresponse().read())
+
+def _remote(url, name, writes=False):
+    def remote(*args, **kwargs):
+        result = call(url, name, *args, **kwargs)
+        if writes: notify_changes() # as database._changed() does after a local write
+        return result
+    remote.__name__ = name
+    return remote
+
+def install(url, token=""):
+    """
+    Routes the served functions through the API at url, authenticating with
+    token. Must run before the windows are imported, since they bind the
+    functions at import time. Returns False (and changes nothing) when url is empty.
+    """
+    global TOKEN
+    if not url:
+        return False
+    TOKEN = token
+    for name in READ_OPERATIONS:
+        setattr(database, name, _remote(url, name))
+    for name in WRITE_OPERATIONS + SOLO_OPERATIONS:
+        setattr(database, name, _remote(url, name, writes=True))
+    for name in BACKUP_OPERATIONS:
+        setattr(backup, name, _remote(url, name))
+    return True
@@ -0,0 +1,294 @@
+"""
+Local HTTP/JSON API over the database functions, so several terminals share
+one school.db through a single process instead of each opening the file
+(which is what produces "database is locked" and torn reads on a network
+drive). Run it on the machine that holds the database:
+
+    python manage.py serve-api [--port 8765] [--readers 4]
+
+and set "api_url" (e.g. http://127.0.0.1:8765) and the server's "api_token"
+in fee_settings.json on each terminal; see api_client.py. Every request must
+carry the token as "Authorization: Bearer <token>".
+
+    POST /call/<function>   {"args": [...], "kwargs": {...}} -> {"result": ...}
+                            or {"error": "<exception type>", "message": "..."}
+    GET  /health            counters
+
+Password changes are not served; they are made on the server machine.
+
+Reads run concurrently on a pool of threads that each keep one connection
+open. Writes go through one queue to a single writer thread: every write
+waiting when the writer comes round is run in the same transaction, each
+inside its own savepoint, and the group is committed once. Bulk operations
+that commit in chunks or take a safety snapshot run on the writer thread
+alone, between groups. The database is switched to WAL so readers never
+wait for the writer.
+"""
+import asyncio
+import hmac
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import backup
+
+HOST = "127.0.0.1"
+PORT = 8765
+READ_POOL_SIZE = 4
+GROUP_LIMIT = 256 # writes committed together at most
+WRITE_QUEUE_LIMIT = 1000 # queued writes before callers wait
+BUSY_TIMEOUT_MS = 5000
+
+READ_OPERATIONS = (
+    "check_login", "get_students", "get_active_students", "get_students_for_forms", "get_student_by_id",
+    "find_duplicate_students", "find_duplicate_students_bulk", "get_challans_by_student_id", "get_challans_details",
+    "get_challan_details_by_id", "get_class_challans", "get_unpaid_challans", "get_student_balance",
+    "get_payments_by_student_id", "get_fee_plan", "get_discount_rules", "get_family_members",
+    "get_family_vouchers_for_challans", "get_challan_family_voucher", "get_family_voucher_details",
+    "get_student_fee_summary", "iter_classwise_defaulters", "get_classwise_defaulter_list", "iter_classwise_postings",
+    "get_classwise_posting_sheet", "get_collection_summary", "get_monthly_collection", "get_yearly_collection",
+    "get_total_collected", "iter_receivables_aging", "get_receivables_aging", "get_new_admissions_list",
+    "get_struck_off_list", "iter_enrollment_by_class", "get_promotion_candidates", "get_passed_out_students",
+    "get_change_seq", "get_changes_since",
+)
+# Single-statement-group writes, safe to share a transaction
+WRITE_OPERATIONS = (
+    "add_student", "update_student", "set_student_photo", "delete_student", "create_challan", "pay_challan",
+    "allocate_payment", "pay_family_voucher", "set_fee_plan_item", "delete_fee_plan_item",
+    "add_discount_rule", "delete_discount_rule",
+)
+# Commit on their own (chunks, snapshots, VACUUM): run alone on the writer thread
+SOLO_OPERATIONS = (
+    "promote_students", "create_challans_bulk", "allocate_payments_bulk", "accrue_fines",
+    "archive_paid_challans", "rebuild_families", "rebuild_student_balances", "rebuild_collection_daily",
+    "prune_change_log", "import_students_batch",
+)
+# Served from backup.py; the page copy reads like any other query
+BACKUP_OPERATIONS = ("take_snapshot", "ensure_daily_snapshot")
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 500: "Internal Server Error"}
+
+# --- JSON encoding of results (shared with api_client.py) ---
+
+def encode(value):
+    """Turns a result into JSON-safe data, keeping row types and non-string dict keys."""
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return {"__row__": type(value).__name__, "values": [encode(v) for v in value]}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: encode(v) for k, v in value.items()}
+        return {"__items__": [[encode(k), encode(v)] for k, v in value.items()]}
+    return value
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if isinstance(value, dict):
+        if "__row__" in value:
+            return getattr(database, value["__row__"])._make(decode(v) for v in value["values"])
+        if "__items__" in value:
+            return {(tuple(k) if isinstance(k, list) else k): decode(v) for k, v in (decode(i) for i in value["__items__"])}
+        return {k: decode(v) for k, v in value.items()}
+    return value
+
+def _error(e):
+    return {"error": type(e).__name__, "message": str(e)}
+
+# --- Pooled connections ---
+
+def _open(factory):
+    conn = sqlite3.connect(database.DB_PATH, factory=factory, timeout=BUSY_TIMEOUT_MS / 1000)
+    sqlite3.Cursor(conn).execute("PRAGMA foreign_keys = 1")
+    return conn
+
+class PooledConnection(sqlite3.Connection):
+    """A connection that outlives close(), for handing to database.pin_connection()."""
+    def close(self):
+        # Kept open for the next request; undo what connect_history() set up instead
+        if self.in_transaction: self.rollback()
+        cursor = sqlite3.Cursor(self)
+        for (name,) in cursor.execute("SELECT name FROM sqlite_temp_master WHERE type = 'view'").fetchall():
+            cursor.execute(f"DROP VIEW temp.{name}")
+        for _, name, _ in cursor.execute("PRAGMA database_list").fetchall():
+            if name not in ("main", "temp"): cursor.execute(f"DETACH DATABASE {name}")
+
+class _GroupCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        # The writer owns the transaction; a function's own BEGIN IMMEDIATE joins it
+        if sql.lstrip()[:5].upper() == "BEGIN":
+            return self
+        return super().execute(sql, parameters)
+
+class _WriterConnection(sqlite3.Connection):
+    def cursor(self, factory=_GroupCursor):
+        return super().cursor(factory)
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    def commit(self): pass # committed once per group
+    def rollback(self):
+        sqlite3.Cursor(self).execute("ROLLBACK TO operation")
+    def close(self): pass
+
+def _start_reader():
+    database.pin_connection(_open(PooledConnection))
+
+def _start_writer():
+    conn = _open(_WriterConnection)
+    sqlite3.Cursor(conn).execute("PRAGMA journal_mode = WAL")
+    database.pin_connection(conn)
+
+def _run_read(fn, args, kwargs):
+    try:
+        result = fn(*args, **kwargs)
+        if hasattr(result, "__next__"): result = list(result) # iter_* report generators
+        payload = {"result": encode(result)}
+    except Exception as e:
+        payload = _error(e)
+    finally:
+        database.connect_db().close()
+    return json.dumps(payload).encode()
+
+def _run_group(calls):
+    """Runs the writes in one transaction, each in a savepoint. Returns [(ok, result or exception)]."""
+    conn = database.connect_db()
+    cursor = sqlite3.Cursor(conn)
+    cursor.execute("BEGIN IMMEDIATE")
+    results = []
+    for fn, args, kwargs in calls:
+        cursor.execute("SAVEPOINT operation")
+        try:
+            results.append((True, fn(*args, **kwargs)))
+        except Exception as e:
+            conn.rollback()
+            results.append((False, e))
+        cursor.execute("RELEASE operation")
+    try:
+        sqlite3.Connection.commit(conn)
+    except sqlite3.Error as e:
+        sqlite3.Connection.rollback(conn)
+        results = [(False, e)] * len(results)
+    return results
+
+def _run_solo(fn, args, kwargs):
+    conn = database.connect_db()
+    database.pin_connection(None) # bulk operations open and commit their own connection
+    try:
+        return [(True, fn(*args, **kwargs))]
+    except Exception as e:
+        return [(False, e)]
+    finally:
+        database.pin_connection(conn)
+
+class ApiServer:
+    def __init__(self, token, host=HOST, port=PORT, readers=READ_POOL_SIZE):
+        if not token:
+            raise ValueError("The API server needs a token (api_token in the settings).")
+        self.token = token
+        self.host, self.port = host, port
+        self.readers = ThreadPoolExecutor(readers, "api-read", initializer=_start_reader)
+        self.writer = ThreadPoolExecutor(1, "api-write", initializer=_start_writer)
+        self.operations = {name: (getattr(database, name), "read") for name in READ_OPERATIONS}
+        self.operations.update({name: (getattr(database, name), "write") for name in WRITE_OPERATIONS})
+        self.operations.update({name: (getattr(database, name), "solo") for name in SOLO_OPERATIONS})
+        self.operations.update({name: (getattr(backup, name), "read") for name in BACKUP_OPERATIONS})
+        self.stats = {"reads": 0, "writes": 0, "groups": 0, "largest_group": 0}
+        self.queue = None
+        self.server = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(WRITE_QUEUE_LIMIT)
+        self.writer_task = asyncio.create_task(self._write_loop())
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.writer_task.cancel()
+        self.readers.shutdown()
+        self.writer.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < GROUP_LIMIT and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            group = []
+            for item in batch + [None]:
+                if item is None or item[0] == "solo":
+                    if group:
+                        results = await loop.run_in_executor(self.writer, _run_group, [call for _, call, _ in group])
+                        self.stats["groups"] += 1
+                        self.stats["largest_group"] = max(self.stats["largest_group"], len(group))
+                        for (_, _, future), result in zip(group, results):
+                            if not future.done(): future.set_result(result)
+                        group = []
+                    if item:
+                        [result] = await loop.run_in_executor(self.writer, _run_solo, *item[1])
+                        if not item[2].done(): item[2].set_result(result)
+                else:
+                    group.append(item)
+
+    async def call(self, name, args, kwargs):
+        """Runs one operation. Returns the JSON response body (bytes)."""
+        fn, kind = self.operations[name]
+        if kind == "read":
+            self.stats["reads"] += 1
+            return await asyncio.get_running_loop().run_in_executor(self.readers, _run_read, fn, args, kwargs)
+        self.stats["writes"] += 1
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, (fn, args, kwargs), future))
+        ok, result = await future
+        return json.dumps({"result": encode(result)} if ok else _error(result)).encode()
+
+    async def _dispatch(self, method, path, body, authorization=""):
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {self.token}".encode()):
+            return 401, json.dumps({"error": "PermissionError", "message": "missing or wrong API token"}).encode()
+        if method == "GET" and path == "/health":
+            return 200, json.dumps(dict(self.stats, queued=self.queue.qsize())).encode()
+        name = path[len("/call/"):] if method == "POST" and path.startswith("/call/") else None
+        if name not in self.operations:
+            return 404, json.dumps({"error": "NotFound", "message": f"{method} {path}"}).encode()
+        try:
+            request = json.loads(body or b"{}")
+            args, kwargs = decode(request.get("args", [])), decode(request.get("kwargs", {}))
+        except (ValueError, AttributeError) as e:
+            return 400, json.dumps(_error(e)).encode()
+        body = await self.call(name, args, kwargs)
+        return (500 if body.startswith(b'{"error"') else 200), body
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip(): break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip(): break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                status, data = await self._dispatch(method, path, body, headers.get("authorization", ""))
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close": break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+def serve(token, host=HOST, port=PORT, readers=READ_POOL_SIZE):
+    """Runs the API server until interrupted."""
+    asyncio.run(ApiServer(token, host, port, readers).serve_forever())
@@ -0,0 +1,200 @@
+"""
+Online backups of school.db. Snapshots are taken with the SQLite online
+backup API a few pages at a time, pausing between steps so the application
+can keep writing. Each snapshot is integrity-checked, gzip-compressed and
+stored with a SHA-256 sidecar as
+
+    backups/school_<YYYY-MM-DD_HHMMSS>_<label>.db.gz
+
+Only the newest snapshots of each label are kept (see rotate_snapshots).
+snapshot_before() is called by bulk operations (voucher generation,
+promotion, payment reconciliation) so any of them can be rolled back.
+Archival moves settled history out of school.db, so every archive database
+it writes to is snapshotted afterwards under the label archive-<year>;
+restore_snapshot puts those back in archive/.
+"""
+import datetime
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import database
+from settings import load_settings, save_settings
+
+BACKUP_DIR = "backups"
+PAGES_PER_STEP = 64 # pages copied per step (4 KB each by default)
+STEP_SLEEP = 0.01 # seconds between steps, in which writers can take the lock
+PRE_OPERATION_KEEP = 10 # pre-<operation> snapshots kept per operation
+
+_NAME_RE = re.compile(r"^school_(\d{4}-\d{2}-\d{2}_\d{6})(?:-(\d+))?_([\w-]+)\.db\.gz$")
+_ARCHIVE_LABEL_RE = re.compile(r"^archive-(\d{4})$")
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _integrity(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+def _backup_to(dest_path, progress=None, source=None):
+    src = sqlite3.connect(source) if source else database.connect_db()
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                   progress=(lambda status, remaining, total: progress(total - remaining, total)) if progress else None)
+    finally:
+        dest.close()
+        src.close()
+
+def _finish(raw_path, final_path, label, keep):
+    """Checks, compresses and rotates one raw snapshot file."""
+    try:
+        result = _integrity(raw_path)
+        if result != "ok":
+            raise RuntimeError(f"Snapshot failed integrity check: {result}")
+        tmp = final_path + ".tmp"
+        with open(raw_path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dest:
+            shutil.copyfileobj(src, dest, 1 << 20)
+        os.replace(tmp, final_path)
+        with open(final_path + ".sha256", "w") as f:
+            f.write(f"{_sha256(final_path)}  {os.path.basename(final_path)}\n")
+    finally:
+        os.remove(raw_path)
+    rotate_snapshots(keep, label)
+
+def take_snapshot(label="manual", keep=None, progress=None, background=False, source=None):
+    """
+    Writes a compressed, verified snapshot and returns its path. progress(done,
+    total) is called after each step. With background=True only the page copy
+    runs on the caller's thread; checking and compression finish on a worker.
+    source is the database file to copy (default: the live database).
+    """
+    settings = load_settings()
+    folder = settings.get("backup_dir") or BACKUP_DIR
+    keep = keep or int(settings.get("backup_keep") or 14)
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    final_path = os.path.join(folder, f"school_{stamp}_{label}.db.gz")
+    n = 1
+    while os.path.exists(final_path): # two snapshots within the same second
+        n += 1
+        final_path = os.path.join(folder, f"school_{stamp}-{n}_{label}.db.gz")
+    fd, raw_path = tempfile.mkstemp(suffix=".db", dir=folder)
+    os.close(fd)
+    try:
+        _backup_to(raw_path, progress, source)
+    except Exception:
+        os.remove(raw_path)
+        raise
+    if background:
+        threading.Thread(target=_finish, args=(raw_path, final_path, label, keep), name="snapshot-finish").start()
+    else:
+        _finish(raw_path, final_path, label, keep)
+    return final_path
+
+def snapshot_before(operation):
+    """Safety snapshot taken automatically before a bulk operation."""
+    return take_snapshot(f"pre-{operation}", keep=PRE_OPERATION_KEEP, background=True)
+
+def snapshot_archives(years):
+    """Snapshots the archive databases of the given years (after an archival run). Returns their paths."""
+    return [take_snapshot(f"archive-{year}", source=database.archive_path(year)) for year in sorted(years)]
+
+def ensure_daily_snapshot():
+    """Takes today's 'daily' snapshot unless one exists. Returns its path, or None if already done."""
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    settings = load_settings()
+    if settings.get("backup_last_run") == today:
+        return None
+    path = take_snapshot("daily")
+    settings = load_settings()
+    settings["backup_last_run"] = today
+    save_settings(settings)
+    return path
+
+def list_snapshots(folder=None):
+    """Returns [(path, label, taken_at, size)], newest first."""
+    folder = folder or load_settings().get("backup_dir") or BACKUP_DIR
+    if not os.path.isdir(folder):
+        return []
+    snapshots = []
+    for name in os.listdir(folder):
+        m = _NAME_RE.match(name)
+        if m:
+            path = os.path.join(folder, name)
+            taken_at = datetime.datetime.strptime(m.group(1), "%Y-%m-%d_%H%M%S")
+            snapshots.append((int(m.group(2) or 1), (path, m.group(3), taken_at, os.path.getsize(path))))
+    snapshots.sort(key=lambda s: (s[1][2], s[0]), reverse=True)
+    return [snapshot for _, snapshot in snapshots]
+
+def rotate_snapshots(keep, label=None):
+    """Deletes all but the newest `keep` snapshots of each label (or only of `label`)."""
+    seen = {}
+    removed = []
+    for path, snap_label, _, _ in list_snapshots():
+        if label and snap_label != label: continue
+        seen[snap_label] = seen.get(snap_label, 0) + 1
+        if seen[snap_label] > keep:
+            for p in (path, path + ".sha256"):
+                if os.path.exists(p): os.remove(p)
+            removed.append(path)
+    return removed
+
+def verify_snapshot(path):
+    """Checks the checksum and decompresses the snapshot to run PRAGMA integrity_check. Returns (ok, message)."""
+    sidecar = path + ".sha256"
+    if not os.path.exists(sidecar):
+        return False, "checksum file missing"
+    with open(sidecar) as f:
+        expected = f.read().split()[0]
+    if _sha256(path) != expected:
+        return False, "checksum mismatch"
+    fd, raw_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        with gzip.open(path, "rb") as src, open(raw_path, "wb") as dest:
+            shutil.copyfileobj(src, dest, 1 << 20)
+        result = _integrity(raw_path)
+    except (OSError, EOFError, sqlite3.DatabaseError) as e:
+        return False, str(e)
+    finally:
+        os.remove(raw_path)
+    return result == "ok", result
+
+def restore_snapshot(path, dest_path=None):
+    """
+    Verifies a snapshot and writes it back to dest_path (default: the live
+    database path, or archive/ for an archive-<year> snapshot). Only run this
+    with the application closed.
+    """
+    ok, message = verify_snapshot(path)
+    if not ok:
+        raise RuntimeError(f"Snapshot {path} is not usable: {message}")
+    if not dest_path:
+        m = _NAME_RE.match(os.path.basename(path))
+        archive = _ARCHIVE_LABEL_RE.match(m.group(3)) if m else None
+        if archive:
+            os.makedirs(database.ARCHIVE_DIR, exist_ok=True)
+            dest_path = database.archive_path(int(archive.group(1)))
+        else:
+            dest_path = database.DB_PATH
+    tmp = dest_path + ".restore"
+    with gzip.open(path, "rb") as src, open(tmp, "wb") as dest:
+        shutil.copyfileobj(src, dest, 1 << 20)
+    # A leftover WAL would be replayed over the restored pages on the next open
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(dest_path + suffix): os.remove(dest_path + suffix)
+    os.replace(tmp, dest_path)
+    return dest_path
@@ -1,12 +1,79 @@
 import sqlite3
+import os
+import re
 import datetime
+import json
+import difflib
+import platform
+import threading
+import unicodedata
+from collections import namedtuple
+
+# Classes a student can be admitted into
+CLASS_LIST = [
+    "Playgroup", 
+    "Nursery", 
+    "Prep",
+    "Grade 1", "Grade 2", "Grade 3", "Grade 4", "Grade 5",
+    "Grade 6", "Grade 7", "Grade 8", "Grade 9", "Grade 10",
+    "O-Level", "A-Level", "Hifz"
+]
+
+STUDENT_STATUSES = ("Active", "Inactive", "Withdrawn", "Graduated", "Passed Out")
+
+# students columns in table order, without student_id
+STUDENT_COLUMNS = (
+    "full_name", "date_of_birth", "place_of_birth", "class_into_which_admission_is_sought",
+    "last_school_attended", "reason_for_leaving_last_school", "father_name", "father_occupation",
+    "father_office_address", "mother_name", "mother_occupation", "mother_office_address",
+    "guardian_name", "residential_address", "contact_details", "brothers_sisters_applicant",
+    "medical_info", "admission_date", "status", "photo_path",
+)
+
+# Row types returned by the query functions. Each query selects exactly the
+# fields of its row type (never SELECT *), so new table columns do not shift
+# positions, and callers read fields by name.
+Student = namedtuple("Student", ("student_id",) + STUDENT_COLUMNS)
+StudentListItem = namedtuple("StudentListItem", "student_id full_name class_name father_name contact_details")
+Challan = namedtuple("Challan", "challan_id student_id issue_date due_date status payment_date total_amount arrears fine amount_paid billing_period kind")
+ChallanItem = namedtuple("ChallanItem", "description amount")
+VoucherStudent = namedtuple("VoucherStudent", "student_id full_name father_name class_name")
+ChallanDetail = namedtuple("ChallanDetail", "challan items student")
+Change = namedtuple("Change", "seq entity entity_id operation student_id changed_at")
+
+STUDENT_SELECT = ", ".join(Student._fields)
+STUDENT_LIST_SELECT = "student_id, full_name, class_into_which_admission_is_sought, father_name, contact_details"
+CHALLAN_SELECT = ", ".join(Challan._fields)
+
+def _rows_as(row_type):
+    """Row factory building row_type from each fetched row."""
+    return lambda cursor, row: row_type._make(row)
+
+# Database file used by connect_db(). Worker processes and tools that run
+# against a snapshot or another campus file point this elsewhere.
+DB_PATH = 'school.db'
+BUSY_TIMEOUT = 5.0 # seconds a connection waits for another writer's lock
+
+# Connection lent to the current thread by pin_connection()
+_pinned = threading.local()
 
 def connect_db():
     """Creates or connects to the database and returns the connection."""
-    conn = sqlite3.connect('school.db')
+    conn = getattr(_pinned, "conn", None)
+    if conn is not None:
+        return conn
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT)
     conn.execute("PRAGMA foreign_keys = 1") # Enforce foreign keys
     return conn
 
+def pin_connection(conn):
+    """
+    Makes connect_db() on this thread return conn (None to stop). The API
+    server uses this to run the functions below on its pooled connections,
+    whose close() and commit() it overrides.
+    """
+    _pinned.conn = conn
+
 def setup_database():
     """Creates or updates the database schema."""
     conn = connect_db()
@@ -81,6 +148,43 @@ def setup_database():
     )
     """)
     
+    # --- 6. Create Fee Plans Table (per-class fee heads) ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS fee_plans (
+        plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        class_name TEXT NOT NULL,
+        description TEXT NOT NULL,
+        amount REAL NOT NULL DEFAULT 0,
+        UNIQUE (class_name, description)
+    )
+    """)
+
+    # --- 7. Create Discount Rules Table ---
+    # rule_type 'sibling': children ranked >= min_count in a family get the discount
+    # rule_type 'class': every student of class_name (or every class if NULL) gets it
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS discount_rules (
+        rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        rule_type TEXT NOT NULL DEFAULT 'sibling',
+        class_name TEXT,
+        applies_to TEXT,
+        min_count INTEGER DEFAULT 2,
+        percent REAL DEFAULT 0,
+        flat_amount REAL DEFAULT 0,
+        active INTEGER DEFAULT 1
+    )
+    """)
+    # Bumped on every fee plan or rule edit, from any process, so compiled plans
+    # cached elsewhere (see compile_fee_plans) can tell they are stale
+    cursor.execute("CREATE TABLE IF NOT EXISTS fee_plan_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+    cursor.execute("INSERT OR IGNORE INTO fee_plan_version (id, version) VALUES (1, 0)")
+    cursor.executescript("".join(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()} AFTER {event} ON {table}
+    BEGIN
+        UPDATE fee_plan_version SET version = version + 1 WHERE id = 1;
+    END;""" for table in ("fee_plans", "discount_rules") for event in ("INSERT", "UPDATE", "DELETE")))
+
     cursor.execute("SELECT * FROM users WHERE username = 'admin'")
     if not cursor.fetchone():
         cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", ('admin', 'admin'))
@@ -89,11 +193,329 @@ def setup_database():
         cursor.execute("ALTER TABLE students ADD COLUMN photo_path TEXT")
     except sqlite3.OperationalError:
         pass
-        
+
+    # Unpaid challans rolled into a newer challan's arrears point at that challan
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN carried_forward_to INTEGER")
+    except sqlite3.OperationalError:
+        pass
+    # Due date of the oldest balance carried into a challan's arrears, so that debt stays overdue
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN arrears_due_date TEXT")
+        cursor.execute("""
+            WITH RECURSIVE carried (target, due_date) AS (
+                SELECT carried_forward_to, due_date FROM challans WHERE carried_forward_to IS NOT NULL
+                UNION ALL SELECT c.carried_forward_to, carried.due_date
+                FROM carried JOIN challans c ON c.challan_id = carried.target WHERE c.carried_forward_to IS NOT NULL
+            )
+            UPDATE challans SET arrears_due_date = (SELECT MIN(due_date) FROM carried WHERE target = challans.challan_id)
+            WHERE arrears > 0
+        """)
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_challans_student_status ON challans (student_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_challan_items_challan ON challan_items (challan_id)")
+
+    # Date the current fine was computed for, so re-running an accrual is a no-op
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN fine_as_of TEXT")
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_challans_status_due ON challans (status, due_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_challans_status_payment ON challans (status, payment_date)")
+
+    # Normalized identity used for duplicate-admission checks (see make_identity_key)
+    for column in ("identity_key", "contact_key"):
+        try:
+            cursor.execute(f"ALTER TABLE students ADD COLUMN {column} TEXT")
+        except sqlite3.OperationalError:
+            pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_identity ON students (identity_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_dob ON students (date_of_birth)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_contact_key ON students (contact_key)")
+    cursor.execute("SELECT student_id, full_name, father_name, date_of_birth, contact_details FROM students WHERE identity_key IS NULL")
+    cursor.executemany("UPDATE students SET identity_key = ?, contact_key = ? WHERE student_id = ?", [
+        (make_identity_key(name, father, dob, contact), contact_digits(contact), sid)
+        for sid, name, father, dob, contact in cursor.fetchall()
+    ])
+
+    # --- 8. Create Families Table (siblings share father name + contact number) ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS families (
+        family_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        family_key TEXT UNIQUE NOT NULL,
+        father_name TEXT,
+        contact_details TEXT
+    )
+    """)
+    try:
+        cursor.execute("ALTER TABLE students ADD COLUMN family_id INTEGER REFERENCES families (family_id)")
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_family ON students (family_id)")
+
+    # --- 9. Create Family Vouchers Table (one voucher covering siblings' challans) ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS family_vouchers (
+        voucher_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        family_id INTEGER NOT NULL,
+        issue_date TEXT NOT NULL,
+        due_date TEXT NOT NULL,
+        status TEXT DEFAULT 'Unpaid',
+        payment_date TEXT,
+        total_amount REAL DEFAULT 0,
+        FOREIGN KEY (family_id) REFERENCES families (family_id)
+    )
+    """)
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN family_voucher_id INTEGER REFERENCES family_vouchers (voucher_id)")
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_challans_family_voucher ON challans (family_voucher_id)")
+    cursor.execute("SELECT 1 FROM families LIMIT 1")
+    if not cursor.fetchone():
+        _rebuild_families(cursor)
+
+    # --- 10. Create Payments and Allocations Tables ---
+    # A payment is cash received from a student; allocations spread it over
+    # that student's open challans oldest-first (see allocate_payment)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS payments (
+        payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL,
+        payment_date TEXT NOT NULL,
+        amount REAL NOT NULL,
+        unapplied REAL DEFAULT 0,
+        method TEXT,
+        reference TEXT,
+        FOREIGN KEY (student_id) REFERENCES students (student_id)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS payment_allocations (
+        payment_id INTEGER NOT NULL,
+        challan_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        PRIMARY KEY (payment_id, challan_id),
+        FOREIGN KEY (payment_id) REFERENCES payments (payment_id) ON DELETE CASCADE,
+        FOREIGN KEY (challan_id) REFERENCES challans (challan_id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_student ON payments (student_id, payment_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (payment_date)")
+    # A bank/reconciliation reference is recorded once, so re-importing a file is a no-op
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_reference ON payments (reference) WHERE reference IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_allocations_challan ON payment_allocations (challan_id)")
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN amount_paid REAL DEFAULT 0")
+        # Challans paid before payments were recorded get one payment each (payment_id = challan_id)
+        cursor.execute("UPDATE challans SET amount_paid = total_amount WHERE status = 'Paid'")
+        cursor.execute("""
+            INSERT INTO payments (payment_id, student_id, payment_date, amount, method)
+            SELECT challan_id, student_id, COALESCE(payment_date, issue_date), total_amount, 'Migrated'
+            FROM challans WHERE status = 'Paid'
+        """)
+        cursor.execute("""
+            INSERT INTO payment_allocations (payment_id, challan_id, amount)
+            SELECT challan_id, challan_id, total_amount FROM challans WHERE status = 'Paid'
+        """)
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute("ALTER TABLE students ADD COLUMN balance REAL DEFAULT 0")
+        new_balance = True
+    except sqlite3.OperationalError:
+        new_balance = False
+    # students.balance (outstanding on open challans) follows every challan write,
+    # including the bulk UPDATEs of fine accrual and carry-forward
+    cursor.executescript("""
+    CREATE TRIGGER IF NOT EXISTS trg_challans_balance_insert AFTER INSERT ON challans
+    WHEN NEW.status = 'Unpaid'
+    BEGIN
+        UPDATE students SET balance = balance + NEW.total_amount - COALESCE(NEW.amount_paid, 0) WHERE student_id = NEW.student_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_challans_balance_update AFTER UPDATE OF status, total_amount, amount_paid, student_id ON challans
+    WHEN OLD.status = 'Unpaid' OR NEW.status = 'Unpaid'
+    BEGIN
+        UPDATE students SET balance = balance - (CASE WHEN OLD.status = 'Unpaid' THEN OLD.total_amount - COALESCE(OLD.amount_paid, 0) ELSE 0 END)
+        WHERE student_id = OLD.student_id;
+        UPDATE students SET balance = balance + (CASE WHEN NEW.status = 'Unpaid' THEN NEW.total_amount - COALESCE(NEW.amount_paid, 0) ELSE 0 END)
+        WHERE student_id = NEW.student_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_challans_balance_delete AFTER DELETE ON challans
+    WHEN OLD.status = 'Unpaid'
+    BEGIN
+        UPDATE students SET balance = balance - (OLD.total_amount - COALESCE(OLD.amount_paid, 0)) WHERE student_id = OLD.student_id;
+    END;
+    """)
+    if new_balance:
+        _rebuild_student_balances(cursor)
+
+    # Month (YYYY-MM) and kind a challan bills for; one challan per student, period and kind
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN billing_period TEXT")
+        # Existing rows: the oldest challan per student and issue month takes the period,
+        # later duplicates of the same month are left without one
+        cursor.execute("""
+            UPDATE challans SET billing_period = substr(issue_date, 1, 7)
+            WHERE challan_id IN (SELECT MIN(challan_id) FROM challans GROUP BY student_id, substr(issue_date, 1, 7))
+        """)
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute("ALTER TABLE challans ADD COLUMN kind TEXT DEFAULT 'Monthly'")
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_challans_period ON challans (student_id, billing_period, kind)")
+
+    # --- 11. Create Daily Collection Rollup (kept in step by the payment functions) ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS collection_daily (
+        collection_date TEXT NOT NULL,
+        class_name TEXT NOT NULL DEFAULT '',
+        challan_count INTEGER NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (collection_date, class_name)
+    )
+    """)
+    cursor.execute("SELECT 1 FROM collection_daily LIMIT 1")
+    if not cursor.fetchone():
+        _rebuild_collection_daily(cursor)
+
+    # --- 12. Create Change Log (append-only, written by triggers) ---
+    # seq never goes backwards, so a reader can ask for everything after the last seq it saw
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        operation TEXT NOT NULL,
+        student_id INTEGER,
+        changed_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_log_time ON change_log (changed_at)")
+    conn.commit()
+    # Balance-only updates are left out; they always come with a logged challan change
+    student_columns = ", ".join(STUDENT_COLUMNS + ("family_id",))
+    triggers = [("student", "students", "student_id", "student_id", "UPDATE OF " + student_columns),
+                ("challan", "challans", "challan_id", "student_id", "UPDATE"),
+                ("payment", "payments", "payment_id", "student_id", "UPDATE")]
+    script = []
+    for entity, table, key, owner, update in triggers:
+        for operation, event, row in (("insert", "INSERT", "NEW"), ("update", update, "NEW"), ("delete", "DELETE", "OLD")):
+            script.append(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{operation} AFTER {event} ON {table}
+    BEGIN
+        INSERT INTO change_log (entity, entity_id, operation, student_id) VALUES ('{entity}', {row}.{key}, '{operation}', {row}.{owner});
+    END;""")
+    cursor.executescript("".join(script))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_log_entity ON change_log (entity, entity_id, seq)")
+
+    # --- 13. Create Replication Tables (see replication.py) ---
+    # Each copy of the database is a site with a random id; replica_rows keeps the
+    # original identity and last applied version of rows received from other sites
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS replica_site (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        site_id TEXT NOT NULL,
+        name TEXT
+    )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO replica_site (id, site_id, name) VALUES (1, lower(hex(randomblob(8))), ?)", (platform.node(),))
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS replica_peers (
+        site_id TEXT PRIMARY KEY,
+        name TEXT,
+        sent_seq INTEGER NOT NULL DEFAULT 0,
+        acked_seq INTEGER NOT NULL DEFAULT 0,
+        received_seq INTEGER NOT NULL DEFAULT 0,
+        last_sync TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS replica_rows (
+        entity TEXT NOT NULL,
+        local_id INTEGER NOT NULL,
+        origin_site TEXT NOT NULL,
+        origin_id INTEGER NOT NULL,
+        version_at TEXT NOT NULL,
+        version_site TEXT NOT NULL,
+        applied_seq INTEGER NOT NULL,
+        PRIMARY KEY (entity, local_id)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS replica_aliases (
+        entity TEXT NOT NULL,
+        origin_site TEXT NOT NULL,
+        origin_id INTEGER NOT NULL,
+        local_id INTEGER NOT NULL,
+        PRIMARY KEY (entity, origin_site, origin_id)
+    )
+    """)
+
+    # --- 14. Create Notification Tables (see notifications.py) ---
+    # Every message of a run is stored before sending, so a run can be resumed
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS notification_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+        gateway TEXT,
+        recipients INTEGER NOT NULL DEFAULT 0,
+        finished_at TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS notification_log (
+        run_id INTEGER NOT NULL,
+        recipient TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        address TEXT NOT NULL,
+        student_ids TEXT,
+        amount REAL,
+        message TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        gateway_ref TEXT,
+        error TEXT,
+        sent_at TEXT,
+        PRIMARY KEY (run_id, recipient),
+        FOREIGN KEY (run_id) REFERENCES notification_runs (run_id) ON DELETE CASCADE
+    )
+    """)
+
     conn.commit()
     conn.close()
     print("Database and tables created successfully.")
 
+def snapshot_database(dest_path):
+    """Copies a transactionally consistent image of the database to dest_path (SQLite online backup)."""
+    conn = connect_db()
+    dest = sqlite3.connect(dest_path)
+    try:
+        conn.backup(dest)
+    finally:
+        dest.close()
+        conn.close()
+    return dest_path
+
+def _changed():
+    # Tells open windows about the rows just committed (see events.py); imported
+    # here because events.py reads the change feed through this module
+    from events import notify_changes
+    notify_changes()
+
+def _snapshot_before(operation):
+    # Imported here because backup.py itself builds on connect_db
+    from backup import snapshot_before
+    snapshot_before(operation)
+
+def _snapshot_archives(years):
+    # The archives hold the only copy of the rows just moved out of school.db
+    from backup import snapshot_archives
+    snapshot_archives(years)
+
 # === STUDENT FUNCTIONS ===
 
 def add_student(full_name, date_of_birth, place_of_birth, class_into_which_admission_is_sought,
@@ -109,19 +531,22 @@ def add_student(full_name, date_of_birth, place_of_birth, class_into_which_admis
             last_school_attended, reason_for_leaving_last_school, father_name, father_occupation,
             father_office_address, mother_name, mother_occupation, mother_office_address,
             guardian_name, residential_address, contact_details, brothers_sisters_applicant,
-            medical_info, admission_date, status, photo_path
+            medical_info, admission_date, status, photo_path, identity_key, contact_key
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         full_name, date_of_birth, place_of_birth, class_into_which_admission_is_sought,
         last_school_attended, reason_for_leaving_last_school, father_name, father_occupation,
         father_office_address, mother_name, mother_occupation, mother_office_address,
         guardian_name, residential_address, contact_details, brothers_sisters_applicant,
-        medical_info, admission_date, status, photo_path
+        medical_info, admission_date, status, photo_path,
+        make_identity_key(full_name, father_name, date_of_birth, contact_details), contact_digits(contact_details)
     ))
-    conn.commit()
     new_id = cursor.lastrowid
+    _assign_family(cursor, new_id, father_name, contact_details)
+    conn.commit()
     conn.close()
+    _changed()
     return new_id
 
 def update_student(student_id, full_name, date_of_birth, place_of_birth, class_into_which_admission_is_sought,
@@ -137,25 +562,221 @@ def update_student(student_id, full_name, date_of_birth, place_of_birth, class_i
             last_school_attended=?, reason_for_leaving_last_school=?, father_name=?, father_occupation=?,
             father_office_address=?, mother_name=?, mother_occupation=?, mother_office_address=?,
             guardian_name=?, residential_address=?, contact_details=?, brothers_sisters_applicant=?,
-            medical_info=?, admission_date=?, status=?, photo_path=?
+            medical_info=?, admission_date=?, status=?, photo_path=?, identity_key=?, contact_key=?
         WHERE student_id=?
     """, (
         full_name, date_of_birth, place_of_birth, class_into_which_admission_is_sought,
         last_school_attended, reason_for_leaving_last_school, father_name, father_occupation,
         father_office_address, mother_name, mother_occupation, mother_office_address,
         guardian_name, residential_address, contact_details, brothers_sisters_applicant,
-        medical_info, admission_date, status, photo_path, student_id
+        medical_info, admission_date, status, photo_path,
+        make_identity_key(full_name, father_name, date_of_birth, contact_details), contact_digits(contact_details),
+        student_id
     ))
+    _assign_family(cursor, student_id, father_name, contact_details)
+    conn.commit()
+    conn.close()
+    _changed()
+
+def set_student_photo(student_id, photo_path):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE students SET photo_path = ? WHERE student_id = ?", (photo_path, student_id))
+    conn.commit()
+    conn.close()
+    _changed()
+
+def add_students_bulk(rows, cursor):
+    """Inserts many 20-column student tuples (STUDENT_COLUMNS order) on the caller's cursor/transaction."""
+    name_i, father_i = STUDENT_COLUMNS.index("full_name"), STUDENT_COLUMNS.index("father_name")
+    dob_i, contact_i = STUDENT_COLUMNS.index("date_of_birth"), STUDENT_COLUMNS.index("contact_details")
+    cursor.executemany(f"""
+        INSERT INTO students ({", ".join(STUDENT_COLUMNS)}, identity_key, contact_key)
+        VALUES ({", ".join("?" * (len(STUDENT_COLUMNS) + 2))})
+    """, (tuple(r) + (make_identity_key(r[name_i], r[father_i], r[dob_i], r[contact_i]), contact_digits(r[contact_i])) for r in rows))
+
+def import_students_batch(rows):
+    """Inserts one spreadsheet import batch (see student_import.py) in its own transaction. Returns the row count."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    add_students_bulk(rows, cursor)
     conn.commit()
     conn.close()
+    return len(rows)
+
+# === DUPLICATE ADMISSION DETECTION ===
+
+# Common spellings folded to one form before names are compared
+NAME_VARIANTS = {
+    "mohammad": "muhammad", "mohammed": "muhammad", "muhammed": "muhammad", "mohamed": "muhammad",
+    "mohd": "muhammad", "muhammd": "muhammad", "md": "muhammad", "m": "muhammad",
+}
+
+# Minimum name+father similarity (0..1) for a near-match candidate
+NEAR_MATCH_THRESHOLD = 0.85
+# cluster_duplicate_students compares every pair in blocks up to this size,
+# and only the next CLUSTER_WINDOW names (sorted) in larger ones
+CLUSTER_FULL_COMPARE = 200
+CLUSTER_WINDOW = 20
+
+def fold_name(text):
+    """Lower-cases, strips accents and punctuation, and unifies common name spellings."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch if ch.isalnum() else " " for ch in text if not unicodedata.combining(ch)).lower()
+    return " ".join(NAME_VARIANTS.get(part, part) for part in text.split())
+
+def contact_digits(contact_details):
+    """Last 10 digits of the phone number, so +92 300... and 0300... compare equal."""
+    digits = "".join(ch for ch in (contact_details or "") if ch.isdigit())
+    return digits[-10:] or None
+
+def make_identity_key(full_name, father_name, date_of_birth, contact_details):
+    return "|".join((fold_name(full_name), fold_name(father_name), (date_of_birth or "").strip(), contact_digits(contact_details) or ""))
+
+def _is_similar(a, b, threshold):
+    # The quick ratios are cheap upper bounds that rule out most pairs
+    matcher = difflib.SequenceMatcher(None, a, b)
+    return matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+def find_duplicate_students(full_name, father_name, date_of_birth, contact_details, exclude_id=None, cursor=None):
+    """
+    Returns possible existing admissions of the same child as
+    [(student_id, full_name, father_name, date_of_birth, contact_details, score, exact)],
+    best first. The exact key, date of birth and contact number are all indexed,
+    so this stays a few index probes however many students there are.
+    """
+    own_conn = cursor is None
+    if own_conn:
+        conn = connect_db()
+        cursor = conn.cursor()
+    key = make_identity_key(full_name, father_name, date_of_birth, contact_details)
+    contact = contact_digits(contact_details)
+    cursor.execute("""
+        SELECT student_id, full_name, father_name, date_of_birth, contact_details, identity_key
+        FROM students
+        WHERE identity_key = ? OR (date_of_birth = ? AND date_of_birth <> '') OR contact_key = ?
+    """, (key, (date_of_birth or "").strip(), contact))
+    candidates = cursor.fetchall()
+    if own_conn:
+        conn.close()
+    candidates = [c + (fold_name(c[1]) + "|" + fold_name(c[2]),) for c in candidates]
+    return _rank_duplicates(key, fold_name(full_name) + "|" + fold_name(father_name), candidates, exclude_id)
+
+def _rank_duplicates(key, wanted, candidates, exclude_id=None):
+    # candidates are (student_id, full_name, father_name, date_of_birth, contact_details, identity_key, folded names)
+    matches = []
+    # One matcher per wanted name: difflib indexes its second sequence once
+    matcher = difflib.SequenceMatcher(None, b=wanted)
+    for sid, name, father, dob, phone, other_key, folded in candidates:
+        if sid == exclude_id: continue
+        exact = other_key == key
+        score = 1.0
+        if not exact:
+            matcher.set_seq1(folded)
+            if matcher.real_quick_ratio() < NEAR_MATCH_THRESHOLD or matcher.quick_ratio() < NEAR_MATCH_THRESHOLD: continue
+            score = matcher.ratio()
+            if score < NEAR_MATCH_THRESHOLD: continue
+        matches.append((sid, name, father, dob, phone, round(score, 3), exact))
+    matches.sort(key=lambda m: (not m[6], -m[5], m[0]))
+    return matches
+
+def find_duplicate_students_bulk(rows):
+    """
+    find_duplicate_students for a batch of STUDENT_COLUMNS rows (the spreadsheet
+    import): one query fetches every student sharing an identity key, date of
+    birth or contact number with any of the rows. Returns one match list per row.
+    """
+    name_i, father_i = STUDENT_COLUMNS.index("full_name"), STUDENT_COLUMNS.index("father_name")
+    dob_i, contact_i = STUDENT_COLUMNS.index("date_of_birth"), STUDENT_COLUMNS.index("contact_details")
+    wanted = [(make_identity_key(r[name_i], r[father_i], r[dob_i], r[contact_i]), (r[dob_i] or "").strip(),
+               contact_digits(r[contact_i]), fold_name(r[name_i]) + "|" + fold_name(r[father_i])) for r in rows]
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT student_id, full_name, father_name, date_of_birth, contact_details, identity_key, contact_key
+        FROM students
+        WHERE identity_key IN (SELECT value FROM json_each(?))
+           OR date_of_birth IN (SELECT value FROM json_each(?)) OR contact_key IN (SELECT value FROM json_each(?))
+    """, tuple(json.dumps(sorted(set(w[i] for w in wanted if w[i]))) for i in range(3)))
+    blocks = {}
+    for candidate in cursor.fetchall():
+        # Names are folded once per batch, however many rows share the candidate's blocks
+        folded = candidate[:6] + (fold_name(candidate[1]) + "|" + fold_name(candidate[2]),)
+        for block in (("k", candidate[5]), ("d", (candidate[3] or "").strip()), ("c", candidate[6])):
+            if block[1]: blocks.setdefault(block, []).append(folded)
+    conn.close()
+    results = []
+    for key, dob, contact, folded in wanted:
+        candidates = {}
+        for block in (("k", key), ("d", dob), ("c", contact)):
+            if block[1]:
+                for candidate in blocks.get(block, ()): candidates[candidate[0]] = candidate
+        results.append(_rank_duplicates(key, folded, candidates.values()))
+    return results
 
-def get_students(search_term=""):
+def cluster_duplicate_students(threshold=NEAR_MATCH_THRESHOLD):
+    """
+    One-off scan that groups existing students who look like the same child.
+    Students are compared only within blocks sharing a date of birth or a
+    contact number, and pairs are merged with union-find.
+    Returns [[(student_id, full_name, father_name, date_of_birth, contact_details), ...], ...].
+    """
     conn = connect_db()
     cursor = conn.cursor()
+    cursor.execute("SELECT student_id, full_name, father_name, date_of_birth, contact_details, identity_key, contact_key FROM students")
+    students = cursor.fetchall()
+    conn.close()
+
+    parent = {s[0]: s[0] for s in students}
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra != rb: parent[max(ra, rb)] = min(ra, rb)
+
+    blocks = {}
+    for s in students:
+        sid, name, father, dob, _, key, contact = s
+        folded = fold_name(name) + "|" + fold_name(father)
+        for block in (("k", key), ("d", (dob or "").strip()), ("c", contact)):
+            if block[1]: blocks.setdefault(block, []).append((sid, folded, key))
+    for (kind, _), members in blocks.items():
+        if len(members) < 2: continue
+        if kind == "k":
+            for other in members[1:]: union(members[0][0], other[0])
+            continue
+        # Large blocks (a common birth date) only compare alphabetical neighbours
+        members.sort(key=lambda m: m[1])
+        window = len(members) if len(members) <= CLUSTER_FULL_COMPARE else CLUSTER_WINDOW
+        for i in range(len(members)):
+            for j in range(i + 1, min(i + window, len(members))):
+                if _is_similar(members[i][1], members[j][1], threshold):
+                    union(members[i][0], members[j][0])
+
+    clusters = {}
+    for s in students:
+        clusters.setdefault(find(s[0]), []).append(s[:5])
+    return [c for c in clusters.values() if len(c) > 1]
+
+def get_students(search_term="", class_name=None, status=None, student_ids=None):
+    """StudentListItem rows for list views, optionally filtered by name, class, status and ids."""
+    conditions, params = [], []
     if search_term:
-        cursor.execute("SELECT * FROM students WHERE full_name LIKE ?", ('%' + search_term + '%',))
-    else:
-        cursor.execute("SELECT * FROM students")
+        conditions.append("full_name LIKE ?"); params.append('%' + search_term + '%')
+    if class_name:
+        conditions.append("class_into_which_admission_is_sought = ?"); params.append(class_name)
+    if status:
+        conditions.append("status = ?"); params.append(status)
+    if student_ids is not None:
+        conditions.append("student_id IN (SELECT value FROM json_each(?))"); params.append(json.dumps(list(student_ids)))
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.row_factory = _rows_as(StudentListItem)
+    cursor.execute(f"SELECT {STUDENT_LIST_SELECT} FROM students {where}", params)
     students = cursor.fetchall()
     conn.close()
     return students
@@ -163,7 +784,26 @@ def get_students(search_term=""):
 def get_active_students():
     conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM students WHERE status = 'Active'")
+    cursor.row_factory = _rows_as(StudentListItem)
+    cursor.execute(f"SELECT {STUDENT_LIST_SELECT} FROM students WHERE status = 'Active'")
+    students = cursor.fetchall()
+    conn.close()
+    return students
+
+def get_students_for_forms(class_name=None, start_date=None, end_date=None):
+    """Student rows for batch form printing, filtered by class and/or admission date range, in one query."""
+    conditions, params = [], []
+    if class_name:
+        conditions.append("class_into_which_admission_is_sought = ?"); params.append(class_name)
+    if start_date:
+        conditions.append("admission_date >= ?"); params.append(start_date)
+    if end_date:
+        conditions.append("admission_date <= ?"); params.append(end_date)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.row_factory = _rows_as(Student)
+    cursor.execute(f"SELECT {STUDENT_SELECT} FROM students {where} ORDER BY class_into_which_admission_is_sought, full_name", params)
     students = cursor.fetchall()
     conn.close()
     return students
@@ -171,14 +811,34 @@ def get_active_students():
 def get_student_by_id(student_id):
     conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM students WHERE student_id = ?", (student_id,))
+    cursor.row_factory = _rows_as(Student)
+    cursor.execute(f"SELECT {STUDENT_SELECT} FROM students WHERE student_id = ?", (student_id,))
     student = cursor.fetchone()
     conn.close()
     return student
 
+def promote_students(student_ids, target_class):
+    """Moves students to target_class in one transaction; 'Passed Out' also sets their status."""
+    _snapshot_before("promotion")
+    conn = connect_db()
+    cursor = conn.cursor()
+    if target_class == "Passed Out":
+        cursor.executemany("UPDATE students SET class_into_which_admission_is_sought = ?, status = 'Passed Out' WHERE student_id = ?",
+                           [(target_class, sid) for sid in student_ids])
+    else:
+        cursor.executemany("UPDATE students SET class_into_which_admission_is_sought = ? WHERE student_id = ?",
+                           [(target_class, sid) for sid in student_ids])
+    count = cursor.rowcount
+    conn.commit()
+    conn.close()
+    _changed()
+    return count
+
 def delete_student(student_id):
     conn = connect_db()
     cursor = conn.cursor()
+    # payments.student_id has no ON DELETE action; allocations go with the payments
+    cursor.execute("DELETE FROM payments WHERE student_id = ?", (student_id,))
     cursor.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
     try:
         cursor.execute("DELETE FROM fees_old WHERE student_id = ?", (student_id,))
@@ -186,18 +846,24 @@ def delete_student(student_id):
         pass
     conn.commit()
     conn.close()
+    _changed()
 
 # === CHALLAN & FEE FUNCTIONS ===
 
-def create_challan(student_id, issue_date, due_date, status, items, arrears=0, fine=0):
+def create_challan(student_id, issue_date, due_date, status, items, arrears=0, fine=0, billing_period=None, kind="Monthly"):
     conn = connect_db()
     cursor = conn.cursor()
     total_amount = sum(item[1] for item in items) + arrears + fine
     
-    cursor.execute("""
-        INSERT INTO challans (student_id, issue_date, due_date, status, total_amount, arrears, fine)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (student_id, issue_date, due_date, status, total_amount, arrears, fine))
+    # Raises sqlite3.IntegrityError if the student already has a challan of this kind for the period
+    try:
+        cursor.execute("""
+            INSERT INTO challans (student_id, issue_date, due_date, status, total_amount, arrears, fine, billing_period, kind)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (student_id, issue_date, due_date, status, total_amount, arrears, fine, billing_period, kind))
+    except sqlite3.IntegrityError:
+        conn.close()
+        raise
     challan_id = cursor.lastrowid
     
     for desc, amount in items:
@@ -205,45 +871,516 @@ def create_challan(student_id, issue_date, due_date, status, items, arrears=0, f
             INSERT INTO challan_items (challan_id, description, amount)
             VALUES (?, ?, ?)
         """, (challan_id, desc, amount))
+    _apply_credit(cursor, [student_id])
     conn.commit()
     conn.close()
+    _changed()
     return challan_id
 
 def get_challans_by_student_id(student_id):
-    conn = connect_db()
+    """Full challan history of a student, archived years included."""
+    conn = connect_history()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM challans WHERE student_id = ? ORDER BY issue_date DESC", (student_id,))
+    cursor.row_factory = _rows_as(Challan)
+    cursor.execute(f"SELECT {CHALLAN_SELECT} FROM all_challans WHERE student_id = ? ORDER BY issue_date DESC", (student_id,))
     challans = cursor.fetchall()
     conn.close()
     return challans
 
+# Challan header, its items (as a JSON array) and the voucher's student fields in one row
+_CHALLAN_DETAIL_SQL = """
+    SELECT {challan_cols},
+           s.student_id, s.full_name, s.father_name, s.class_into_which_admission_is_sought,
+           (SELECT json_group_array(json_array(i.description, i.amount))
+            FROM (SELECT description, amount FROM {prefix}challan_items WHERE challan_id = c.challan_id ORDER BY item_id) i)
+    FROM {prefix}challans c JOIN students s ON s.student_id = c.student_id
+    WHERE c.challan_id IN (SELECT value FROM json_each(?))
+"""
+
+def _fetch_challan_details(cursor, challan_ids, prefix=""):
+    cursor.execute(_CHALLAN_DETAIL_SQL.format(challan_cols=", ".join("c." + f for f in Challan._fields), prefix=prefix),
+                   (json.dumps(list(challan_ids)),))
+    n = len(Challan._fields)
+    details = {}
+    for row in cursor.fetchall():
+        items = [ChallanItem._make(item) for item in json.loads(row[n + 4])]
+        details[row[0]] = ChallanDetail(Challan._make(row[:n]), items, VoucherStudent._make(row[n:n + 4]))
+    return details
+
+def get_challans_details(challan_ids):
+    """
+    ChallanDetail (challan, items, student) for every id, in the order given,
+    in one query (plus one over the archives for ids not in the live database).
+    Ids that do not exist are left out.
+    """
+    challan_ids = [int(cid) for cid in challan_ids]
+    if not challan_ids: return []
+    conn = connect_db()
+    details = _fetch_challan_details(conn.cursor(), challan_ids)
+    conn.close()
+    missing = [cid for cid in challan_ids if cid not in details]
+    if missing and list_archives():
+        conn = connect_history()
+        details.update(_fetch_challan_details(conn.cursor(), missing, "all_"))
+        conn.close()
+    return [details[cid] for cid in challan_ids if cid in details]
+
 def get_challan_details_by_id(challan_id):
+    """ChallanDetail (challan, items, student) of one challan, or None."""
+    details = get_challans_details([challan_id])
+    return details[0] if details else None
+
+def get_class_challans(class_name, student_ids=None):
+    """(student_id, name, challan_id, due_date, total, status) for a class, latest due first; student_ids narrows it."""
     conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM challans WHERE challan_id = ?", (challan_id,))
-    challan = cursor.fetchone()
-    cursor.execute("SELECT description, amount FROM challan_items WHERE challan_id = ?", (challan_id,))
-    items = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT s.student_id, s.full_name, c.challan_id, c.due_date, c.total_amount, c.status
+        FROM challans c JOIN students s ON c.student_id = s.student_id
+        WHERE s.class_into_which_admission_is_sought = ?
+        {"AND s.student_id IN (SELECT value FROM json_each(?))" if student_ids is not None else ""}
+        ORDER BY c.due_date DESC
+    """, (class_name,) if student_ids is None else (class_name, json.dumps(list(student_ids))))
+    rows = cursor.fetchall()
     conn.close()
-    return challan, items
+    return rows
 
 def get_unpaid_challans(student_id):
     conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM challans WHERE student_id = ? AND status = 'Unpaid'", (student_id,))
+    cursor.row_factory = _rows_as(Challan)
+    cursor.execute(f"SELECT {CHALLAN_SELECT} FROM challans WHERE student_id = ? AND status = 'Unpaid'", (student_id,))
     unpaid_challans = cursor.fetchall()
     conn.close()
     return unpaid_challans
 
 def pay_challan(challan_id, payment_date):
+    """Records a payment of whatever is still outstanding on one challan."""
     conn = connect_db()
     cursor = conn.cursor()
     cursor.execute("""
-        UPDATE challans SET status = 'Paid', payment_date = ?
+        SELECT student_id, challan_id, total_amount - amount_paid FROM challans
+        WHERE challan_id = ? AND status = 'Unpaid'
+    """, (challan_id,))
+    row = cursor.fetchone()
+    if row:
+        _record_payment(cursor, row[0], row[2], payment_date, [row[1:]])
+    conn.commit()
+    conn.close()
+    _changed()
+
+# === PAYMENT ALLOCATION ===
+
+# Adds one allocation to the daily rollup; params are (payment_date, settled 0/1, amount, challan_id).
+# challan_count counts challans settled that day, amount is the cash applied.
+COLLECTION_UPSERT = """
+    INSERT INTO collection_daily (collection_date, class_name, challan_count, amount)
+    SELECT ?, COALESCE(s.class_into_which_admission_is_sought, ''), ?, ?
+    FROM challans c JOIN students s ON s.student_id = c.student_id
+    WHERE c.challan_id = ?
+    ON CONFLICT (collection_date, class_name) DO UPDATE SET
+        challan_count = challan_count + excluded.challan_count,
+        amount = amount + excluded.amount
+"""
+
+# Marks paid the family vouchers whose children are all settled once a challan is paid;
+# params are (challan_id, payment_date). Vouchers of challans carried forward into the
+# paid challan are checked too, and a carried-forward child counts as settled only
+# once the challan its balance ended up on is paid.
+FAMILY_VOUCHER_SETTLE = """
+    WITH RECURSIVE feeders (challan_id) AS (
+        SELECT ?
+        UNION SELECT c.challan_id FROM challans c JOIN feeders f ON c.carried_forward_to = f.challan_id
+    ), vouchers (voucher_id) AS (
+        SELECT family_voucher_id FROM challans WHERE challan_id IN feeders AND family_voucher_id IS NOT NULL
+    ), chain (voucher_id, status, next) AS (
+        SELECT family_voucher_id, status, carried_forward_to FROM challans WHERE family_voucher_id IN vouchers
+        UNION SELECT chain.voucher_id, c.status, c.carried_forward_to
+        FROM chain JOIN challans c ON c.challan_id = chain.next WHERE chain.status = 'Carried Forward'
+    )
+    UPDATE family_vouchers SET status = 'Paid', payment_date = ?
+    WHERE status = 'Unpaid' AND voucher_id IN vouchers
+      AND voucher_id NOT IN (SELECT voucher_id FROM chain WHERE status = 'Unpaid')
+"""
+
+def _open_challans(cursor, student_id):
+    """[(challan_id, outstanding)] of a student's unpaid challans, oldest due first."""
+    cursor.execute("""
+        SELECT challan_id, total_amount - amount_paid FROM challans
+        WHERE student_id = ? AND status = 'Unpaid'
+        ORDER BY due_date, challan_id
+    """, (student_id,))
+    return cursor.fetchall()
+
+def _fifo_allocate(open_challans, amount):
+    """Splits amount over [(challan_id, outstanding)] in order. Returns ([(challan_id, applied, settled)], unapplied)."""
+    allocations = []
+    remaining = round(float(amount), 2)
+    for challan_id, outstanding in open_challans:
+        if remaining <= 0: break
+        outstanding = round(outstanding, 2)
+        if outstanding <= 0: continue
+        applied = min(remaining, outstanding)
+        remaining = round(remaining - applied, 2)
+        allocations.append((challan_id, applied, applied >= outstanding))
+    return allocations, remaining
+
+def _record_payment(cursor, student_id, amount, payment_date, open_challans, method=None, reference=None):
+    """
+    Inserts the payment and applies it to open_challans in order, on the
+    caller's transaction. Returns (payment_id, allocations, unapplied), or None
+    if the reference was already recorded. What is left over stays on the
+    payment as credit for the student's next challan (see _apply_credit).
+    """
+    if reference:
+        cursor.execute("SELECT 1 FROM payments WHERE reference = ?", (reference,))
+        if cursor.fetchone():
+            return None
+    allocations, unapplied = _fifo_allocate(open_challans, amount)
+    cursor.execute("""
+        INSERT INTO payments (student_id, payment_date, amount, unapplied, method, reference)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (student_id, payment_date, float(amount), unapplied, method, reference or None))
+    payment_id = cursor.lastrowid
+    _apply_allocations(cursor, payment_id, payment_date, allocations)
+    return payment_id, allocations, unapplied
+
+def _apply_allocations(cursor, payment_id, payment_date, allocations):
+    # Writes [(challan_id, applied, settled)] of one payment and everything that follows from them
+    cursor.executemany("""
+        INSERT INTO payment_allocations (payment_id, challan_id, amount) VALUES (?, ?, ?)
+        ON CONFLICT (payment_id, challan_id) DO UPDATE SET amount = amount + excluded.amount
+    """, [(payment_id, cid, applied) for cid, applied, _ in allocations])
+    cursor.executemany("""
+        UPDATE challans SET
+            amount_paid = amount_paid + ?,
+            status = CASE WHEN ? THEN 'Paid' ELSE status END,
+            payment_date = CASE WHEN ? THEN ? ELSE payment_date END
         WHERE challan_id = ?
-    """, (payment_date, challan_id))
+    """, [(applied, settled, settled, payment_date, cid) for cid, applied, settled in allocations])
+    cursor.executemany(COLLECTION_UPSERT, [(payment_date, int(settled), applied, cid) for cid, applied, settled in allocations])
+    cursor.executemany(FAMILY_VOUCHER_SETTLE, [(cid, payment_date) for cid, _, settled in allocations if settled])
+
+def _apply_credit(cursor, student_ids):
+    """
+    Applies the unapplied credit of the students' earlier payments to their open
+    challans oldest-first, on the caller's transaction. Run after challans are
+    created, so an overpayment settles (part of) the next challan.
+    """
+    cursor.execute("""
+        SELECT payment_id, student_id, payment_date, unapplied FROM payments
+        WHERE student_id IN (SELECT value FROM json_each(?)) AND unapplied > 0
+        ORDER BY student_id, payment_date, payment_id
+    """, (json.dumps(sorted(set(student_ids))),))
+    open_map = {}
+    for payment_id, student_id, payment_date, credit in cursor.fetchall():
+        if student_id not in open_map:
+            open_map[student_id] = [list(row) for row in _open_challans(cursor, student_id)]
+        allocations, left = _fifo_allocate(open_map[student_id], credit)
+        if not allocations: continue
+        _apply_allocations(cursor, payment_id, payment_date, allocations)
+        cursor.execute("UPDATE payments SET unapplied = ? WHERE payment_id = ?", (left, payment_id))
+        applied = dict((cid, a) for cid, a, _ in allocations)
+        for item in open_map[student_id]:
+            item[1] -= applied.get(item[0], 0)
+
+def allocate_payment(student_id, amount, payment_date, method="Cash", reference=None):
+    """
+    Applies a payment across the student's unpaid challans oldest-first in one
+    transaction; the last challan touched may be left partly paid. Returns
+    (payment_id, [(challan_id, applied, settled)], unapplied amount), or None
+    if the reference was already recorded.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        result = _record_payment(cursor, student_id, amount, payment_date, _open_challans(cursor, student_id), method, reference)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _changed()
+    return result
+
+def allocate_payments_bulk(payments):
+    """
+    Applies many payments (student_id, amount, payment_date, method, reference)
+    in one transaction, e.g. from a bank reconciliation file. Open challans of
+    every student involved are read in one query and consumed in memory, so
+    later payments in the batch see earlier ones. Payments are applied in date
+    order; a reference already on file is skipped, so re-running a file is safe.
+    """
+    payments = sorted(payments, key=lambda p: (p[2], int(p[0])))
+    if payments: _snapshot_before("reconcile-payments")
+    wanted = set(int(p[0]) for p in payments)
+    summary = {"recorded": 0, "skipped": 0, "amount": 0.0, "unapplied": 0.0, "unknown_students": []}
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT student_id FROM students")
+        known = set(row[0] for row in cursor.fetchall()) & wanted
+        open_map = {}
+        cursor.execute("""
+            SELECT student_id, challan_id, total_amount - amount_paid FROM challans
+            WHERE status = 'Unpaid' ORDER BY student_id, due_date, challan_id
+        """)
+        for sid, challan_id, outstanding in cursor:
+            if sid in known: open_map.setdefault(sid, []).append([challan_id, outstanding])
+        for student_id, amount, payment_date, method, reference in payments:
+            student_id = int(student_id)
+            if student_id not in known:
+                summary["unknown_students"].append(student_id)
+                continue
+            open_challans = open_map.get(student_id, [])
+            result = _record_payment(cursor, student_id, amount, payment_date, open_challans, method, reference)
+            if result is None:
+                summary["skipped"] += 1
+                continue
+            _, allocations, unapplied = result
+            applied = dict((cid, a) for cid, a, _ in allocations)
+            for item in open_challans:
+                item[1] -= applied.get(item[0], 0)
+            open_map[student_id] = [item for item in open_challans if round(item[1], 2) > 0]
+            summary["recorded"] += 1
+            summary["amount"] += float(amount)
+            summary["unapplied"] += unapplied
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _changed()
+    return summary
+
+def get_student_balance(student_id):
+    """Outstanding amount on the student's open challans, kept current by triggers on challans."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT balance FROM students WHERE student_id = ?", (student_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row and row[0] else 0
+
+def get_payments_by_student_id(student_id):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT payment_id, payment_date, amount, unapplied, method, reference FROM payments
+        WHERE student_id = ? ORDER BY payment_date DESC, payment_id DESC
+    """, (student_id,))
+    payments = cursor.fetchall()
+    conn.close()
+    return payments
+
+def _rebuild_student_balances(cursor):
+    cursor.execute("""
+        UPDATE students SET balance = COALESCE((
+            SELECT SUM(c.total_amount - c.amount_paid) FROM challans c
+            WHERE c.student_id = students.student_id AND c.status = 'Unpaid'), 0)
+    """)
+
+def rebuild_student_balances():
+    """Recomputes every students.balance from the open challans."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    _rebuild_student_balances(cursor)
+    conn.commit()
+    conn.close()
+
+def _rebuild_collection_daily(cursor, prefix="", dates=None):
+    # prefix "all_" reads the archive union views of a connect_history() connection;
+    # dates limits the rebuild to those days (replication refreshes only what it touched)
+    where, params = ("", ()) if dates is None else (" AND {} IN (SELECT value FROM json_each(?))", (json.dumps(sorted(dates)),))
+    cursor.execute("DELETE FROM collection_daily WHERE 1" + where.format("collection_date"), params)
+    # Cash applied per day and class, then the challans settled on each day
+    cursor.execute(f"""
+        INSERT INTO collection_daily (collection_date, class_name, challan_count, amount)
+        SELECT p.payment_date, COALESCE(s.class_into_which_admission_is_sought, ''), 0, SUM(a.amount)
+        FROM {prefix}payment_allocations a
+        JOIN payments p ON p.payment_id = a.payment_id
+        JOIN {prefix}challans c ON c.challan_id = a.challan_id
+        JOIN students s ON s.student_id = c.student_id
+        WHERE 1{where.format("p.payment_date")}
+        GROUP BY p.payment_date, s.class_into_which_admission_is_sought
+    """, params)
+    cursor.execute(f"""
+        INSERT INTO collection_daily (collection_date, class_name, challan_count, amount)
+        SELECT c.payment_date, COALESCE(s.class_into_which_admission_is_sought, ''), COUNT(*), 0
+        FROM {prefix}challans c JOIN students s ON s.student_id = c.student_id
+        WHERE c.status = 'Paid' AND c.payment_date IS NOT NULL{where.format("c.payment_date")}
+        GROUP BY c.payment_date, s.class_into_which_admission_is_sought
+        ON CONFLICT (collection_date, class_name) DO UPDATE SET challan_count = excluded.challan_count
+    """, params)
+
+def rebuild_collection_daily():
+    """Recomputes the whole collection_daily rollup from the payments and challans tables, archives included."""
+    conn = connect_history()
+    cursor = conn.cursor()
+    _rebuild_collection_daily(cursor, "all_")
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM collection_daily")
+    rows = cursor.fetchone()[0]
+    conn.close()
+    return rows
+
+# Students per committed batch in create_challans_bulk
+GENERATION_CHUNK = 500
+
+def _family_chunks(students, size):
+    """Splits (sid, class, family_id) rows into batches of about size, never splitting a family."""
+    chunk = []
+    for row in students:
+        if len(chunk) >= size and (row[2] is None or row[2] != chunk[-1][2]):
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+def create_challans_bulk(student_ids, issue_date, due_date, default_items=None, carry_arrears=True, family_vouchers=False,
+                         billing_period=None, kind="Monthly"):
+    """
+    Generates one challan per student for billing_period (default: the issue
+    month). Fee items come from the compiled fee plans (see compile_fee_plans),
+    so no per-student fee queries are made. With carry_arrears, the unpaid
+    balance is added as arrears on the new challan and the old challans are
+    marked 'Carried Forward'. With family_vouchers, siblings generated together
+    are also grouped under one family voucher (see pay_family_voucher).
+
+    Students that already have a challan of this kind for the period are
+    skipped, and work is committed in batches of GENERATION_CHUNK students
+    (siblings kept together), so re-running after a crash or a partial run
+    only generates the missing challans.
+    Returns the list of new challan ids.
+    """
+    _snapshot_before("generate-vouchers")
+    compiled = compile_fee_plans()
+    billing_period = billing_period or issue_date[:7]
+    wanted = set(int(sid) for sid in student_ids)
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT student_id, class_into_which_admission_is_sought, family_id
+        FROM students WHERE status = 'Active'
+    """)
+    students = cursor.fetchall()
+    sibling_rank = _rank_siblings(students)
+    selected = sorted((row for row in students if row[0] in wanted), key=lambda r: (r[2] is None, r[2] or 0, r[0]))
+
+    new_ids = []
+    try:
+        for chunk in _family_chunks(selected, GENERATION_CHUNK):
+            new_ids.extend(_generate_chunk(cursor, chunk, compiled, sibling_rank, issue_date, due_date, default_items,
+                                           carry_arrears, family_vouchers, billing_period, kind))
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        _changed() # chunks already committed are published even if a later one failed
+    return new_ids
+
+def _generate_chunk(cursor, chunk, compiled, sibling_rank, issue_date, due_date, default_items,
+                    carry_arrears, family_vouchers, billing_period, kind):
+    cursor.execute("BEGIN IMMEDIATE")
+    marks = ",".join("?" * len(chunk))
+    chunk_ids = [row[0] for row in chunk]
+    cursor.execute(f"""
+        SELECT student_id FROM challans
+        WHERE student_id IN ({marks}) AND billing_period = ? AND kind = ?
+    """, chunk_ids + [billing_period, kind])
+    done = set(row[0] for row in cursor.fetchall())
+    arrears_map = {}
+    last_id = 0
+    if carry_arrears:
+        cursor.execute("SELECT COALESCE(MAX(challan_id), 0) FROM challans")
+        last_id = cursor.fetchone()[0]
+        cursor.execute(f"""
+            SELECT student_id, SUM(total_amount - amount_paid), MIN(COALESCE(arrears_due_date, due_date)) FROM challans
+            WHERE student_id IN ({marks}) AND status = 'Unpaid' GROUP BY student_id
+        """, chunk_ids)
+        arrears_map = {sid: (arrears, owed_since) for sid, arrears, owed_since in cursor.fetchall()}
+
+    new_ids = []
+    item_rows = []
+    carried_rows = []
+    by_family = {}
+    for sid, s_class, family_id in chunk:
+        if sid in done: continue
+        items = build_fee_items(compiled, s_class, sibling_rank.get(sid, 1), default_items)
+        arrears, owed_since = arrears_map.get(sid) or (0, None)
+        arrears = arrears or 0
+        total_amount = sum(amount for _, amount in items) + arrears
+        # Carried arrears keep the due date they were first owed on (arrears_due_date)
+        cursor.execute("""
+            INSERT INTO challans (student_id, issue_date, due_date, status, total_amount, arrears, arrears_due_date, fine, billing_period, kind)
+            VALUES (?, ?, ?, 'Unpaid', ?, ?, ?, 0, ?, ?)
+            ON CONFLICT (student_id, billing_period, kind) DO NOTHING
+        """, (sid, issue_date, due_date, total_amount, arrears, owed_since if arrears else None, billing_period, kind))
+        if not cursor.rowcount: continue
+        challan_id = cursor.lastrowid
+        new_ids.append(challan_id)
+        item_rows.extend((challan_id, desc, amount) for desc, amount in items)
+        if arrears:
+            carried_rows.append((challan_id, sid, last_id))
+        if family_id is not None:
+            by_family.setdefault(family_id, []).append((challan_id, total_amount))
+    cursor.executemany("INSERT INTO challan_items (challan_id, description, amount) VALUES (?, ?, ?)", item_rows)
+    cursor.executemany("""
+        UPDATE challans SET status = 'Carried Forward', carried_forward_to = ?
+        WHERE student_id = ? AND status = 'Unpaid' AND challan_id <= ?
+    """, carried_rows)
+    if family_vouchers:
+        for family_id, members in by_family.items():
+            if len(members) < 2: continue
+            cursor.execute("""
+                INSERT INTO family_vouchers (family_id, issue_date, due_date, status, total_amount)
+                VALUES (?, ?, ?, 'Unpaid', ?)
+            """, (family_id, issue_date, due_date, sum(total for _, total in members)))
+            voucher_id = cursor.lastrowid
+            cursor.executemany("UPDATE challans SET family_voucher_id = ? WHERE challan_id = ?",
+                               [(voucher_id, challan_id) for challan_id, _ in members])
+    if new_ids:
+        _apply_credit(cursor, chunk_ids)
+    return new_ids
+
+def accrue_fines(as_of=None, per_day=10, cap=0, grace_days=0):
+    """
+    Recomputes the late fine of every overdue unpaid challan in one UPDATE.
+    fine = min(cap, max(0, days_late - grace_days) * per_day); cap <= 0 means no cap.
+    The fine is recomputed from scratch (not added to), so running again for
+    the same as_of date changes nothing. Returns the number of challans updated.
+    """
+    as_of = as_of or datetime.date.today().strftime("%Y-%m-%d")
+    params = {
+        "as_of": as_of,
+        "per_day": float(per_day),
+        "cap": float(cap) if cap and float(cap) > 0 else 1e18,
+        "grace": int(float(grace_days or 0)),
+    }
+    fine_expr = """MIN(:cap, MAX(0, CAST(julianday(:as_of) - julianday(due_date) AS INTEGER) - :grace) * :per_day)"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    # All right-hand sides see the old row, so total_amount - fine removes the previous fine
+    cursor.execute(f"""
+        UPDATE challans SET
+            total_amount = total_amount - fine + {fine_expr},
+            fine = {fine_expr},
+            fine_as_of = :as_of
+        WHERE status = 'Unpaid' AND due_date < :as_of
+          AND (fine <> {fine_expr} OR fine_as_of IS NOT :as_of)
+    """, params)
+    updated = cursor.rowcount
     conn.commit()
     conn.close()
+    _changed()
+    return updated
 
 def check_login(username, password):
     """Verifies username and password."""
@@ -263,11 +1400,479 @@ def update_password(username, new_password):
     conn.close()
     return True
 
+# === FEE PLAN FUNCTIONS ===
+
+# Compiled {class: items} lookup plus active discount rules, built once and
+# reused by every bulk generation until a plan or rule changes: (version, compiled),
+# checked against fee_plan_version so edits made by other processes are seen too.
+_fee_plan_cache = None
+
+def invalidate_fee_plan_cache():
+    global _fee_plan_cache
+    _fee_plan_cache = None
+
+def compile_fee_plans():
+    """Loads every fee plan and active discount rule into an in-memory lookup."""
+    global _fee_plan_cache
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM fee_plan_version WHERE id = 1")
+    version = cursor.fetchone()[0]
+    if _fee_plan_cache is not None and _fee_plan_cache[0] == version:
+        conn.close()
+        return _fee_plan_cache[1]
+    cursor.execute("SELECT class_name, description, amount FROM fee_plans ORDER BY class_name, plan_id")
+    plans = {}
+    for class_name, desc, amount in cursor.fetchall():
+        plans.setdefault(class_name, []).append((desc, amount))
+    cursor.execute("""
+        SELECT name, rule_type, class_name, applies_to, min_count, percent, flat_amount
+        FROM discount_rules WHERE active = 1 ORDER BY rule_id
+    """)
+    rules = cursor.fetchall()
+    conn.close()
+    compiled = {
+        "plans": {cls: tuple(items) for cls, items in plans.items()},
+        "rules": tuple(rules),
+    }
+    _fee_plan_cache = (version, compiled)
+    return compiled
+
+def build_fee_items(compiled, class_name, sibling_rank=1, default_items=None):
+    """Returns the (description, amount) lines for one student, discounts as negative lines."""
+    items = list(compiled["plans"].get(class_name) or default_items or [])
+    discounts = []
+    for name, rule_type, rule_class, applies_to, min_count, percent, flat_amount in compiled["rules"]:
+        if rule_class and rule_class != class_name: continue
+        if rule_type == "sibling" and sibling_rank < (min_count or 2): continue
+        if rule_type not in ("sibling", "class"): continue
+        base = sum(amount for desc, amount in items if not applies_to or desc == applies_to)
+        discount = round(base * (percent or 0) / 100.0 + (flat_amount or 0), 2)
+        discount = min(discount, base)
+        if discount > 0:
+            discounts.append((name, -discount))
+    return items + discounts
+
+def _rank_siblings(students):
+    """Maps student_id -> 1-based position among siblings (oldest record first)."""
+    counters = {}
+    ranks = {}
+    for sid, _, family_id in sorted(students):
+        if family_id is None:
+            ranks[sid] = 1
+            continue
+        counters[family_id] = counters.get(family_id, 0) + 1
+        ranks[sid] = counters[family_id]
+    return ranks
+
+def get_fee_plan(class_name):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT plan_id, description, amount FROM fee_plans WHERE class_name = ? ORDER BY plan_id", (class_name,))
+    items = cursor.fetchall()
+    conn.close()
+    return items
+
+def set_fee_plan_item(class_name, description, amount):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO fee_plans (class_name, description, amount) VALUES (?, ?, ?)
+        ON CONFLICT (class_name, description) DO UPDATE SET amount = excluded.amount
+    """, (class_name, description, amount))
+    conn.commit()
+    conn.close()
+    invalidate_fee_plan_cache()
+
+def delete_fee_plan_item(plan_id):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM fee_plans WHERE plan_id = ?", (plan_id,))
+    conn.commit()
+    conn.close()
+    invalidate_fee_plan_cache()
+
+def get_discount_rules():
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT rule_id, name, rule_type, class_name, applies_to, min_count, percent, flat_amount, active FROM discount_rules ORDER BY rule_id")
+    rules = cursor.fetchall()
+    conn.close()
+    return rules
+
+def add_discount_rule(name, rule_type="sibling", class_name=None, applies_to=None, min_count=2, percent=0, flat_amount=0):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO discount_rules (name, rule_type, class_name, applies_to, min_count, percent, flat_amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (name, rule_type, class_name, applies_to, min_count, percent, flat_amount))
+    conn.commit()
+    rule_id = cursor.lastrowid
+    conn.close()
+    invalidate_fee_plan_cache()
+    return rule_id
+
+def delete_discount_rule(rule_id):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM discount_rules WHERE rule_id = ?", (rule_id,))
+    conn.commit()
+    conn.close()
+    invalidate_fee_plan_cache()
+
+# === FAMILY FUNCTIONS ===
+
+def _family_key(father_name, contact_details):
+    name = fold_name(father_name)
+    digits = contact_digits(contact_details)
+    if not name or not digits:
+        return None
+    return f"{name}|{digits}"
+
+def _assign_family(cursor, student_id, father_name, contact_details):
+    key = _family_key(father_name, contact_details)
+    if key is None:
+        cursor.execute("UPDATE students SET family_id = NULL WHERE student_id = ?", (student_id,))
+        return
+    cursor.execute("""
+        INSERT INTO families (family_key, father_name, contact_details) VALUES (?, ?, ?)
+        ON CONFLICT (family_key) DO NOTHING
+    """, (key, father_name, contact_details))
+    cursor.execute("""
+        UPDATE students SET family_id = (SELECT family_id FROM families WHERE family_key = ?)
+        WHERE student_id = ?
+    """, (key, student_id))
+
+def _rebuild_families(cursor):
+    cursor.execute("SELECT student_id, father_name, contact_details FROM students")
+    families = {}
+    links = []
+    for sid, father_name, contact in cursor.fetchall():
+        key = _family_key(father_name, contact)
+        if key is not None:
+            families.setdefault(key, (father_name, contact))
+        links.append((key, sid))
+    cursor.executemany("""
+        INSERT INTO families (family_key, father_name, contact_details) VALUES (?, ?, ?)
+        ON CONFLICT (family_key) DO NOTHING
+    """, [(key, father, contact) for key, (father, contact) in families.items()])
+    cursor.execute("SELECT family_key, family_id FROM families")
+    ids = dict(cursor.fetchall())
+    cursor.executemany("UPDATE students SET family_id = ? WHERE student_id = ?", [(ids.get(key), sid) for key, sid in links])
+    cursor.execute("""
+        DELETE FROM families WHERE family_id NOT IN (SELECT family_id FROM students WHERE family_id IS NOT NULL)
+          AND family_id NOT IN (SELECT family_id FROM family_vouchers)
+    """)
+
+def rebuild_families():
+    """Re-links every student to a family in one pass over the students table."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    _rebuild_families(cursor)
+    conn.commit()
+    cursor.execute("""
+        SELECT COUNT(*) FROM (SELECT family_id FROM students WHERE family_id IS NOT NULL
+        GROUP BY family_id HAVING COUNT(*) > 1)
+    """)
+    multi = cursor.fetchone()[0]
+    conn.close()
+    return multi
+
+def get_family_members(family_id):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT student_id, full_name, class_into_which_admission_is_sought, status
+        FROM students WHERE family_id = ? ORDER BY student_id
+    """, (family_id,))
+    members = cursor.fetchall()
+    conn.close()
+    return members
+
+def get_family_vouchers_for_challans(challan_ids):
+    if not challan_ids: return []
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT DISTINCT family_voucher_id FROM challans
+        WHERE family_voucher_id IS NOT NULL AND challan_id IN ({",".join("?" * len(challan_ids))})
+        ORDER BY family_voucher_id
+    """, list(challan_ids))
+    vouchers = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return vouchers
+
+def get_challan_family_voucher(challan_id):
+    """Returns (voucher_id, status, outstanding, children) for the family voucher covering a challan, or None."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT fv.voucher_id, fv.status,
+               (SELECT COALESCE(SUM(m.total_amount - m.amount_paid), 0) FROM challans m
+                WHERE m.family_voucher_id = fv.voucher_id AND m.status = 'Unpaid'),
+               (SELECT COUNT(*) FROM challans m WHERE m.family_voucher_id = fv.voucher_id)
+        FROM challans c JOIN family_vouchers fv ON fv.voucher_id = c.family_voucher_id
+        WHERE c.challan_id = ?
+    """, (challan_id,))
+    voucher = cursor.fetchone()
+    conn.close()
+    return voucher
+
+def get_family_voucher_details(voucher_ids):
+    """
+    Loads vouchers with their children in one query.
+    Returns [(voucher, children)] where voucher = (voucher_id, issue_date, due_date, status,
+    total_amount, father_name, contact_details) and each child = (challan_id, student_id,
+    full_name, class, total_amount, arrears, fine, status, amount_paid). The stored
+    total_amount is the total at issue; what is still due comes from the children.
+    """
+    if not voucher_ids: return []
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT fv.voucher_id, fv.issue_date, fv.due_date, fv.status, fv.total_amount, f.father_name, f.contact_details,
+               c.challan_id, s.student_id, s.full_name, s.class_into_which_admission_is_sought,
+               c.total_amount, c.arrears, c.fine, c.status, c.amount_paid
+        FROM family_vouchers fv
+        JOIN families f ON f.family_id = fv.family_id
+        JOIN challans c ON c.family_voucher_id = fv.voucher_id
+        JOIN students s ON s.student_id = c.student_id
+        WHERE fv.voucher_id IN ({",".join("?" * len(voucher_ids))})
+        ORDER BY fv.voucher_id, s.student_id
+    """, list(voucher_ids))
+    rows = cursor.fetchall()
+    conn.close()
+    details = []
+    for row in rows:
+        if not details or details[-1][0][0] != row[0]:
+            details.append((row[:7], []))
+        details[-1][1].append(row[7:])
+    return details
+
+def pay_family_voucher(voucher_id, payment_date):
+    """
+    Pays off every unpaid child challan on a family voucher, in one transaction.
+    The voucher is marked paid only once every child is settled; a child carried
+    forward into a challan that is still unpaid keeps it open.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT student_id, challan_id, total_amount - amount_paid FROM challans
+            WHERE family_voucher_id = ? AND status = 'Unpaid'
+        """, (voucher_id,))
+        children = cursor.fetchall()
+        for student_id, challan_id, outstanding in children:
+            _record_payment(cursor, student_id, outstanding, payment_date, [(challan_id, outstanding)], "Family Voucher")
+        cursor.execute("SELECT MIN(challan_id) FROM challans WHERE family_voucher_id = ?", (voucher_id,))
+        cursor.execute(FAMILY_VOUCHER_SETTLE, (cursor.fetchone()[0], payment_date))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _changed()
+    return [challan_id for _, challan_id, _ in children]
+
+# === ARCHIVAL ===
+
+ARCHIVE_DIR = "archive"
+# Tables whose settled rows move to the yearly archives, parents first
+ARCHIVED_TABLES = ("challans", "challan_items", "payment_allocations")
+# SQLite attaches at most 10 databases per connection; the live one is main
+MAX_ATTACHED_ARCHIVES = 9
+
+# (challan_id, year) of settled challans issued before :before: paid ones, and carried-forward
+# ones whose balance ended up on a challan that is paid (or already archived)
+ARCHIVABLE_CHALLANS = """
+    WITH RECURSIVE chain (challan_id, next) AS (
+        SELECT challan_id, carried_forward_to FROM challans
+        WHERE status = 'Carried Forward' AND carried_forward_to IS NOT NULL AND issue_date < :before
+        UNION SELECT chain.challan_id, c.carried_forward_to FROM chain JOIN challans c ON c.challan_id = chain.next
+        WHERE c.status = 'Carried Forward'
+    )
+    SELECT challan_id, CAST(substr(issue_date, 1, 4) AS INTEGER) AS year FROM challans
+    WHERE issue_date < :before AND (status = 'Paid' OR (
+        status = 'Carried Forward' AND carried_forward_to IS NOT NULL AND challan_id NOT IN (
+            SELECT chain.challan_id FROM chain JOIN challans c ON c.challan_id = chain.next WHERE c.status = 'Unpaid')))
+"""
+
+def archive_path(year):
+    return os.path.join(ARCHIVE_DIR, f"school_archive_{year}.db")
+
+def list_archives():
+    """Returns [(year, path)] of existing archive databases, newest first."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    found = []
+    for name in os.listdir(ARCHIVE_DIR):
+        m = re.match(r"^school_archive_(\d{4})\.db$", name)
+        if m: found.append((int(m.group(1)), os.path.join(ARCHIVE_DIR, name)))
+    return sorted(found, reverse=True)
+
+def _columns(cursor, schema, table):
+    cursor.execute(f"PRAGMA {schema}.table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+def connect_history():
+    """
+    A read connection with the yearly archives attached and TEMP union views
+    all_challans, all_challan_items and all_payment_allocations over live and
+    archived rows (columns in the live table's order). Without archives the
+    views cover the live tables only.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    schemas = []
+    for year, path in list_archives()[:MAX_ATTACHED_ARCHIVES]:
+        cursor.execute(f"ATTACH DATABASE ? AS arch_{year}", (path,))
+        schemas.append(f"arch_{year}")
+    for table in ARCHIVED_TABLES:
+        columns = _columns(cursor, "main", table)
+        selects = [f"SELECT {', '.join(columns)} FROM main.{table}"]
+        for schema in schemas:
+            present = set(_columns(cursor, schema, table))
+            if not present: continue
+            selects.append(f"SELECT {', '.join(c if c in present else 'NULL' for c in columns)} FROM {schema}.{table}")
+        cursor.execute(f"CREATE TEMP VIEW all_{table} AS {' UNION ALL '.join(selects)}")
+    return conn
+
+def _prepare_archive(cursor, schema):
+    """Creates/extends the archive's copies of the archived tables to match the live columns."""
+    for table in ARCHIVED_TABLES:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{table} AS SELECT * FROM main.{table} WHERE 0")
+        present = set(_columns(cursor, schema, table))
+        for column in _columns(cursor, "main", table):
+            if column not in present:
+                cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {column}")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_challans_student ON challans (student_id)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_challans_id ON challans (challan_id)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_challan_items_challan ON challan_items (challan_id)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_allocations_challan ON payment_allocations (challan_id)")
+
+def archive_paid_challans(before, vacuum=False):
+    """
+    Moves settled challans issued before `before` (YYYY-MM-DD), with their items
+    and payment allocations, into archive/school_archive_<issue year>.db: paid
+    ones, and carried-forward ones once the challan their balance moved to is paid. All
+    affected years move in one transaction across the attached databases, and
+    each archive written to is snapshotted afterwards (see backup.py).
+    Payments, balances and the collection rollup stay in the live database.
+    Returns {year: challans moved}.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT year, COUNT(*) FROM ({ARCHIVABLE_CHALLANS}) GROUP BY 1 ORDER BY 1", {"before": before})
+    counts = {int(year): n for year, n in cursor.fetchall()}
+    if not counts:
+        conn.close()
+        return {}
+    if len(counts) > MAX_ATTACHED_ARCHIVES:
+        conn.close()
+        raise ValueError(f"Archive at most {MAX_ATTACHED_ARCHIVES} years per run; choose an earlier cutoff first.")
+    conn.close()
+    _snapshot_before("archive-challans")
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        for year in counts:
+            cursor.execute(f"ATTACH DATABASE ? AS arch_{year}", (archive_path(year),))
+            _prepare_archive(cursor, f"arch_{year}")
+        conn.commit()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"CREATE TEMP TABLE archive_batch AS {ARCHIVABLE_CHALLANS}", {"before": before})
+        for year in counts:
+            schema = f"arch_{year}"
+            for table in ARCHIVED_TABLES:
+                columns = ", ".join(_columns(cursor, "main", table))
+                cursor.execute(f"""
+                    INSERT INTO {schema}.{table} ({columns}) SELECT {columns} FROM main.{table}
+                    WHERE challan_id IN (SELECT challan_id FROM archive_batch WHERE year = ?)
+                """, (year,))
+        for table in reversed(ARCHIVED_TABLES):
+            cursor.execute(f"DELETE FROM main.{table} WHERE challan_id IN (SELECT challan_id FROM archive_batch)")
+        cursor.execute("DROP TABLE archive_batch")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        for year in counts:
+            try: cursor.execute(f"DETACH DATABASE arch_{year}")
+            except sqlite3.OperationalError: pass
+        conn.close()
+    _changed()
+    _snapshot_archives(counts)
+    if vacuum:
+        conn = connect_db()
+        conn.execute("VACUUM")
+        conn.close()
+    return counts
+
+# === CHANGE FEED ===
+
+CHANGE_LOG_KEEP_DAYS = 30
+
+def get_change_seq():
+    """Sequence number of the newest change (0 before any)."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def get_changes_since(seq, limit=None):
+    """
+    Changes after seq, oldest first (at most limit of them). Returns None when
+    entries after seq have been pruned; the caller has to reload everything.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT (SELECT MIN(seq) FROM change_log),
+               (SELECT seq FROM sqlite_sequence WHERE name = 'change_log')
+    """)
+    oldest, newest = cursor.fetchone()
+    if seq < (oldest or (newest or 0) + 1) - 1:
+        conn.close()
+        return None
+    cursor.row_factory = _rows_as(Change)
+    cursor.execute("""
+        SELECT seq, entity, entity_id, operation, student_id, changed_at FROM change_log
+        WHERE seq > ? ORDER BY seq LIMIT ?
+    """, (seq, -1 if limit is None else limit))
+    changes = cursor.fetchall()
+    conn.close()
+    return changes
+
+def prune_change_log(keep_days=CHANGE_LOG_KEEP_DAYS):
+    """Deletes change log entries older than keep_days. Returns the number removed."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM change_log WHERE changed_at < datetime('now', 'localtime', ?)", (f"-{int(keep_days)} days",))
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
 # === REPORTING FUNCTIONS (UPDATED FOR DEFAULTER LOGIC) ===
 
-def get_student_fee_summary():
+# Part of an unpaid challan c that is overdue on {d}. Arrears carried forward keep
+# the due date they were first owed on (arrears_due_date) and are paid off first.
+OVERDUE_SQL = """CASE WHEN c.due_date < {d} THEN c.total_amount - c.amount_paid
+    WHEN c.arrears_due_date < {d} THEN MAX(c.arrears - c.amount_paid, 0) ELSE 0 END"""
+
+def get_student_fee_summary(student_ids=None):
     """
     Separates 'Overdue' (Defaulters) from 'Pending' (Not yet overdue).
+    student_ids limits the summary to those students.
     """
     conn = connect_db()
     cursor = conn.cursor()
@@ -280,58 +1885,74 @@ def get_student_fee_summary():
             s.full_name, 
             s.class_into_which_admission_is_sought, 
             s.contact_details,
-            SUM(CASE WHEN c.status = 'Unpaid' AND c.due_date < '{today}' THEN c.total_amount ELSE 0 END) as overdue_amount,
-            SUM(CASE WHEN c.status = 'Unpaid' AND c.due_date >= '{today}' THEN c.total_amount ELSE 0 END) as pending_amount
+            SUM(CASE WHEN c.status = 'Unpaid' THEN {OVERDUE_SQL.format(d=f"'{today}'")} ELSE 0 END) as overdue_amount,
+            SUM(CASE WHEN c.status = 'Unpaid' THEN c.total_amount - c.amount_paid - ({OVERDUE_SQL.format(d=f"'{today}'")}) ELSE 0 END) as pending_amount
         FROM students s
         LEFT JOIN challans c ON s.student_id = c.student_id
-        WHERE s.status = 'Active'
+        WHERE s.status = 'Active' {"AND s.student_id IN (SELECT value FROM json_each(?))" if student_ids is not None else ""}
         GROUP BY s.student_id
         ORDER BY overdue_amount DESC, s.full_name ASC
-    """)
+    """, () if student_ids is None else (json.dumps(list(student_ids)),))
     summary = cursor.fetchall()
     conn.close()
     return summary
 
-def get_classwise_defaulter_list():
-    # Returns students who have OVERDUE amounts only
+def iter_classwise_defaulters():
+    """Yields (class, name, overdue total) ordered by class, straight off the cursor."""
     conn = connect_db()
     cursor = conn.cursor()
     today = datetime.date.today().strftime("%Y-%m-%d")
-    
-    cursor.execute(f"""
-        SELECT 
-            s.class_into_which_admission_is_sought, 
-            s.full_name, 
-            SUM(c.total_amount) as total_due
-        FROM students s 
-        JOIN challans c ON s.student_id = c.student_id
-        WHERE c.status = 'Unpaid' AND c.due_date < '{today}' AND s.status = 'Active'
-        GROUP BY s.class_into_which_admission_is_sought, s.full_name
-        HAVING total_due > 0 
-        ORDER BY s.class_into_which_admission_is_sought, s.full_name
-    """)
-    defaulters = cursor.fetchall()
-    conn.close()
+    try:
+        cursor.execute(f"""
+            SELECT 
+                s.class_into_which_admission_is_sought, 
+                s.full_name, 
+                SUM({OVERDUE_SQL.format(d=":today")}) as total_due
+            FROM students s 
+            JOIN challans c ON s.student_id = c.student_id
+            WHERE c.status = 'Unpaid' AND (c.due_date < :today OR c.arrears_due_date < :today) AND s.status = 'Active'
+            GROUP BY s.class_into_which_admission_is_sought, s.full_name
+            HAVING total_due > 0 
+            ORDER BY s.class_into_which_admission_is_sought, s.full_name
+        """, {"today": today})
+        for row in cursor:
+            yield row
+    finally:
+        conn.close()
+
+def get_classwise_defaulter_list():
+    # Returns students who have OVERDUE amounts only
     class_map = {}
-    for s_class, name, due in defaulters:
+    for s_class, name, due in iter_classwise_defaulters():
         if s_class not in class_map: class_map[s_class] = []
         class_map[s_class].append((name, due))
     return class_map
 
-def get_classwise_posting_sheet(month, year):
-    conn = connect_db()
+def iter_classwise_postings(month, year):
+    """Yields (class, name, challan_id, payment_date, amount applied, arrears, fine) for the month, ordered by class."""
+    conn = connect_history()
     cursor = conn.cursor()
-    month_str = f"{month:02d}"
-    cursor.execute(f"""
-        SELECT s.class_into_which_admission_is_sought, s.full_name, c.challan_id, c.payment_date, c.total_amount, c.arrears, c.fine
-        FROM challans c JOIN students s ON s.student_id = c.student_id
-        WHERE c.status = 'Paid' AND strftime('%Y', c.payment_date) = ? AND strftime('%m', c.payment_date) = ?
-        ORDER BY s.class_into_which_admission_is_sought, s.full_name
-    """, (str(year), month_str))
-    postings = cursor.fetchall()
-    conn.close()
+    # Plain date range instead of strftime() so the payments date index is used
+    start = f"{year:04d}-{month:02d}-01"
+    end = f"{year + 1:04d}-01-01" if month == 12 else f"{year:04d}-{month + 1:02d}-01"
+    try:
+        cursor.execute("""
+            SELECT s.class_into_which_admission_is_sought, s.full_name, c.challan_id, p.payment_date, a.amount, c.arrears, c.fine
+            FROM payments p
+            JOIN all_payment_allocations a ON a.payment_id = p.payment_id
+            JOIN all_challans c ON c.challan_id = a.challan_id
+            JOIN students s ON s.student_id = c.student_id
+            WHERE p.payment_date >= ? AND p.payment_date < ?
+            ORDER BY s.class_into_which_admission_is_sought, s.full_name
+        """, (start, end))
+        for row in cursor:
+            yield row
+    finally:
+        conn.close()
+
+def get_classwise_posting_sheet(month, year):
     class_map = {}
-    for row in postings:
+    for row in iter_classwise_postings(month, year):
         s_class = row[0]
         if s_class not in class_map: class_map[s_class] = []
         class_map[s_class].append(row[1:])
@@ -341,14 +1962,121 @@ def get_collection_summary(start_date, end_date):
     conn = connect_db()
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT payment_date, COUNT(challan_id), SUM(total_amount) FROM challans
-        WHERE status = 'Paid' AND payment_date BETWEEN ? AND ?
-        GROUP BY payment_date ORDER BY payment_date
+        SELECT collection_date, SUM(challan_count), SUM(amount) FROM collection_daily
+        WHERE collection_date BETWEEN ? AND ?
+        GROUP BY collection_date ORDER BY collection_date
     """, (start_date, end_date))
     summary = cursor.fetchall()
     conn.close()
     return summary
 
+def get_monthly_collection(year):
+    """Returns [(month 1-12, challan count, amount)] for the year, from the daily rollup."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT CAST(substr(collection_date, 6, 2) AS INTEGER), SUM(challan_count), SUM(amount)
+        FROM collection_daily
+        WHERE collection_date >= ? AND collection_date < ?
+        GROUP BY substr(collection_date, 6, 2) ORDER BY 1
+    """, (f"{year:04d}-01-01", f"{year + 1:04d}-01-01"))
+    months = cursor.fetchall()
+    conn.close()
+    return months
+
+def get_yearly_collection():
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT CAST(substr(collection_date, 1, 4) AS INTEGER), SUM(challan_count), SUM(amount)
+        FROM collection_daily GROUP BY substr(collection_date, 1, 4) ORDER BY 1
+    """)
+    years = cursor.fetchall()
+    conn.close()
+    return years
+
+def get_total_collected():
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT SUM(amount) FROM collection_daily")
+    total = cursor.fetchone()[0]
+    conn.close()
+    return total or 0
+
+AGING_BUCKETS = ("Current", "0-30", "31-60", "61-90", "90+")
+
+def iter_receivables_aging(as_of=None, by="class"):
+    """
+    Buckets every challan outstanding on as_of by days past its due date, in
+    one grouped query, and yields rows as the cursor produces them.
+    by='class'   -> (class, current, 0-30, 31-60, 61-90, 90+, total)
+    by='student' -> (class, student_id, full_name, current, 0-30, 31-60, 61-90, 90+, total)
+    For a past as_of a challan counts if it was issued by then and was not yet
+    paid (or carried into a newer challan) on that date. Arrears carried into a
+    challan are aged from the due date they were first owed on.
+    """
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    as_of = as_of or today
+    if as_of >= today:
+        paid = "SELECT c.*, c.amount_paid AS paid FROM challans c WHERE c.status = 'Unpaid'"
+        params = ()
+    else:
+        # Part-payments made after as_of still count as outstanding on that date
+        paid = """
+            SELECT c.*, COALESCE((
+                SELECT SUM(a.amount) FROM all_payment_allocations a JOIN payments p ON p.payment_id = a.payment_id
+                WHERE a.challan_id = c.challan_id AND p.payment_date <= ?), 0) AS paid
+            FROM all_challans c
+            LEFT JOIN all_challans r ON r.challan_id = c.carried_forward_to
+            WHERE c.issue_date <= ? AND (
+                c.status = 'Unpaid'
+                OR (c.status = 'Paid' AND c.payment_date > ?)
+                OR (c.status = 'Carried Forward' AND r.issue_date > ?))
+        """
+        params = (as_of, as_of, as_of, as_of)
+    # Each challan's outstanding amount, with the carried arrears still unpaid (paid off first) split out
+    outstanding = f"""
+        SELECT c.student_id, c.due_date, c.arrears_due_date, c.total_amount - c.paid AS total_amount,
+               CASE WHEN c.arrears_due_date IS NULL THEN 0 ELSE MIN(MAX(c.arrears - c.paid, 0), c.total_amount - c.paid) END AS carried
+        FROM ({paid}) c
+    """
+    group_cols = "s.class_into_which_admission_is_sought"
+    if by == "student":
+        group_cols += ", s.student_id, s.full_name"
+    # Past dates may need challans that have since been archived
+    conn = connect_db() if as_of >= today else connect_history()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            WITH outstanding AS ({outstanding})
+            SELECT {group_cols},
+                SUM(CASE WHEN o.days < 0 THEN o.total_amount ELSE 0 END),
+                SUM(CASE WHEN o.days BETWEEN 0 AND 30 THEN o.total_amount ELSE 0 END),
+                SUM(CASE WHEN o.days BETWEEN 31 AND 60 THEN o.total_amount ELSE 0 END),
+                SUM(CASE WHEN o.days BETWEEN 61 AND 90 THEN o.total_amount ELSE 0 END),
+                SUM(CASE WHEN o.days > 90 THEN o.total_amount ELSE 0 END),
+                SUM(o.total_amount)
+            FROM (
+                SELECT x.student_id, x.total_amount,
+                       CAST(julianday(?) - julianday(x.due_date) AS INTEGER) AS days
+                FROM (
+                    SELECT student_id, due_date, total_amount - carried AS total_amount FROM outstanding
+                    UNION ALL
+                    SELECT student_id, arrears_due_date, carried FROM outstanding WHERE carried > 0
+                ) x
+            ) o
+            JOIN students s ON s.student_id = o.student_id
+            GROUP BY {group_cols}
+            ORDER BY {group_cols}
+        """, params + (as_of,))
+        for row in cursor:
+            yield row
+    finally:
+        conn.close()
+
+def get_receivables_aging(as_of=None, by="class"):
+    return list(iter_receivables_aging(as_of, by))
+
 def get_new_admissions_list(start_date, end_date):
     conn = connect_db()
     cursor = conn.cursor()
@@ -371,5 +2099,41 @@ def get_struck_off_list():
     conn.close()
     return struck_off
 
+def get_promotion_candidates(class_name):
+    """(student_id, full_name, status) of the active students of a class, for the promotion tab."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT student_id, full_name, status FROM students
+        WHERE class_into_which_admission_is_sought = ? AND status = 'Active'
+    """, (class_name,))
+    students = cursor.fetchall()
+    conn.close()
+    return students
+
+def get_passed_out_students():
+    """(student_id, full_name, father_name, class, contact) of students promoted out of the school."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT student_id, full_name, father_name, class_into_which_admission_is_sought, contact_details
+        FROM students WHERE status = 'Passed Out' OR class_into_which_admission_is_sought = 'Passed Out'
+    """)
+    students = cursor.fetchall()
+    conn.close()
+    return students
+
+def iter_enrollment_by_class():
+    """Yields (class, active students) ordered by class."""
+    conn = connect_db()
+    try:
+        yield from conn.execute("""
+            SELECT class_into_which_admission_is_sought, COUNT(*) FROM students
+            WHERE status = 'Active' GROUP BY class_into_which_admission_is_sought
+            ORDER BY class_into_which_admission_is_sought
+        """)
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
     setup_database()
\ No newline at end of file
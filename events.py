@@ -0,0 +1,109 @@
+"""
+In-process publish/subscribe for data changes. The database write functions
+call notify_changes() once they have committed; it reads the change_log
+entries written since the last call and hands them to every subscriber, so
+one payment reaches the dashboard, the class lists and any open admissions
+window without each of them reloading.
+
+Windows subscribe through FrameCoalescer: changes may be published from any
+thread (bulk generation and photo ingest run on workers), so they are queued
+and applied on the Tk thread, merged into one update per frame. A coalescer
+also polls the change log every few seconds to pick up writes made by other
+terminals. A batch of None means the log was pruned past what a subscriber
+had seen and it should reload everything.
+"""
+import queue
+import sqlite3
+import threading
+
+import database
+
+FRAME_MS = 33 # UI updates are merged over this window
+POLL_MS = 2000 # how often windows look for changes made elsewhere
+
+_subscribers = []
+_lock = threading.Lock()
+_last_seq = None
+
+def subscribe(callback, entities=None):
+    """
+    Calls callback(changes) for every published batch, with only the changes
+    for the given entities ('student', 'challan', 'payment') if any are given.
+    Returns a function that unsubscribes.
+    """
+    global _last_seq
+    entry = (frozenset(entities) if entities else None, callback)
+    with _lock:
+        if _last_seq is None:
+            _last_seq = database.get_change_seq()
+        _subscribers.append(entry)
+    def unsubscribe():
+        global _last_seq
+        with _lock:
+            if entry in _subscribers: _subscribers.remove(entry)
+            if not _subscribers: _last_seq = None # the next subscriber starts from then
+    return unsubscribe
+
+def notify_changes():
+    """Publishes the change_log entries committed since the last call. Does nothing without subscribers."""
+    global _last_seq
+    if not _subscribers:
+        return
+    with _lock:
+        try:
+            changes = database.get_changes_since(_last_seq)
+            if changes == []:
+                return
+            _last_seq = changes[-1].seq if changes else database.get_change_seq()
+        except sqlite3.Error:
+            return # the write itself succeeded; the next notify catches up
+        for entities, callback in list(_subscribers):
+            if changes is None or entities is None:
+                callback(changes)
+            else:
+                selected = [c for c in changes if c.entity in entities]
+                if selected: callback(selected)
+
+class FrameCoalescer:
+    """
+    Subscribes handler(changes) for as long as widget exists. Batches published
+    from any thread are merged and passed to handler on the Tk thread at most
+    once per frame.
+    """
+    def __init__(self, widget, handler, entities=None):
+        self.widget = widget
+        self.handler = handler
+        self.pending = queue.SimpleQueue()
+        self.unsubscribe = subscribe(self.pending.put, entities)
+        self.since_poll = 0
+        widget.after(FRAME_MS, self._tick)
+
+    def _tick(self):
+        try:
+            alive = self.widget.winfo_exists()
+        except Exception:
+            alive = False
+        if not alive:
+            return self.unsubscribe()
+        try:
+            self.since_poll += FRAME_MS
+            if self.since_poll >= POLL_MS:
+                self.since_poll = 0
+                notify_changes()
+            merged, reload = [], False
+            while True:
+                try: changes = self.pending.get_nowait()
+                except queue.Empty: break
+                if changes is None: reload = True
+                else: merged.extend(changes)
+            if reload: self.handler(None)
+            elif merged: self.handler(merged)
+        finally:
+            self.widget.after(FRAME_MS, self._tick)
+
+def insert_in_order(tree, iid, values, key, descending=False, **options):
+    """Inserts a Treeview row where key(values) keeps the rows sorted."""
+    wanted = key(values)
+    keys = [key(tree.item(child, "values")) for child in tree.get_children()]
+    position = sum(1 for k in keys if (k >= wanted if descending else k <= wanted))
+    tree.insert("", position, iid=iid, values=values, **options)
@@ -0,0 +1,185 @@
+"""
+Consolidated reporting across campuses. Each campus keeps its own school.db;
+head office registers them (name + path, kept in campuses.json) and runs a
+report against all of them at once:
+
+    python manage.py campus add "Ali Pur Chattha" //alipur/school/school.db
+    python manage.py federated-report defaulters --out Defaulters_All.csv
+
+Every campus is queried in its own worker process, and rows are sent back in
+chunks as they are read. The per-campus streams come back in the same sort
+order, so they are merged as they arrive (heapq.merge) instead of being
+collected and sorted afterwards: a consolidated report takes about as long
+as the slowest campus, and memory stays at a few chunks per campus.
+"""
+import csv
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+import urllib.parse
+
+import database
+
+CAMPUSES_FILE = "campuses.json"
+CHUNK_ROWS = 500 # rows per message from a campus worker
+QUEUE_CHUNKS = 64 # messages in flight before workers wait
+
+# report -> (database function, columns in the merge key, CSV header)
+REPORTS = {
+    "defaulters": ("iter_classwise_defaulters", 2, ["Class", "Name", "Overdue", "Campus"]),
+    "collections": ("get_collection_summary", 1, ["Date", "Challans", "Amount"]),
+    "enrollment": ("iter_enrollment_by_class", 1, ["Class", "Students"]),
+}
+
+def load_campuses():
+    """Registered campuses as [(name, db_path)], in registration order."""
+    try:
+        with open(CAMPUSES_FILE) as f:
+            return [(c["name"], c["db_path"]) for c in json.load(f)]
+    except (OSError, ValueError):
+        return []
+
+def _save_campuses(campuses):
+    with open(CAMPUSES_FILE, "w") as f:
+        json.dump([{"name": name, "db_path": path} for name, path in campuses], f, indent=2)
+
+def _readonly_uri(db_path):
+    # Empty URI authority, so a UNC path (//server/share/...) stays part of the path;
+    # '#', '?' and '%' in names are escaped
+    path = os.path.abspath(db_path).replace(os.sep, "/")
+    if not path.startswith("/"): path = "/" + path # C:/...
+    return f"file://{urllib.parse.quote(path)}?mode=ro"
+
+def register_campus(name, db_path):
+    """Adds or re-points a campus after checking the file is a school database."""
+    try:
+        conn = sqlite3.connect(_readonly_uri(db_path), uri=True)
+        try:
+            conn.execute("SELECT 1 FROM students LIMIT 1")
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"{db_path} is not a school database: {e}")
+    campuses = [c for c in load_campuses() if c[0] != name]
+    campuses.append((name, db_path))
+    _save_campuses(campuses)
+
+def remove_campus(name):
+    campuses = load_campuses()
+    _save_campuses([c for c in campuses if c[0] != name])
+    return len(campuses) != len(load_campuses())
+
+def _campus_worker(campus, db_path, function, args, out):
+    """Runs one report function against one campus file, sending rows back in chunks."""
+    try:
+        database.DB_PATH = db_path
+        rows = iter(getattr(database, function)(*args))
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_ROWS))
+            if not chunk: break
+            out.put((campus, chunk, None))
+        out.put((campus, None, None))
+    except Exception as e:
+        out.put((campus, None, f"{type(e).__name__}: {e}"))
+
+def _campus_streams(function, args, campuses, errors):
+    """
+    Starts one worker per campus. Returns (streams, stop): one row iterator per
+    campus, fed from a shared queue, and a function that ends the workers.
+    """
+    ctx = multiprocessing.get_context()
+    out = ctx.Queue(QUEUE_CHUNKS)
+    workers = [ctx.Process(target=_campus_worker, args=(name, path, function, args, out), daemon=True)
+               for name, path in campuses]
+    for w in workers: w.start()
+    buffers = {name: [] for name, _ in campuses}
+    finished = set()
+
+    def receive():
+        # Chunks for other campuses are buffered until their stream asks for them
+        campus, chunk, error = out.get()
+        if chunk is None:
+            finished.add(campus)
+            if error: errors.append((campus, error))
+        else:
+            buffers[campus].append(chunk)
+
+    def stream(name):
+        while True:
+            if buffers[name]:
+                yield from buffers[name].pop(0)
+            elif name in finished:
+                return
+            else:
+                receive()
+
+    def stop():
+        for w in workers:
+            if w.is_alive() and len(finished) < len(workers): w.terminate()
+            w.join()
+        out.close()
+
+    return [stream(name) for name, _ in campuses], stop
+
+def _tag(rows, campus, key_len):
+    for row in rows:
+        yield tuple(row[:key_len]), campus, row
+
+def stream_federated(report, args=(), campuses=None, errors=None):
+    """
+    Yields the merged rows of a report over all (or the given) campuses, in the
+    report's own order:
+        defaulters   (class, name, overdue, campus)
+        collections  (date, challans, amount, {campus: amount})
+        enrollment   (class, students, {campus: students})
+    A campus whose query fails is left out and (campus, message) is appended
+    to errors.
+    """
+    function, key_len, _ = REPORTS[report]
+    campuses = campuses or load_campuses()
+    errors = errors if errors is not None else []
+    streams, stop = _campus_streams(function, tuple(args), campuses, errors)
+    tagged = [_tag(rows, name, key_len) for (name, _), rows in zip(campuses, streams)]
+    try:
+        merged = heapq.merge(*tagged, key=lambda t: t[0])
+        if report == "defaulters":
+            for _, name, row in merged:
+                yield tuple(row) + (name,)
+            return
+        for key, group in itertools.groupby(merged, key=lambda t: t[0]):
+            by_campus = {name: row for _, name, row in group}
+            if report == "collections":
+                yield key + (sum(r[1] or 0 for r in by_campus.values()), sum(r[2] or 0 for r in by_campus.values()),
+                             {name: r[2] or 0 for name, r in by_campus.items()})
+            else:
+                yield key + (sum(r[1] for r in by_campus.values()), {name: r[1] for name, r in by_campus.items()})
+    finally:
+        stop()
+
+def export_federated(report, filename, args=(), campuses=None):
+    """
+    Streams a consolidated report into a CSV with one column per campus (one
+    campus column for defaulters). Returns {"rows", "totals": {campus: total}, "errors"}.
+    """
+    campuses = campuses or load_campuses()
+    names = [name for name, _ in campuses]
+    header = REPORTS[report][2] + ([] if report == "defaulters" else names)
+    totals = dict.fromkeys(names, 0)
+    errors = []
+    count = 0
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in stream_federated(report, args, campuses, errors):
+            if report == "defaulters":
+                totals[row[3]] += row[2] or 0
+                writer.writerow(row)
+            else:
+                breakdown = row[-1]
+                for name, value in breakdown.items(): totals[name] += value
+                writer.writerow(list(row[:-1]) + [breakdown.get(name, 0) for name in names])
+            count += 1
+    return {"rows": count, "totals": totals, "errors": errors, "file": os.path.abspath(filename)}
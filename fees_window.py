@@ -1,13 +1,14 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 import datetime
 import os
 import calendar 
 import webbrowser
 import subprocess
 import sys
-import sqlite3
 import json
+import threading
+import queue
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import inch, mm
 from reportlab.pdfgen import canvas as pdfcanvas
@@ -23,13 +24,23 @@ from database import (
     get_challan_details_by_id, get_unpaid_challans, pay_challan,
     create_challan, get_student_fee_summary, get_classwise_defaulter_list,
     get_classwise_posting_sheet, get_collection_summary,
-    get_new_admissions_list, get_struck_off_list, get_active_students
+    get_new_admissions_list, get_struck_off_list, get_active_students,
+    create_challans_bulk, get_fee_plan, set_fee_plan_item, delete_fee_plan_item,
+    get_discount_rules, add_discount_rule, delete_discount_rule, accrue_fines,
+    get_receivables_aging, AGING_BUCKETS, get_total_collected, get_monthly_collection,
+    get_family_vouchers_for_challans, get_challan_family_voucher, pay_family_voucher,
+    allocate_payment, get_student_balance, promote_students, get_class_challans,
+    get_promotion_candidates, get_passed_out_students
 )
+from events import FrameCoalescer, insert_in_order
+from settings import load_settings, save_settings
+from reports import export_receivables_aging, render_defaulter_report, render_posting_sheet, run_month_end_close
+from vouchers import render_family_vouchers, render_challans
 
 # --- CONSTANTS & STYLES ---
 MONTH_NAMES = [None, 'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
 LOGO_PATH = "logo.png"
-SETTINGS_FILE = "fee_settings.json"
+CHANGE_REFRESH_LIMIT = 500 # more changes than this in one frame and the tabs are simply reloaded
 
 CLASS_LIST = [
     "Playgroup", "Nursery", "Prep",
@@ -136,6 +147,8 @@ class FeesWindow:
         
         # Load Data
         self._refresh_dashboard()
+        # Payments and new challans from anywhere patch the affected rows in place
+        FrameCoalescer(self.master, self._on_changes)
 
     def _setup_styles(self):
         style = ttk.Style()
@@ -161,6 +174,10 @@ class FeesWindow:
         self.card_unpaid.pack(side=tk.LEFT, padx=(0, 20), fill=tk.X, expand=True)
         self.card_paid = self._make_card(cards_frame, "Total Collected", "Rs. 0", COLOR_ACCENT)
         self.card_paid.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        trend_frame = tk.LabelFrame(container, text="Collections - Last 12 Months", bg=COLOR_WHITE, font=FONT_HEADER, fg=COLOR_PRIMARY)
+        trend_frame.pack(fill=tk.X, pady=(0, 10))
+        self.trend_canvas = tk.Canvas(trend_frame, height=120, bg=COLOR_WHITE, highlightthickness=0)
+        self.trend_canvas.pack(fill=tk.X, padx=5, pady=5)
         list_frame = tk.Frame(container, bg=COLOR_WHITE)
         list_frame.pack(fill=tk.BOTH, expand=True)
         def_frame = tk.LabelFrame(list_frame, text="Top Defaulters", bg=COLOR_WHITE, font=FONT_HEADER, fg=COLOR_DANGER)
@@ -194,23 +211,69 @@ class FeesWindow:
     def _refresh_dashboard(self):
         for i in self.def_tree.get_children(): self.def_tree.delete(i)
         for i in self.clr_tree.get_children(): self.clr_tree.delete(i)
-        data = get_student_fee_summary()
-        total_unpaid = 0
-        for row in data:
-            due = row[4]
-            if due > 0:
-                total_unpaid += due
-                self.def_tree.insert("", "end", values=(row[0], row[1], row[2], f"{due:,.0f}"))
-            else:
-                self.clr_tree.insert("", "end", values=(row[0], row[1], row[2], row[3]))
-        conn = sqlite3.connect('school.db')
-        cur = conn.cursor()
-        cur.execute("SELECT SUM(total_amount) FROM challans WHERE status='Paid'")
-        res = cur.fetchone()[0]
-        total_paid = res if res else 0
-        conn.close()
-        self.card_unpaid.lbl_val.config(text=f"Rs. {total_unpaid:,.0f}")
-        self.card_paid.lbl_val.config(text=f"Rs. {total_paid:,.0f}")
+        self.dash_dues = {} # student_id -> overdue shown in Top Defaulters
+        for row in get_student_fee_summary(): self._place_dash_row(row, "end") # already in order
+        self._update_dash_totals()
+        self._draw_collection_trend()
+
+    def _place_dash_row(self, row, position=None):
+        # Rows are keyed by student id so a single student can be moved later
+        sid, due = str(row[0]), row[4]
+        if due > 0:
+            # Top Defaulters stays ordered by overdue amount
+            if position is None: position = sum(1 for d in self.dash_dues.values() if d >= due)
+            self.def_tree.insert("", position, iid=sid, values=(row[0], row[1], row[2], f"{due:,.0f}"))
+            self.dash_dues[row[0]] = due
+        else:
+            self.clr_tree.insert("", "end", iid=sid, values=(row[0], row[1], row[2], row[3]))
+
+    def _update_dash_totals(self):
+        self.card_unpaid.lbl_val.config(text=f"Rs. {sum(self.dash_dues.values()):,.0f}")
+        self.card_paid.lbl_val.config(text=f"Rs. {get_total_collected():,.0f}")
+
+    def _on_changes(self, changes):
+        """Change bus handler, called at most once per frame with the merged changes."""
+        if changes is None or len(changes) > CHANGE_REFRESH_LIMIT:
+            self._refresh_dashboard()
+            if self.loaded_class: self._load_class_data(None)
+            if self.current_student_id and hasattr(self, "challan_tree"): self.load_student_challans()
+            return
+        students = {c.student_id for c in changes if c.student_id}
+        for sid in students:
+            for tree in (self.def_tree, self.clr_tree):
+                if tree.exists(str(sid)): tree.delete(str(sid))
+            self.dash_dues.pop(sid, None)
+        for row in get_student_fee_summary(students): self._place_dash_row(row)
+        self._update_dash_totals()
+        if any(c.entity != "student" for c in changes): self._draw_collection_trend()
+        if self.loaded_class: self._patch_class_lists(students)
+        if self.current_student_id in students and hasattr(self, "challan_tree"): self.load_student_challans()
+
+    def _draw_collection_trend(self):
+        # Reads the per-month totals from the collection_daily rollup, two small queries at most
+        today = datetime.date.today()
+        by_month = {}
+        for year in {today.year - 1, today.year}:
+            for month, _, amount in get_monthly_collection(year): by_month[(year, month)] = amount or 0
+        months = []
+        y, m = today.year, today.month
+        for _ in range(12):
+            months.append((y, m))
+            y, m = (y - 1, 12) if m == 1 else (y, m - 1)
+        months.reverse()
+        cv = self.trend_canvas
+        cv.delete("all")
+        cv.update_idletasks()
+        width, height = max(cv.winfo_width(), 600), int(cv["height"])
+        peak = max([by_month.get(k, 0) for k in months] + [1])
+        bar_w = width / len(months)
+        for i, key in enumerate(months):
+            amount = by_month.get(key, 0)
+            bar_h = (height - 30) * amount / peak
+            x0 = i * bar_w + 8
+            cv.create_rectangle(x0, height - 15 - bar_h, x0 + bar_w - 16, height - 15, fill=COLOR_ACCENT, outline="")
+            cv.create_text(x0 + (bar_w - 16) / 2, height - 6, text=MONTH_NAMES[key[1]][:3], font=("Segoe UI", 8))
+            if amount: cv.create_text(x0 + (bar_w - 16) / 2, height - 22 - bar_h, text=f"{amount / 1000:,.0f}k", font=("Segoe UI", 7))
 
     # --- TAB 2: CLASS WISE ---
     def _create_class_list_ui(self, parent):
@@ -239,6 +302,8 @@ class FeesWindow:
         self.class_notebook.add(self.tab_cls_paid, text="Paid History")
         self.tree_cls_paid = self._create_class_status_tree(self.tab_cls_paid, "Paid")
         self.class_listbox.bind("<<ListboxSelect>>", self._load_class_data)
+        self.loaded_class = None
+        self.class_challans = {} # challan_id -> (status tree holding it, student_id)
 
     def _setup_class_generate_tab(self, parent):
         ctrl_frame = tk.Frame(parent, bg="white", pady=10)
@@ -264,28 +329,42 @@ class FeesWindow:
 
     def _load_class_data(self, event):
         sel = self.class_listbox.curselection()
-        if not sel: return
-        cls_name = self.class_listbox.get(sel[0])
+        if sel: self.loaded_class = self.class_listbox.get(sel[0])
+        if not self.loaded_class: return
         for t in [self.tree_cls_students, self.tree_cls_unpaid, self.tree_cls_defaulter, self.tree_cls_paid]:
             for i in t.get_children(): t.delete(i)
-        conn = sqlite3.connect('school.db')
-        cur = conn.cursor()
-        cur.execute("SELECT student_id, full_name, father_name, contact_details FROM students WHERE class_into_which_admission_is_sought=? AND status='Active'", (cls_name,))
-        for s in cur.fetchall(): self.tree_cls_students.insert("", "end", values=s, iid=s[0])
-        cur.execute("""SELECT s.student_id, s.full_name, c.challan_id, c.due_date, c.total_amount, c.status 
-            FROM challans c JOIN students s ON c.student_id = s.student_id 
-            WHERE s.class_into_which_admission_is_sought=? ORDER BY c.due_date DESC""", (cls_name,))
-        for c in cur.fetchall():
-            sid, name, cid, due_str, amt, status = c
-            vals = (sid, name, cid, due_str, f"Rs. {amt:,.0f}", status)
-            if status == "Paid": self.tree_cls_paid.insert("", "end", values=vals, tags=("Paid",))
-            else:
-                try:
-                    if datetime.date.today() > datetime.datetime.strptime(due_str, "%Y-%m-%d").date():
-                        self.tree_cls_defaulter.insert("", "end", values=vals, tags=("Defaulter",))
-                    else: self.tree_cls_unpaid.insert("", "end", values=vals, tags=("Unpaid",))
-                except: self.tree_cls_unpaid.insert("", "end", values=vals)
-        conn.close()
+        self.class_challans = {}
+        for s in get_students(class_name=self.loaded_class, status="Active"):
+            self.tree_cls_students.insert("", "end", values=(s.student_id, s.full_name, s.father_name, s.contact_details), iid=s.student_id)
+        for row in get_class_challans(self.loaded_class): self._place_class_challan(row, "end")
+
+    def _place_class_challan(self, row, position=None):
+        sid, name, cid, due_str, amt, status = row
+        if status == "Carried Forward": return # Already included in a newer challan's arrears
+        vals = (sid, name, cid, due_str, f"Rs. {amt:,.0f}", status)
+        if status == "Paid": tree, tags = self.tree_cls_paid, ("Paid",)
+        else:
+            try:
+                overdue = datetime.date.today() > datetime.datetime.strptime(due_str, "%Y-%m-%d").date()
+                tree, tags = (self.tree_cls_defaulter, ("Defaulter",)) if overdue else (self.tree_cls_unpaid, ("Unpaid",))
+            except: tree, tags = self.tree_cls_unpaid, ()
+        if position is None: insert_in_order(tree, cid, vals, lambda v: str(v[3]), descending=True, tags=tags)
+        else: tree.insert("", position, iid=cid, values=vals, tags=tags)
+        self.class_challans[cid] = (tree, sid)
+
+    def _patch_class_lists(self, students):
+        # Only the rows of the changed students are replaced; selections elsewhere survive
+        selected = set(self.tree_cls_students.selection())
+        for sid in students:
+            if self.tree_cls_students.exists(sid): self.tree_cls_students.delete(sid)
+        for s in get_students(class_name=self.loaded_class, status="Active", student_ids=students):
+            insert_in_order(self.tree_cls_students, s.student_id, (s.student_id, s.full_name, s.father_name, s.contact_details), lambda v: int(v[0]))
+            if str(s.student_id) in selected: self.tree_cls_students.selection_add(s.student_id)
+        for cid, (tree, sid) in list(self.class_challans.items()):
+            if sid in students:
+                tree.delete(cid)
+                del self.class_challans[cid]
+        for row in get_class_challans(self.loaded_class, students): self._place_class_challan(row)
 
     def select_all_class_students(self):
         for item in self.tree_cls_students.get_children(): self.tree_cls_students.selection_add(item)
@@ -295,15 +374,32 @@ class FeesWindow:
         if not selected: return messagebox.showwarning("Info", "Select students first.")
         top = tk.Toplevel(self.master); top.title("Bulk Generate")
         tk.Label(top, text=f"Generate for {len(selected)} Students").pack(pady=10)
-        tk.Button(top, text="Confirm & Generate", command=lambda: self._run_bulk_gen(selected, top)).pack(pady=10)
+        family_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(top, text="One family voucher for siblings", variable=family_var).pack(padx=20)
+        tk.Button(top, text="Confirm & Generate", command=lambda: self._run_bulk_gen(selected, top, family_var.get())).pack(pady=10)
         
-    def _run_bulk_gen(self, selected, top):
+    def _run_bulk_gen(self, selected, top, family_vouchers=False):
         issue = datetime.date.today().strftime("%Y-%m-%d")
         due = (datetime.date.today() + datetime.timedelta(days=15)).strftime("%Y-%m-%d")
-        for sid in selected:
-            create_challan(int(sid), issue, due, "Unpaid", [("Tuition Fee", 5000)], 0, 0)
-        messagebox.showinfo("Success", "Generated"); top.destroy(); self.class_listbox.event_generate("<<ListboxSelect>>")
-        self._refresh_dashboard()
+        # Classes without a fee plan fall back to the single amount in fee_settings.json
+        default_items = [("Tuition Fee", float(load_settings()["amount"] or 5000))]
+        top.destroy() # the class lists and dashboard catch up through the change bus
+        # Generation (and its safety snapshot) runs on a worker so the window stays responsive
+        def generate():
+            new_ids = create_challans_bulk([int(sid) for sid in selected], issue, due, default_items, family_vouchers=family_vouchers)
+            return new_ids, get_family_vouchers_for_challans(new_ids) if family_vouchers else []
+        def done(result, error):
+            if error: return messagebox.showerror("Error", f"Could not generate challans: {error}")
+            new_ids, vouchers = result
+            # Students already billed for this month are skipped, so a second click is harmless
+            skipped = len(selected) - len(new_ids)
+            note = f"\n{skipped} students already had a voucher for {MONTH_NAMES[int(issue[5:7])]} and were skipped." if skipped else ""
+            if vouchers and messagebox.askyesno("Success", f"Generated {len(new_ids)} challans, {len(vouchers)} of them grouped into family vouchers.{note}\n\nPrint the family vouchers now?"):
+                self._render_report("Family Vouchers", lambda: render_family_vouchers(vouchers, f"Family_Vouchers_{issue}.pdf"))
+            elif not vouchers and new_ids and messagebox.askyesno("Success", f"Generated {len(new_ids)} challans.{note}\n\nPrint them now?"):
+                self._render_report("Challans", lambda: render_challans(new_ids, f"Challans_{issue}.pdf"))
+            elif not new_ids: messagebox.showinfo("Success", f"Nothing to generate.{note}")
+        self._run_in_background(generate, done)
 
     # --- TAB 3: MANAGE INDIVIDUAL ---
     def _create_individual_ui(self, parent):
@@ -319,7 +415,7 @@ class FeesWindow:
     def filter_students(self, event=None):
         search = self.search_entry.get().lower()
         self.student_listbox.delete(0, tk.END)
-        for s in get_students(search): self.student_listbox.insert(tk.END, f"ID: {s[0]} - {s[1]}")
+        for s in get_students(search): self.student_listbox.insert(tk.END, f"ID: {s.student_id} - {s.full_name}")
 
     def on_student_select(self, event):
         sel = self.student_listbox.curselection()
@@ -333,6 +429,8 @@ class FeesWindow:
         ctrl = tk.Frame(self.fee_frame); ctrl.pack(fill=tk.X)
         tk.Button(ctrl, text="Print Challan", command=self.print_challan).pack(side=tk.LEFT)
         tk.Button(ctrl, text="Pay", command=self.record_payment).pack(side=tk.LEFT)
+        tk.Button(ctrl, text="Receive Amount", command=self.receive_amount).pack(side=tk.LEFT)
+        self.balance_lbl = tk.Label(ctrl, text="", font=("Segoe UI", 10, "bold")); self.balance_lbl.pack(side=tk.RIGHT, padx=10)
         self.challan_tree = ttk.Treeview(self.fee_frame, columns=("ID", "Issue", "Due", "Total", "Status"), show="headings")
         for c in ("ID", "Issue", "Due", "Total", "Status"): self.challan_tree.heading(c, text=c)
         self.challan_tree.pack(fill=tk.BOTH, expand=True)
@@ -341,27 +439,235 @@ class FeesWindow:
     def load_student_challans(self):
         for i in self.challan_tree.get_children(): self.challan_tree.delete(i)
         for c in get_challans_by_student_id(self.current_student_id):
-             self.challan_tree.insert("", "end", values=(c[0], c[2], c[3], c[6], c[4]))
+             self.challan_tree.insert("", "end", values=(c.challan_id, c.issue_date, c.due_date, c.total_amount, c.status))
+        self.balance_lbl.config(text=f"Balance: Rs. {get_student_balance(self.current_student_id):,.0f}")
 
     def record_payment(self):
         sel = self.challan_tree.selection()
         if sel: 
-            pay_challan(int(self.challan_tree.item(sel[0])['values'][0]), datetime.date.today().strftime("%Y-%m-%d"))
-            self.load_student_challans()
-            self._refresh_dashboard()
+            cid = int(self.challan_tree.item(sel[0])['values'][0])
+            today = datetime.date.today().strftime("%Y-%m-%d")
+            voucher = get_challan_family_voucher(cid)
+            if voucher and voucher[1] == "Unpaid" and messagebox.askyesno("Family Voucher",
+                    f"This challan is on family voucher {voucher[0]} ({voucher[3]} children, Rs. {voucher[2]:,.0f}).\n\nRecord payment for the whole family?"):
+                pay_family_voucher(voucher[0], today)
+            else: pay_challan(cid, today)
+
+    def receive_amount(self):
+        # Part or multi-month payments are spread over unpaid challans oldest-first
+        amount = simpledialog.askfloat("Receive Amount", "Amount received (Rs.):", minvalue=1, parent=self.master)
+        if not amount: return
+        result = allocate_payment(self.current_student_id, amount, datetime.date.today().strftime("%Y-%m-%d"))
+        if not result: return
+        _, allocations, unapplied = result
+        lines = [f"Challan {cid}: Rs. {applied:,.0f}" + (" (settled)" if settled else " (part)") for cid, applied, settled in allocations]
+        if unapplied: lines.append(f"Credit for the next challan: Rs. {unapplied:,.0f}")
+        messagebox.showinfo("Payment Recorded", "\n".join(lines) or "Nothing outstanding.")
 
     # --- TAB 4: REPORTS ---
     def _create_reports_ui(self, parent):
-        tk.Button(parent, text="Defaulters List", command=self.gen_class_defaulter).pack(pady=5)
+        pdf_frame = tk.Frame(parent, bg=COLOR_WHITE)
+        pdf_frame.pack(fill=tk.X, padx=20, pady=10)
+        tk.Button(pdf_frame, text="Defaulters List", command=self.gen_class_defaulter).pack(side=tk.LEFT, padx=5)
+        tk.Label(pdf_frame, text="Posting Sheet for", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=(30, 5))
+        self.posting_month_var = tk.StringVar(value=MONTH_NAMES[self.current_month])
+        ttk.Combobox(pdf_frame, textvariable=self.posting_month_var, values=MONTH_NAMES[1:], width=10, state="readonly").pack(side=tk.LEFT, padx=5)
+        self.posting_year_entry = tk.Entry(pdf_frame, width=6)
+        self.posting_year_entry.insert(0, str(self.current_year))
+        self.posting_year_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(pdf_frame, text="Posting Sheet", command=self.gen_posting_sheet).pack(side=tk.LEFT, padx=5)
+        tk.Button(pdf_frame, text="Month-End Close", command=self.run_month_end_close, bg=COLOR_PRIMARY, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=(30, 5))
+        self.report_status_lbl = tk.Label(pdf_frame, text="", bg=COLOR_WHITE, fg="#666")
+        self.report_status_lbl.pack(side=tk.LEFT, padx=10)
+
+        aging = tk.LabelFrame(parent, text="Receivables Aging", bg=COLOR_WHITE, font=FONT_HEADER, fg=COLOR_PRIMARY)
+        aging.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        ctrl = tk.Frame(aging, bg=COLOR_WHITE); ctrl.pack(fill=tk.X, pady=5)
+        tk.Label(ctrl, text="As of (YYYY-MM-DD):", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+        self.aging_date_entry = tk.Entry(ctrl, width=12)
+        self.aging_date_entry.insert(0, datetime.date.today().strftime("%Y-%m-%d"))
+        self.aging_date_entry.pack(side=tk.LEFT, padx=5)
+        self.aging_by_var = tk.StringVar(value="class")
+        tk.Radiobutton(ctrl, text="By Class", variable=self.aging_by_var, value="class", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+        tk.Radiobutton(ctrl, text="By Student", variable=self.aging_by_var, value="student", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+        tk.Button(ctrl, text="Show", command=self.show_receivables_aging, bg="#2196F3", fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(ctrl, text="Export CSV", command=self.export_receivables_aging, bg=COLOR_ACCENT, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        cols = ("Class", "Student") + AGING_BUCKETS + ("Total",)
+        self.aging_tree = ttk.Treeview(aging, columns=cols, show="headings")
+        for c in cols:
+            self.aging_tree.heading(c, text=c)
+            self.aging_tree.column(c, width=90, anchor="w" if c in ("Class", "Student") else "e")
+        self.aging_tree.column("Student", width=160)
+        self.aging_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+    def show_receivables_aging(self):
+        for i in self.aging_tree.get_children(): self.aging_tree.delete(i)
+        by = self.aging_by_var.get()
+        for row in get_receivables_aging(self.aging_date_entry.get().strip() or None, by):
+            if by == "student": label, amounts = f"{row[1]} - {row[2]}", row[3:]
+            else: label, amounts = "", row[1:]
+            self.aging_tree.insert("", "end", values=(row[0], label) + tuple(f"{a:,.0f}" for a in amounts))
+
+    def export_receivables_aging(self):
+        as_of = self.aging_date_entry.get().strip() or datetime.date.today().strftime("%Y-%m-%d")
+        filename = filedialog.asksaveasfilename(defaultextension=".csv", initialfile=f"Receivables_Aging_{as_of}.csv", filetypes=[("CSV", "*.csv")])
+        if not filename: return
+        count = export_receivables_aging(filename, as_of, self.aging_by_var.get())
+        messagebox.showinfo("Exported", f"{count} rows written to {filename}")
 
     def gen_class_defaulter(self):
-        data = get_classwise_defaulter_list()
-        if not data: return messagebox.showinfo("Info", "No Data")
-        # ... generate PDF logic ...
+        self._render_report("Defaulters List", render_defaulter_report)
 
-    # --- TAB 5: AUTO DEBIT ---
+    def gen_posting_sheet(self):
+        try:
+            month = MONTH_NAMES.index(self.posting_month_var.get())
+            year = int(self.posting_year_entry.get())
+        except ValueError: return messagebox.showerror("Error", "Select a month and enter a valid year.")
+        self._render_report("Posting Sheet", lambda: render_posting_sheet(month, year))
+
+    def run_month_end_close(self):
+        try:
+            month = MONTH_NAMES.index(self.posting_month_var.get())
+            year = int(self.posting_year_entry.get())
+        except ValueError: return messagebox.showerror("Error", "Select a month and enter a valid year.")
+        if load_settings().get("api_url"):
+            # The close reads a snapshot file, which only exists on the server's disk
+            return messagebox.showerror("Month-End Close", "Run the month-end close on the computer that runs the API server\n(python manage.py month-end-close).")
+        self.report_status_lbl.config(text=f"Closing {MONTH_NAMES[month]} {year}...")
+        def done(manifest, error):
+            self.report_status_lbl.config(text="")
+            if error: return messagebox.showerror("Month-End Close", f"Close failed: {error}")
+            lines = [f"{r['file']}: {r['seconds']:.1f}s" for r in manifest["reports"]]
+            lines += [f"{e['report']}: FAILED ({e['error']})" for e in manifest["errors"]]
+            messagebox.showinfo("Month-End Close", f"Saved to {manifest['folder']}\n\n" + "\n".join(lines))
+        self._run_in_background(lambda: run_month_end_close(month, year), done)
+
+    def _render_report(self, title, render):
+        # PDFs are laid out on a worker thread; the UI only polls for the finished file
+        self.report_status_lbl.config(text=f"Generating {title}...")
+        def done(filename, error):
+            self.report_status_lbl.config(text="")
+            if error: return messagebox.showerror("PDF Error", f"Could not create {title}: {error}")
+            self._open_file(filename)
+        self._run_in_background(render, done)
+
+    def _run_in_background(self, work, on_done):
+        results = queue.Queue()
+        def worker():
+            try: results.put((work(), None))
+            except Exception as e: results.put((None, e))
+        threading.Thread(target=worker, daemon=True).start()
+        def poll():
+            try: result, error = results.get_nowait()
+            except queue.Empty: return self.master.after(100, poll)
+            on_done(result, error)
+        self.master.after(100, poll)
+
+    # --- TAB 5: AUTO DEBIT / FEE PLANS ---
     def _create_scheduler_ui(self, parent):
-        tk.Label(parent, text="Auto-Debit Settings").pack()
+        container = tk.Frame(parent, bg=COLOR_WHITE)
+        container.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+        tk.Label(container, text="Class-Wise Fee Plans", font=FONT_HEADER, bg=COLOR_WHITE, fg=COLOR_PRIMARY).pack(pady=10)
+
+        sel_frame = tk.Frame(container, bg=COLOR_WHITE)
+        sel_frame.pack(fill=tk.X, pady=5)
+        tk.Label(sel_frame, text="Class:", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+        self.plan_class_var = tk.StringVar()
+        plan_cb = ttk.Combobox(sel_frame, textvariable=self.plan_class_var, values=CLASS_LIST[:-1], state="readonly")
+        plan_cb.pack(side=tk.LEFT, padx=5)
+        plan_cb.bind("<<ComboboxSelected>>", lambda e: self._load_fee_plan())
+        tk.Label(sel_frame, text="Fee Head:", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=(20, 5))
+        self.plan_desc_entry = ttk.Combobox(sel_frame, values=["Tuition Fee", "Lab Fee", "Transport Fee", "Exam Fee"], width=18)
+        self.plan_desc_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(sel_frame, text="Amount:", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=(10, 5))
+        self.plan_amount_entry = tk.Entry(sel_frame, width=10)
+        self.plan_amount_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(sel_frame, text="Add / Update", command=self._save_fee_plan_item, bg=COLOR_ACCENT, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(sel_frame, text="Remove", command=self._delete_fee_plan_item, bg=COLOR_DANGER, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+        self.plan_tree = ttk.Treeview(container, columns=("ID", "Fee Head", "Amount"), show="headings", height=6)
+        for c in ("ID", "Fee Head", "Amount"): self.plan_tree.heading(c, text=c)
+        self.plan_tree.column("ID", width=50); self.plan_tree.column("Amount", width=100, anchor="e")
+        self.plan_tree.pack(fill=tk.X, pady=5)
+
+        tk.Label(container, text="Discount Rules", font=FONT_HEADER, bg=COLOR_WHITE, fg=COLOR_PRIMARY).pack(pady=(15, 5))
+        rule_frame = tk.Frame(container, bg=COLOR_WHITE)
+        rule_frame.pack(fill=tk.X, pady=5)
+        tk.Label(rule_frame, text="Sibling discount % from child no.", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+        self.rule_min_entry = tk.Entry(rule_frame, width=4); self.rule_min_entry.insert(0, "2")
+        self.rule_min_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(rule_frame, text="Percent:", bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+        self.rule_pct_entry = tk.Entry(rule_frame, width=6)
+        self.rule_pct_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(rule_frame, text="Add Rule", command=self._add_sibling_rule, bg=COLOR_ACCENT, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(rule_frame, text="Remove Rule", command=self._delete_discount_rule, bg=COLOR_DANGER, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+        self.rule_tree = ttk.Treeview(container, columns=("ID", "Name", "Type", "From Child", "Percent"), show="headings", height=4)
+        for c in ("ID", "Name", "Type", "From Child", "Percent"): self.rule_tree.heading(c, text=c)
+        self.rule_tree.column("ID", width=50)
+        self.rule_tree.pack(fill=tk.X, pady=5)
+        self._load_discount_rules()
+
+        tk.Label(container, text="Late Fine Rules", font=FONT_HEADER, bg=COLOR_WHITE, fg=COLOR_PRIMARY).pack(pady=(15, 5))
+        fine_frame = tk.Frame(container, bg=COLOR_WHITE)
+        fine_frame.pack(fill=tk.X, pady=5)
+        settings = load_settings()
+        self.fine_entries = {}
+        for key, label in (("fine_per_day", "Rs. per day:"), ("fine_grace_days", "Grace days:"), ("fine_cap", "Max fine (0 = none):")):
+            tk.Label(fine_frame, text=label, bg=COLOR_WHITE).pack(side=tk.LEFT, padx=5)
+            e = tk.Entry(fine_frame, width=8); e.insert(0, settings[key])
+            e.pack(side=tk.LEFT, padx=5)
+            self.fine_entries[key] = e
+        tk.Button(fine_frame, text="Save & Accrue Fines Now", command=self._run_fine_accrual, bg=COLOR_WARNING, fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=10)
+
+    def _run_fine_accrual(self):
+        settings = load_settings()
+        try:
+            for key, e in self.fine_entries.items(): settings[key] = str(float(e.get()))
+        except ValueError: return messagebox.showerror("Error", "Fine rules must be numbers.")
+        as_of = datetime.date.today().strftime("%Y-%m-%d")
+        updated = accrue_fines(as_of, settings["fine_per_day"], settings["fine_cap"], float(settings["fine_grace_days"]))
+        settings["fines_last_run"] = as_of
+        save_settings(settings)
+        messagebox.showinfo("Fines", f"Fines updated on {updated} overdue challans.")
+
+    def _load_fee_plan(self):
+        for i in self.plan_tree.get_children(): self.plan_tree.delete(i)
+        for plan_id, desc, amount in get_fee_plan(self.plan_class_var.get()):
+            self.plan_tree.insert("", "end", values=(plan_id, desc, f"{amount:,.0f}"), iid=plan_id)
+
+    def _save_fee_plan_item(self):
+        cls, desc = self.plan_class_var.get(), self.plan_desc_entry.get().strip()
+        if not cls or not desc: return messagebox.showwarning("Info", "Select a class and enter a fee head.")
+        try: amount = float(self.plan_amount_entry.get())
+        except ValueError: return messagebox.showerror("Error", "Amount must be a number.")
+        set_fee_plan_item(cls, desc, amount)
+        self._load_fee_plan()
+
+    def _delete_fee_plan_item(self):
+        sel = self.plan_tree.selection()
+        if not sel: return
+        delete_fee_plan_item(int(sel[0]))
+        self._load_fee_plan()
+
+    def _load_discount_rules(self):
+        for i in self.rule_tree.get_children(): self.rule_tree.delete(i)
+        for rule_id, name, rule_type, _, _, min_count, percent, _, _ in get_discount_rules():
+            self.rule_tree.insert("", "end", values=(rule_id, name, rule_type, min_count, f"{percent:g}%"), iid=rule_id)
+
+    def _add_sibling_rule(self):
+        try:
+            min_count = int(self.rule_min_entry.get())
+            percent = float(self.rule_pct_entry.get())
+        except ValueError: return messagebox.showerror("Error", "Enter a child number and a percent.")
+        add_discount_rule(f"Sibling Discount ({percent:g}%)", "sibling", min_count=min_count, percent=percent)
+        self._load_discount_rules()
+
+    def _delete_discount_rule(self):
+        sel = self.rule_tree.selection()
+        if not sel: return
+        delete_discount_rule(int(sel[0]))
+        self._load_discount_rules()
 
     # --- TAB 6: PROMOTION ---
     def _create_promotion_ui(self, parent):
@@ -405,12 +711,8 @@ class FeesWindow:
         
         # Load students
         for i in self.promo_tree.get_children(): self.promo_tree.delete(i)
-        conn = sqlite3.connect('school.db')
-        cur = conn.cursor()
-        cur.execute("SELECT student_id, full_name, status FROM students WHERE class_into_which_admission_is_sought=? AND status='Active'", (current,))
-        for s in cur.fetchall():
+        for s in get_promotion_candidates(current):
             self.promo_tree.insert("", "end", values=s, iid=s[0])
-        conn.close()
 
     def _promo_select_all(self):
         for item in self.promo_tree.get_children(): self.promo_tree.selection_add(item)
@@ -424,21 +726,13 @@ class FeesWindow:
         
         confirm = messagebox.askyesno("Confirm Promotion", f"Promote {len(selected)} students to {target_class}?\nThis will update their class record.")
         if confirm:
-            conn = sqlite3.connect('school.db')
-            cur = conn.cursor()
-            count = 0
-            for sid in selected:
-                # If target is "Passed Out", we might want to change status too
-                if target_class == "Passed Out":
-                    cur.execute("UPDATE students SET class_into_which_admission_is_sought=?, status='Passed Out' WHERE student_id=?", (target_class, sid))
-                else:
-                    cur.execute("UPDATE students SET class_into_which_admission_is_sought=? WHERE student_id=?", (target_class, sid))
-                count += 1
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Success", f"Promoted {count} students.")
-            self._update_promotion_target(None) # Refresh list
-            self._refresh_passed_out_list() # Update passed out tab
+            # A snapshot of the database is taken first (see backup.snapshot_before), on a worker
+            def done(count, error):
+                if error: return messagebox.showerror("Error", f"Could not promote students: {error}")
+                messagebox.showinfo("Success", f"Promoted {count} students.")
+                self._update_promotion_target(None) # Refresh list
+                self._refresh_passed_out_list() # Update passed out tab
+            self._run_in_background(lambda: promote_students([int(sid) for sid in selected], target_class), done)
 
     # --- TAB 7: PASSED OUT ---
     def _create_passed_out_ui(self, parent):
@@ -457,132 +751,19 @@ class FeesWindow:
 
     def _refresh_passed_out_list(self):
         for i in self.po_tree.get_children(): self.po_tree.delete(i)
-        conn = sqlite3.connect('school.db')
-        cur = conn.cursor()
-        # We assume students promoted to "Passed Out" have that as class OR status='Passed Out'
-        cur.execute("SELECT student_id, full_name, father_name, class_into_which_admission_is_sought, contact_details FROM students WHERE status='Passed Out' OR class_into_which_admission_is_sought='Passed Out'")
-        for s in cur.fetchall():
+        # Students promoted to "Passed Out" have that as class OR status='Passed Out'
+        for s in get_passed_out_students():
             self.po_tree.insert("", "end", values=s)
-        conn.close()
 
     # --- CHALLAN PRINTING (Using Exact A4 Vertical Logic) ---
     def print_challan(self):
         sel = self.challan_tree.selection()
         if not sel: return
         cid = int(self.challan_tree.item(sel[0])['values'][0])
-        
-        conn = sqlite3.connect('school.db')
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM challans WHERE challan_id=?", (cid,))
-        challan = cur.fetchone()
-        cur.execute("SELECT description, amount FROM challan_items WHERE challan_id=?", (cid,))
-        items = cur.fetchall()
-        conn.close()
-        
-        if challan[7] > 0: items.append(("Arrears", challan[7]))
-        if challan[8] > 0: items.append(("Fine", challan[8]))
-        
-        unique_10_digit = f"{(1000000000 + cid)}"
-        filename = f"Challan_{cid}.pdf"
-        
-        c = pdfcanvas.Canvas(filename, pagesize=A4)
-        width, height = A4
-        h_copy = height / 3
-        copies = ["Bank Copy", "School Copy", "Student Copy"]
-        
-        for i in range(3):
-            y_start = height - (i * h_copy)
-            self._draw_exact_voucher(c, width, h_copy, y_start, copies[i], challan, items, unique_10_digit)
-            if i < 2:
-                cut_y = y_start - h_copy
-                c.setDash(3, 3)
-                c.line(0, cut_y, width, cut_y)
-                c.setFont("Helvetica", 8)
-                c.drawString(10, cut_y + 2, "Cut Here -----------------------------------------------------------------")
-                c.setDash()
-        
-        c.save()
+        filename = render_challans([cid], f"Challan_{cid}.pdf") # also finds archived challans
         try: os.startfile(filename)
         except: pass
 
-    def _draw_exact_voucher(self, c, w, h, y_top, copy_name, challan, items, unique_num):
-        margin = 0.4 * inch
-        content_w = w - (2 * margin)
-        s = self.current_student_data # 1:Name, 4:Class, 7:Father, 0:ID
-        curr_y = y_top - 0.4 * inch
-        
-        # Header
-        try:
-            if os.path.exists(LOGO_PATH):
-                c.drawImage(LOGO_PATH, margin, curr_y - 0.4*inch, width=0.6*inch, height=0.6*inch, mask='auto', preserveAspectRatio=True)
-        except: pass
-        
-        c.setFont("Helvetica-Bold", 12); c.drawCentredString(w/2, curr_y, "IIUI SCHOOLS")
-        curr_y -= 0.15*inch
-        c.setFont("Helvetica", 9); c.drawCentredString(w/2, curr_y, "International Islamic University Islamabad")
-        curr_y -= 0.15*inch
-        c.setFont("Helvetica-Bold", 10); c.drawCentredString(w/2, curr_y, "Ali Pur Chattha Campus")
-        c.setFont("Helvetica-Bold", 9); c.drawRightString(w - margin, y_top - 0.4*inch, copy_name)
-        
-        curr_y -= 0.3*inch
-        c.setFont("Helvetica-Bold", 10); c.drawString(margin, curr_y, "FEE VOUCHER")
-        c.drawRightString(w - margin, curr_y, f"Challan No: {unique_num}")
-        
-        curr_y -= 0.2*inch
-        c.setFont("Helvetica", 8); c.drawString(margin, curr_y, "HBL P.M.C Branch, Faisalabad")
-        c.drawRightString(w - margin, curr_y, f"Date: {datetime.date.today().strftime('%d-%b-%Y')}")
-        
-        curr_y -= 0.15*inch
-        c.setFont("Helvetica-Bold", 9); c.drawString(margin, curr_y, "A/C No: 13497901233403")
-        
-        # Student Box
-        curr_y -= 0.15*inch
-        box_top = curr_y
-        box_h = 0.7 * inch
-        c.rect(margin, box_top - box_h, content_w, box_h)
-        
-        ty = box_top - 0.2*inch
-        c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Student:")
-        c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, f"{s[1]} S/O {s[7]}")
-        
-        ty -= 0.2*inch
-        c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Class:")
-        c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, s[4])
-        c.drawRightString(w-margin-5, ty, f"Roll: {s[0]:04d}")
-        
-        ty -= 0.2*inch
-        due_dt = datetime.datetime.strptime(challan[3], "%Y-%m-%d").strftime("%d-%b-%Y")
-        c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Due Date:")
-        c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, due_dt)
-
-        # Table
-        curr_y = box_top - box_h - 0.1*inch
-        c.setFillColor(colors.lightgrey)
-        c.rect(margin, curr_y - 0.2*inch, content_w, 0.2*inch, fill=1)
-        c.setFillColor(colors.black)
-        c.setFont("Helvetica-Bold", 9)
-        c.drawString(margin+5, curr_y - 0.14*inch, "Description")
-        c.drawRightString(w-margin-5, curr_y - 0.14*inch, "Amount (Rs)")
-        
-        curr_y -= 0.2*inch
-        c.setFont("Helvetica", 9)
-        for desc, amt in items:
-            curr_y -= 0.15*inch
-            c.drawString(margin+5, curr_y, desc)
-            c.drawRightString(w-margin-5, curr_y, f"{amt:,.0f}")
-            
-        curr_y -= 0.1*inch
-        c.line(margin, curr_y, w-margin, curr_y)
-        curr_y -= 0.15*inch
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(margin+5, curr_y, "Total Payable")
-        c.drawRightString(w-margin-5, curr_y, f"Rs. {challan[6]:,.0f}")
-        
-        fy = y_top - h + 0.3*inch
-        c.setFont("Helvetica", 8)
-        c.drawString(margin, fy, "Officer Signature")
-        c.drawRightString(w-margin, fy, "Cashier")
-
     def _open_file(self, filename):
         try: os.startfile(filename)
         except: pass
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+Concurrency load test. Simulates cashiers and clerks hammering the database
+with a mixed workload (searches, student lookups, new challans, payments and
+reports) from N threads or processes, against a throwaway copy of school.db,
+and reports throughput, p50/p95/p99 latency per operation and how often an
+operation gave up on a lock (SQLITE_BUSY).
+
+Each run is one configuration out of the product of
+    journal modes      delete, wal
+    busy timeouts      seconds sqlite waits for another writer
+    strategies         per-call  a new connection per function call (what the app does)
+                       pinned    one long-lived connection per worker
+                       api       every call through api_server.py
+and is appended to loadtest_results.jsonl so results can be compared over time:
+
+    python manage.py load-test --workers 16 --journal delete,wal --strategy per-call,api
+"""
+import asyncio
+import datetime
+import json
+import os
+import random
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import database
+
+LOAD_TEST_LOG = "loadtest_results.jsonl"
+MIN_STUDENTS = 500 # the copy is topped up to this many students before a run
+
+# Relative frequency of each operation at a fee counter / admissions desk
+MIX = {
+    "search": 30,
+    "get_student_by_id": 30,
+    "create_challan": 12,
+    "pay_challan": 12,
+    "report": 6,
+}
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+def _is_lock_error(e):
+    message = str(e).lower()
+    return "locked" in message or "busy" in message
+
+def _op(url, name):
+    if url:
+        from api_client import call
+        return partial(call, url, name)
+    return getattr(database, name)
+
+def _run_worker(config, student_ids, seed):
+    """One simulated user. Returns per-operation latencies (ms) and lock/error counts."""
+    database.DB_PATH = config["db_path"]
+    database.BUSY_TIMEOUT = config["busy_timeout"]
+    url = config.get("url")
+    if url:
+        import api_client
+        api_client.TOKEN = config["token"]
+    pinned = None
+    if config["strategy"] == "pinned":
+        from api_server import PooledConnection
+        pinned = sqlite3.connect(database.DB_PATH, factory=PooledConnection, timeout=database.BUSY_TIMEOUT)
+        pinned.execute("PRAGMA foreign_keys = 1")
+        database.pin_connection(pinned)
+    get_students, get_student_by_id = _op(url, "get_students"), _op(url, "get_student_by_id")
+    create_challan, pay_challan, get_unpaid_challans = _op(url, "create_challan"), _op(url, "pay_challan"), _op(url, "get_unpaid_challans")
+    reports = [_op(url, "get_student_fee_summary"), _op(url, "get_classwise_defaulter_list")]
+    today = datetime.date.today()
+    issue, due = today.strftime("%Y-%m-%d"), (today + datetime.timedelta(days=10)).strftime("%Y-%m-%d")
+    month_start = today.replace(day=1).strftime("%Y-%m-%d")
+    rng = random.Random(seed)
+    unpaid = [] # challans this worker created and has not paid yet
+
+    def pay():
+        challan_id = unpaid.pop() if unpaid else None
+        if challan_id is None:
+            open_challans = get_unpaid_challans(rng.choice(student_ids))
+            if not open_challans: return
+            challan_id = open_challans[0].challan_id
+        pay_challan(challan_id, issue)
+
+    def report():
+        if rng.random() < 0.5: rng.choice(reports)()
+        else: _op(url, "get_collection_summary")(month_start, issue)
+
+    operations = {
+        "search": lambda: get_students("".join(rng.choices("aeioubdhkmnrst", k=2))),
+        "get_student_by_id": lambda: get_student_by_id(rng.choice(student_ids)),
+        "create_challan": lambda: unpaid.append(create_challan(rng.choice(student_ids), issue, due, "Unpaid", [("Tuition Fee", 5000)])),
+        "pay_challan": pay,
+        "report": report,
+    }
+    names, weights = list(MIX), list(MIX.values())
+    latencies = {name: [] for name in names}
+    lock_errors = {name: 0 for name in names}
+    errors, first_error = 0, None
+    end = time.perf_counter() + config["duration"]
+    try:
+        while time.perf_counter() < end:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                operations[name]()
+            except sqlite3.OperationalError as e:
+                if not _is_lock_error(e): raise
+                lock_errors[name] += 1
+                if pinned: pinned.close() # roll back what the failed call left open
+                continue
+            except Exception as e:
+                errors += 1
+                first_error = first_error or f"{name}: {type(e).__name__}: {e}"
+                if pinned: pinned.close()
+                continue
+            latencies[name].append((time.perf_counter() - started) * 1000)
+    finally:
+        if pinned:
+            database.pin_connection(None)
+            sqlite3.Connection.close(pinned)
+    return {"latencies": latencies, "lock_errors": lock_errors, "errors": errors, "first_error": first_error}
+
+def _prepare_copy(source, folder, journal_mode, min_students):
+    """Copies the database for one run, sets its journal mode and tops up the students. Returns (path, student ids)."""
+    path = os.path.join(folder, "loadtest.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+    shutil.copyfile(source, path)
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    cursor = conn.cursor()
+    count = cursor.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+    if count < min_students:
+        rows = []
+        for i in range(count, min_students):
+            row = dict.fromkeys(database.STUDENT_COLUMNS)
+            row.update(full_name=f"Load Student {i}", father_name=f"Load Parent {i}", date_of_birth="2015-01-01",
+                       class_into_which_admission_is_sought=database.CLASS_LIST[i % len(database.CLASS_LIST)],
+                       contact_details=f"0300-{i:07d}", admission_date="2024-04-01", status="Active")
+            rows.append(tuple(row[c] for c in database.STUDENT_COLUMNS))
+        database.add_students_bulk(rows, cursor)
+    student_ids = [r[0] for r in cursor.execute("SELECT student_id FROM students WHERE status = 'Active'")]
+    conn.commit()
+    conn.close()
+    return path, student_ids
+
+def _start_api(db_path):
+    """Runs an API server on a free port in a background thread. Returns (url, token, stop)."""
+    from api_server import ApiServer
+    database.DB_PATH = db_path
+    token = secrets.token_hex(16)
+    server = ApiServer(token, port=0)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    def run():
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+    thread = threading.Thread(target=run, name="loadtest-api", daemon=True)
+    thread.start()
+    ready.wait()
+    def stop():
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+    return f"http://127.0.0.1:{server.port}", token, stop
+
+def _summarise(config, outcomes, elapsed):
+    operations = {}
+    everything = []
+    for name in MIX:
+        values = sorted(v for o in outcomes for v in o["latencies"][name])
+        everything.extend(values)
+        operations[name] = {"count": len(values), "p50": _percentile(values, 0.50), "p95": _percentile(values, 0.95),
+                            "p99": _percentile(values, 0.99), "lock_errors": sum(o["lock_errors"][name] for o in outcomes)}
+    everything.sort()
+    return {
+        "taken_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "label": config["label"], "journal_mode": config["journal_mode"], "busy_timeout": config["busy_timeout"],
+        "strategy": config["strategy"], "workers": config["workers"], "processes": config["processes"],
+        "duration": round(elapsed, 2), "ops": len(everything), "throughput": round(len(everything) / elapsed, 1),
+        "p50": _percentile(everything, 0.50), "p95": _percentile(everything, 0.95), "p99": _percentile(everything, 0.99),
+        "lock_errors": sum(op["lock_errors"] for op in operations.values()),
+        "errors": sum(o["errors"] for o in outcomes), "first_error": next((o["first_error"] for o in outcomes if o["first_error"]), None),
+        "operations": operations,
+    }
+
+def run_load_test(journal_modes=("delete", "wal"), busy_timeouts=(5.0,), strategies=("per-call",), workers=8,
+                  processes=False, duration=10, min_students=MIN_STUDENTS, label="", log_path=LOAD_TEST_LOG, progress=None):
+    """
+    Runs every combination of the given settings on a fresh copy of the live
+    database and appends one result per run to log_path. progress(result) is
+    called after each run. Returns the results.
+    """
+    folder = tempfile.mkdtemp(prefix="loadtest_")
+    live_path = database.DB_PATH
+    results = []
+    try:
+        source = database.snapshot_database(os.path.join(folder, "source.db"))
+        for journal_mode in journal_modes:
+            for busy_timeout in busy_timeouts:
+                for strategy in strategies:
+                    db_path, student_ids = _prepare_copy(source, folder, journal_mode, min_students)
+                    config = {"db_path": db_path, "journal_mode": journal_mode, "busy_timeout": busy_timeout,
+                              "strategy": strategy, "workers": workers, "processes": processes,
+                              "duration": duration, "label": label}
+                    stop = None
+                    if strategy == "api":
+                        config["url"], config["token"], stop = _start_api(db_path)
+                        config["journal_mode"] = "wal" # the server switches the file to WAL
+                    pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+                    started = time.perf_counter()
+                    try:
+                        outcomes = list(pool.map(_run_worker, [config] * workers, [student_ids] * workers, range(workers)))
+                    finally:
+                        pool.shutdown()
+                        if stop: stop()
+                        database.DB_PATH = live_path
+                    result = _summarise(config, outcomes, time.perf_counter() - started)
+                    results.append(result)
+                    if log_path:
+                        with open(log_path, "a") as f:
+                            f.write(json.dumps(result) + "\n")
+                    if progress: progress(result)
+    finally:
+        database.DB_PATH = live_path
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
@@ -2,11 +2,12 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from PIL import Image, ImageTk 
 import os
+import multiprocessing
+import threading
+import queue
 
-from admissions_window import AdmissionsWindow
-from fees_window import FeesWindow
-from login_window import LoginWindow
-from database import check_login, update_password # Added database imports
+from settings import load_settings
+import api_client
 
 # --- COLORS & FONTS ---
 COLOR_PRIMARY = "#003366"     # Navy Blue
@@ -51,6 +52,10 @@ class SchoolApp:
                   bg="#F39C12", fg="white", relief=tk.FLAT, 
                   font=("Segoe UI", 10, "bold"), cursor="hand2").pack(side=tk.LEFT, padx=10)
 
+        tk.Button(btn_frame, text="Backup Now", command=self.backup_now, 
+                  bg="#2980B9", fg="white", relief=tk.FLAT, 
+                  font=("Segoe UI", 10, "bold"), cursor="hand2").pack(side=tk.LEFT, padx=(0, 10))
+
         tk.Button(btn_frame, text="Logout / Exit", command=self.root.destroy, 
                   bg="#c0392b", fg="white", relief=tk.FLAT, 
                   font=("Segoe UI", 10, "bold"), cursor="hand2").pack(side=tk.LEFT)
@@ -74,6 +79,9 @@ class SchoolApp:
         self.create_card(cards_frame, "Fees & Accounts", "Generate monthly vouchers, manage dues,\nand print fee reports.", 
                          "#4CAF50", self.open_fees, 1)
 
+        # Once-a-day snapshot, copied in small steps on a worker thread so the UI stays responsive
+        threading.Thread(target=ensure_daily_snapshot, name="daily-backup").start()
+
     def create_card(self, parent, title, desc, color, command, col):
         # A "Card" is just a frame with a border and styling
         card = tk.Frame(parent, bg=COLOR_WHITE, relief=tk.RAISED, bd=1)
@@ -99,6 +107,19 @@ class SchoolApp:
     def open_fees(self):
         FeesWindow(tk.Toplevel(self.root))
 
+    def backup_now(self):
+        results = queue.Queue()
+        def worker():
+            try: results.put((take_snapshot("manual"), None))
+            except Exception as e: results.put((None, e))
+        threading.Thread(target=worker, daemon=True).start()
+        def poll():
+            try: path, error = results.get_nowait()
+            except queue.Empty: return self.root.after(200, poll)
+            if error: messagebox.showerror("Backup Failed", str(error))
+            else: messagebox.showinfo("Backup", f"Snapshot saved to:\n{os.path.abspath(path)}")
+        self.root.after(200, poll)
+
     def open_change_password(self):
         """Opens a window to change the user password."""
         cp_win = tk.Toplevel(self.root)
@@ -131,6 +152,11 @@ class SchoolApp:
                 messagebox.showerror("Error", "All fields are required.", parent=cp_win)
                 return
                 
+            if load_settings().get("api_url"):
+                # Not served over the API; changed on the machine that runs the server
+                messagebox.showerror("Error", "Change the password on the computer that runs the API server.", parent=cp_win)
+                return
+
             if check_login(user, old):
                 update_password(user, new)
                 messagebox.showinfo("Success", "Password updated successfully.", parent=cp_win)
@@ -150,6 +176,18 @@ class SchoolApp:
         self.root.geometry(f'{width}x{height}+{x}+{y}')
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Report worker processes in the frozen build
+    # With "api_url" set, the windows talk to the API server instead of opening school.db.
+    # Installed here rather than at import, so spawned workers (month-end close, batch
+    # printing, photos) keep using the snapshot or file they were given.
+    settings = load_settings()
+    api_client.install(settings.get("api_url"), settings.get("api_token", ""))
+    # The windows bind the database functions at import time, so they come after install()
+    from admissions_window import AdmissionsWindow
+    from fees_window import FeesWindow
+    from login_window import LoginWindow
+    from database import check_login, update_password
+    from backup import take_snapshot, ensure_daily_snapshot
     root = tk.Tk()
     root.withdraw() # Hide main window initially
     
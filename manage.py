@@ -0,0 +1,364 @@
+"""
+Command-line maintenance tasks for the school database.
+Meant to be run from Task Scheduler / cron as well as by hand, e.g.
+
+    python manage.py accrue-fines
+    python manage.py accrue-fines --as-of 2025-12-31
+    python manage.py rebuild-collections
+    python manage.py month-end-close --month 11 --year 2025
+    python manage.py import-students new_intake.xlsx [--resume | --start-row N]
+    python manage.py find-duplicates --out duplicates.csv
+    python manage.py reconcile-payments bank_statement.csv
+    python manage.py backup [--label nightly] [--verify | --list]
+    python manage.py archive-challans [--before 2024-01-01] [--vacuum]
+    python manage.py prune-changes [--keep-days 30]
+    python manage.py serve-api [--port 8765] [--readers 4]
+    python manage.py load-test [--workers 8] [--journal delete,wal] [--timeout 5] [--strategy per-call,pinned,api]
+    python manage.py campus add "Jalalpur Campus" //jalalpur/school/school.db
+    python manage.py campus list | remove "Jalalpur Campus"
+    python manage.py federated-report defaulters|collections|enrollment [--start ..] [--end ..] [--out file.csv]
+    python manage.py sync status | peers | clone [--name office-2] | add-peer SITE_ID NAME
+    python manage.py sync export PEER [--out file.chg] [--resend]
+    python manage.py sync import file.chg [more.chg ...]
+    python manage.py notify-defaulters [--gateway stub] [--rate 20] [--concurrency 20] [--min-amount 0] [--dry-run]
+    python manage.py notify-defaulters --resume RUN_ID [--retry-failed]
+    python manage.py notify-status [RUN_ID]
+"""
+import argparse
+import datetime
+import time
+
+from database import setup_database, accrue_fines, rebuild_collection_daily, rebuild_student_balances
+from settings import load_settings, save_settings
+
+def cmd_accrue_fines(args):
+    settings = load_settings()
+    as_of = args.as_of or datetime.date.today().strftime("%Y-%m-%d")
+    updated = accrue_fines(as_of, settings["fine_per_day"], settings["fine_cap"], settings["fine_grace_days"])
+    settings["fines_last_run"] = as_of
+    save_settings(settings)
+    print(f"Fines accrued as of {as_of}: {updated} challans updated.")
+
+def cmd_rebuild_collections(args):
+    rows = rebuild_collection_daily()
+    rebuild_student_balances()
+    print(f"Collection rollup rebuilt: {rows} (date, class) rows. Student balances recomputed.")
+
+def cmd_month_end_close(args):
+    from reports import run_month_end_close
+    today = datetime.date.today()
+    manifest = run_month_end_close(args.month or today.month, args.year or today.year, args.out, args.workers)
+    for r in manifest["reports"]:
+        print(f"  {r['report']:<20} {r['file']:<24} {r['seconds']:>8.2f}s")
+    for e in manifest["errors"]:
+        print(f"  {e['report']:<20} FAILED: {e['error']}")
+    print(f"Month-end close written to {manifest['folder']} in {manifest['total_seconds']:.2f}s")
+
+def cmd_import_students(args):
+    from student_import import import_students
+    started = time.perf_counter()
+    summary = import_students(args.file, start_row=args.start_row, resume=args.resume, error_report=args.errors,
+                              progress=lambda row: print(f"  committed through row {row}"))
+    seconds = time.perf_counter() - started
+    rate = summary["imported"] / seconds if seconds else 0
+    print(f"Imported {summary['imported']} students ({rate:,.0f} rows/s), {summary['errors']} rows rejected, "
+          f"{summary['warnings']} possible duplicates.")
+    if summary["error_report"]:
+        print(f"Error report: {summary['error_report']}")
+
+def cmd_find_duplicates(args):
+    from database import cluster_duplicate_students
+    from reports import export_rows_csv
+    clusters = cluster_duplicate_students()
+    rows = ((n, *student) for n, cluster in enumerate(clusters, 1) for student in cluster)
+    export_rows_csv(args.out, ["Cluster", "Student ID", "Name", "Father", "Date of Birth", "Contact"], rows)
+    print(f"{len(clusters)} possible duplicate groups ({sum(len(c) for c in clusters)} students) written to {args.out}")
+
+def cmd_reconcile_payments(args):
+    from payment_import import import_payments
+    summary = import_payments(args.file, error_report=args.errors, default_method=args.method)
+    print(f"Recorded {summary['recorded']} payments (Rs. {summary['amount']:,.0f}), "
+          f"{summary['skipped']} already on file, {summary['errors']} rows rejected.")
+    if summary["unapplied"]:
+        print(f"Rs. {summary['unapplied']:,.0f} exceeded the outstanding challans and is held as credit for the next challans.")
+    if summary["unknown_students"]:
+        print(f"Unknown student IDs: {', '.join(str(s) for s in sorted(set(summary['unknown_students'])))}")
+    if summary["error_report"]:
+        print(f"Error report: {summary['error_report']}")
+
+def cmd_backup(args):
+    from backup import take_snapshot, list_snapshots, verify_snapshot
+    if args.list or args.verify:
+        for path, label, taken_at, size in list_snapshots():
+            status = ""
+            if args.verify:
+                ok, message = verify_snapshot(path)
+                status = "ok" if ok else f"FAILED: {message}"
+            print(f"  {taken_at:%Y-%m-%d %H:%M:%S}  {label:<24} {size / 1024:>10,.0f} KB  {status}")
+        return
+    started = time.perf_counter()
+    path = take_snapshot(args.label)
+    print(f"Snapshot written to {path} in {time.perf_counter() - started:.2f}s")
+
+def cmd_archive_challans(args):
+    from database import archive_paid_challans
+    before = args.before
+    if not before:
+        today = datetime.date.today()
+        years = int(float(load_settings()["archive_after_years"] or 2))
+        before = f"{today.year - years:04d}-01-01"
+    moved = archive_paid_challans(before, vacuum=args.vacuum)
+    for year, count in moved.items():
+        print(f"  {year}: {count} paid challans archived")
+    print(f"Archived {sum(moved.values())} challans issued before {before}.")
+
+def cmd_prune_changes(args):
+    from database import prune_change_log
+    removed = prune_change_log(args.keep_days)
+    print(f"Removed {removed} change log entries older than {args.keep_days} days.")
+
+def cmd_serve_api(args):
+    import secrets
+    from api_server import serve, HOST
+    settings = load_settings()
+    if not settings.get("api_token"):
+        settings["api_token"] = secrets.token_urlsafe(24)
+        save_settings(settings)
+        print(f"Generated api_token {settings['api_token']}; set the same api_token on every terminal.")
+    port = args.port or int(settings["api_port"] or 8765)
+    print(f"Serving the school database on http://{HOST}:{port} (Ctrl+C to stop)")
+    try:
+        serve(settings["api_token"], HOST, port, args.readers)
+    except KeyboardInterrupt:
+        pass
+
+def cmd_load_test(args):
+    from loadtest import run_load_test, LOAD_TEST_LOG
+    def show(r):
+        print(f"  {r['journal_mode']:<7} timeout {r['busy_timeout']:>5}s  {r['strategy']:<9} {r['throughput']:>8.1f} ops/s  "
+              f"p50 {r['p50']}ms  p95 {r['p95']}ms  p99 {r['p99']}ms  lock errors {r['lock_errors']}  errors {r['errors']}")
+        if r["first_error"]: print(f"      first error: {r['first_error']}")
+    print(f"{args.workers} {'processes' if args.processes else 'threads'}, {args.duration}s per run")
+    run_load_test([m.strip() for m in args.journal.split(",")], [float(t) for t in args.timeout.split(",")],
+                  [s.strip() for s in args.strategy.split(",")], args.workers, args.processes, args.duration,
+                  args.students, args.label, args.out, progress=show)
+    print(f"Results appended to {args.out}")
+
+def cmd_campus(args):
+    from federation import load_campuses, register_campus, remove_campus
+    if args.action != "list" and not args.name or args.action == "add" and not args.db_path:
+        raise SystemExit(f"usage: manage.py campus {args.action} NAME{' DB_PATH' if args.action == 'add' else ''}")
+    if args.action == "add":
+        try:
+            register_campus(args.name, args.db_path)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"Registered {args.name}: {args.db_path}")
+    elif args.action == "remove":
+        print(f"Removed {args.name}." if remove_campus(args.name) else f"No campus named {args.name}.")
+    else:
+        for name, path in load_campuses():
+            print(f"  {name:<30} {path}")
+
+def cmd_federated_report(args):
+    from federation import export_federated, load_campuses
+    if not load_campuses():
+        raise SystemExit("No campuses registered; see: manage.py campus add")
+    today = datetime.date.today()
+    report_args = ()
+    if args.report == "collections":
+        report_args = (args.start or today.replace(day=1).strftime("%Y-%m-%d"), args.end or today.strftime("%Y-%m-%d"))
+    out = args.out or f"Federated_{args.report}_{today:%Y%m%d}.csv"
+    started = time.perf_counter()
+    summary = export_federated(args.report, out, report_args)
+    for name, total in summary["totals"].items():
+        print(f"  {name:<30} {total:>14,.0f}")
+    for name, message in summary["errors"]:
+        print(f"  {name}: FAILED ({message})")
+    print(f"{summary['rows']} rows written to {summary['file']} in {time.perf_counter() - started:.2f}s")
+
+def cmd_sync(args):
+    import replication
+    if args.action == "status":
+        site_id, name, seq = replication.get_site()
+        print(f"This site: {name} ({site_id}), {seq} changes recorded")
+    elif args.action == "peers":
+        for site_id, name, sent, acked, received, last_sync in replication.get_peers():
+            print(f"  {name or '?':<20} {site_id}  sent {sent}  confirmed {acked}  received {received}  last sync {last_sync or '-'}")
+    elif args.action == "clone":
+        print(f"This copy is now site {replication.clone_site(args.name)}.")
+    elif args.action == "add-peer":
+        if len(args.targets) != 2:
+            raise SystemExit("usage: manage.py sync add-peer SITE_ID NAME")
+        replication.add_peer(*args.targets)
+        print(f"Registered peer {args.targets[1]}.")
+    elif args.action == "export":
+        if len(args.targets) != 1:
+            raise SystemExit("usage: manage.py sync export PEER [--out file.chg]")
+        out = args.out or f"changes_to_{args.targets[0]}_{datetime.datetime.now():%Y%m%d_%H%M%S}.chg"
+        started = time.perf_counter()
+        try:
+            summary = replication.export_changeset(args.targets[0], out, args.resend)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        rows = ", ".join(f"{n} {entity}s" for entity, n in summary["rows"].items())
+        print(f"{'Full copy' if summary['full'] else 'Changes'} for {summary['peer']}: {rows}, {summary['deleted']} deletions")
+        print(f"Written to {out} in {time.perf_counter() - started:.2f}s")
+    else:
+        for path in args.targets:
+            started = time.perf_counter()
+            try:
+                summary = replication.apply_changeset(path)
+            except (ValueError, OSError) as e:
+                raise SystemExit(f"{path}: {e}")
+            rows = ", ".join(f"{n} {entity}s" for entity, n in summary["applied"].items())
+            print(f"{path} from {summary['peer']}: applied {rows}, {summary['deleted']} deletions "
+                  f"in {time.perf_counter() - started:.2f}s")
+            print(f"  skipped {summary['older']} older versions, {summary['deleted_here']} rows deleted here, "
+                  f"{summary['missing_parent']} without their student, {summary['conflicts']} conflicts")
+
+def cmd_notify_defaulters(args):
+    import notifications
+    if args.dry_run:
+        messages, unreachable = notifications.build_messages(args.min_amount)
+        for _, channel, address, _, _, text in messages[:5]:
+            print(f"  {channel} {address}: {text}")
+        print(f"{len(messages)} parents would be notified; {len(unreachable)} defaulters have no usable contact.")
+        return
+    run_id = args.resume
+    if run_id is None:
+        gateway = args.gateway or load_settings()["notify_gateway"]
+        run_id, count, unreachable = notifications.create_run(gateway, args.min_amount)
+        print(f"Run {run_id}: {count} parents to notify; {len(unreachable)} defaulters have no usable contact.")
+    last = [0.0]
+    def show(counts):
+        if time.perf_counter() - last[0] >= 2 or not counts["remaining"]:
+            last[0] = time.perf_counter()
+            print(f"  sent {counts['sent']}, failed {counts['failed']}, retries {counts['retries']}, remaining {counts['remaining']}")
+    try:
+        gateway = notifications.make_gateway(args.gateway) if args.gateway else None
+        summary = notifications.send_run(run_id, gateway, args.concurrency, args.rate, args.retry_failed, show)
+    except KeyboardInterrupt:
+        raise SystemExit(f"Interrupted; continue with: manage.py notify-defaulters --resume {run_id}")
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Run {run_id}: {summary['sent']} sent, {summary['failed']} failed ({summary['retries']} retries) in {summary['seconds']}s")
+
+def cmd_notify_status(args):
+    from notifications import get_runs, get_failed_messages
+    if args.run_id:
+        for recipient, attempts, error in get_failed_messages(args.run_id):
+            print(f"  {recipient:<40} {attempts} attempts  {error}")
+        return
+    for run_id, created_at, gateway, recipients, sent, failed, pending, finished_at in get_runs():
+        print(f"  {run_id:>4}  {created_at}  {gateway:<6} {recipients:>6} parents  sent {sent}  failed {failed}  "
+              f"pending {pending}  {'finished ' + finished_at if finished_at else 'unfinished'}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="School system maintenance tasks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("accrue-fines", help="Recompute late fines on overdue unpaid challans")
+    p.add_argument("--as-of", help="Date to compute fines for (YYYY-MM-DD), default today")
+    p.set_defaults(func=cmd_accrue_fines)
+
+    p = sub.add_parser("rebuild-collections", help="Rebuild the daily collection rollup and student balances")
+    p.set_defaults(func=cmd_rebuild_collections)
+
+    p = sub.add_parser("month-end-close", help="Build all month-end accounting reports from one snapshot")
+    p.add_argument("--month", type=int, help="Month number, default current month")
+    p.add_argument("--year", type=int, help="Year, default current year")
+    p.add_argument("--out", default="month_end", help="Output root folder (default: month_end)")
+    p.add_argument("--workers", type=int, help="Worker processes (default: one per report)")
+    p.set_defaults(func=cmd_month_end_close)
+
+    p = sub.add_parser("import-students", help="Bulk import students from a CSV or XLSX file")
+    p.add_argument("file", help="Spreadsheet with a header row")
+    p.add_argument("--start-row", type=int, help="First spreadsheet row to import (header is row 1)")
+    p.add_argument("--resume", action="store_true", help="Continue after the last committed row of a previous run")
+    p.add_argument("--errors", help="Where to write the row-level error report")
+    p.set_defaults(func=cmd_import_students)
+
+    p = sub.add_parser("find-duplicates", help="Group existing students that look like the same child")
+    p.add_argument("--out", default="duplicate_admissions.csv", help="CSV file for the clusters")
+    p.set_defaults(func=cmd_find_duplicates)
+
+    p = sub.add_parser("reconcile-payments", help="Apply a bank/collection file of payments oldest-challan-first")
+    p.add_argument("file", help="CSV or XLSX with student id, amount, date and optional reference/method columns")
+    p.add_argument("--method", default="Bank", help="Payment method for rows without one (default: Bank)")
+    p.add_argument("--errors", help="Where to write the row-level error report")
+    p.set_defaults(func=cmd_reconcile_payments)
+
+    p = sub.add_parser("backup", help="Take a verified, compressed snapshot of the live database")
+    p.add_argument("--label", default="manual", help="Snapshot label, used for rotation (default: manual)")
+    p.add_argument("--list", action="store_true", help="List existing snapshots instead")
+    p.add_argument("--verify", action="store_true", help="List and verify every existing snapshot")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("archive-challans", help="Move old settled challans into yearly archive databases")
+    p.add_argument("--before", help="Archive paid challans issued before this date (default: start of the year archive_after_years ago)")
+    p.add_argument("--vacuum", action="store_true", help="Compact the live database afterwards")
+    p.set_defaults(func=cmd_archive_challans)
+
+    p = sub.add_parser("prune-changes", help="Trim the change log that windows and caches refresh from")
+    p.add_argument("--keep-days", type=int, default=30, help="Days of changes to keep (default: 30)")
+    p.set_defaults(func=cmd_prune_changes)
+
+    p = sub.add_parser("serve-api", help="Serve the database to other terminals over a local HTTP/JSON API")
+    p.add_argument("--port", type=int, help="Port to listen on (default: api_port setting, 8765)")
+    p.add_argument("--readers", type=int, default=4, help="Concurrent read connections (default: 4)")
+    p.set_defaults(func=cmd_serve_api)
+
+    p = sub.add_parser("load-test", help="Measure throughput, latency and lock errors under concurrent users (on a copy)")
+    p.add_argument("--workers", type=int, default=8, help="Simulated users (default: 8)")
+    p.add_argument("--processes", action="store_true", help="Run users as processes instead of threads")
+    p.add_argument("--duration", type=float, default=10, help="Seconds per configuration (default: 10)")
+    p.add_argument("--journal", default="delete,wal", help="Journal modes to compare (default: delete,wal)")
+    p.add_argument("--timeout", default="5", help="Busy timeouts in seconds to compare (default: 5)")
+    p.add_argument("--strategy", default="per-call", help="Connection strategies: per-call, pinned, api (default: per-call)")
+    p.add_argument("--students", type=int, default=500, help="Top the copy up to this many students (default: 500)")
+    p.add_argument("--label", default="", help="Label stored with the results, e.g. a version")
+    p.add_argument("--out", default="loadtest_results.jsonl", help="Results log to append to")
+    p.set_defaults(func=cmd_load_test)
+
+    p = sub.add_parser("campus", help="Register the campus databases used for consolidated reports")
+    p.add_argument("action", choices=["add", "list", "remove"])
+    p.add_argument("name", nargs="?")
+    p.add_argument("db_path", nargs="?")
+    p.set_defaults(func=cmd_campus)
+
+    p = sub.add_parser("federated-report", help="Run a report across all registered campuses")
+    p.add_argument("report", choices=["defaulters", "collections", "enrollment"])
+    p.add_argument("--start", help="Collections from date (default: first of this month)")
+    p.add_argument("--end", help="Collections to date (default: today)")
+    p.add_argument("--out", help="CSV file to write")
+    p.set_defaults(func=cmd_federated_report)
+
+    p = sub.add_parser("sync", help="Exchange changesets with another copy of the database (USB sync)")
+    p.add_argument("action", choices=["status", "peers", "clone", "add-peer", "export", "import"])
+    p.add_argument("targets", nargs="*", help="export: peer name or site id; import: changeset files")
+    p.add_argument("--out", help="Changeset file to write (export)")
+    p.add_argument("--resend", action="store_true", help="Include everything the peer has not confirmed (export)")
+    p.add_argument("--name", help="Name for this site (clone)")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("notify-defaulters", help="Send overdue-fee notices to parents by SMS/email")
+    p.add_argument("--gateway", help="stub, http or package.module:Class (default: notify_gateway setting)")
+    p.add_argument("--rate", type=float, help="Messages per second at most (default: notify_rate setting)")
+    p.add_argument("--concurrency", type=int, help="Messages in flight at once (default: notify_concurrency setting)")
+    p.add_argument("--min-amount", type=float, default=0, help="Only parents owing more than this overdue")
+    p.add_argument("--dry-run", action="store_true", help="Show what would be sent without storing or sending")
+    p.add_argument("--resume", type=int, metavar="RUN_ID", help="Continue an interrupted run")
+    p.add_argument("--retry-failed", action="store_true", help="With --resume, also resend messages that failed")
+    p.set_defaults(func=cmd_notify_defaulters)
+
+    p = sub.add_parser("notify-status", help="List notification runs, or the failed messages of one")
+    p.add_argument("run_id", nargs="?", type=int)
+    p.set_defaults(func=cmd_notify_status)
+
+    args = parser.parse_args(argv)
+    setup_database()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
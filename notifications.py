@@ -0,0 +1,334 @@
+"""
+Overdue-fee notices to parents by SMS or email. A run takes every active
+student with an overdue amount (get_student_fee_summary), groups them by the
+parent's contact in contact_details (a mobile number, or an email address),
+builds one message per parent and stores all of them in notification_log
+before anything is sent. They then go out through a gateway from an asyncio
+loop with bounded concurrency, a rate limit and retries with backoff, and
+each outcome is written back to the log in batches. An interrupted run is
+resumed with only the messages that have not gone out:
+
+    python manage.py notify-defaulters [--gateway stub] [--rate 20] [--concurrency 20]
+    python manage.py notify-defaulters --resume 12 [--retry-failed]
+    python manage.py notify-status [12]
+
+A gateway is any object with `async send(channel, address, message, reference)`
+that returns the provider's message id and raises TemporaryError for failures
+worth retrying (anything else fails the message). "stub" appends messages to
+notifications_outbox.jsonl with simulated latency and failures, "http" posts
+JSON to notify_gateway_url, and "package.module:Class" loads any other class
+(constructed with the settings dict). The reference passed to send() is the
+same on every attempt and on resume, so a provider can drop duplicates.
+"""
+import asyncio
+import datetime
+import http.client
+import importlib
+import json
+import random
+import re
+import time
+import urllib.parse
+
+import database
+from settings import load_settings
+
+STUB_OUTBOX = "notifications_outbox.jsonl"
+MAX_ATTEMPTS = 4
+RETRY_DELAY = 2.0 # seconds before the first retry, doubled for each one after
+SEND_TIMEOUT = 30 # seconds a gateway gets per message
+FLUSH_ROWS = 200 # outcomes written to the log at a time
+FLUSH_SECONDS = 1.0
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# A Pakistani mobile number (03xx-xxxxxxx, +92 3xx xxxxxxx); landlines and other digits in the field never match
+MOBILE_RE = re.compile(r"(?<!\d)(?:(?:\+|00)?92[-\s]?|0)?(3\d{2})[-\s]?(\d{7})(?!\d)")
+
+class TemporaryError(Exception):
+    """A send that may succeed if tried again (timeout, throttling, provider down)."""
+
+# --- Building the messages ---
+
+def parse_contact(contact_details):
+    """(channel, address) to reach a parent at: the first mobile number for SMS, else an email address. None if neither."""
+    match = MOBILE_RE.search(contact_details or "")
+    if match:
+        return "sms", "0" + match.group(1) + match.group(2)
+    match = EMAIL_RE.search(contact_details or "")
+    if match:
+        return "email", match.group(0).lower()
+    return None
+
+def build_messages(min_overdue=0, template=None, campus=None):
+    """
+    Groups the defaulters by parent contact. Returns (messages, unreachable):
+    messages as [(recipient, channel, address, [student ids], overdue, text)]
+    and the (student_id, name, contact) rows with no usable contact.
+    """
+    settings = load_settings()
+    template = template or settings["notify_template"]
+    campus = campus or settings["campus_name"]
+    parents = {}
+    unreachable = []
+    for sid, name, class_name, contact, overdue, _ in database.get_student_fee_summary():
+        if not overdue or overdue <= min_overdue:
+            continue
+        target = parse_contact(contact)
+        if target is None:
+            unreachable.append((sid, name, contact))
+            continue
+        parents.setdefault(target, []).append((sid, name, class_name, overdue))
+    messages = []
+    for (channel, address), children in sorted(parents.items()):
+        amount = sum(c[3] for c in children)
+        students = ", ".join(f"{name} ({class_name}) Rs. {overdue:,.0f}" for _, name, class_name, overdue in children)
+        text = template.format(students=students, amount=f"{amount:,.0f}", campus=campus)
+        messages.append((f"{channel}:{address}", channel, address, [c[0] for c in children], amount, text))
+    return messages, unreachable
+
+def create_run(gateway, min_overdue=0):
+    """Builds and stores the messages of a new run. Returns (run_id, messages stored, unreachable students)."""
+    messages, unreachable = build_messages(min_overdue)
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO notification_runs (gateway, recipients) VALUES (?, ?)", (gateway, len(messages)))
+    run_id = cursor.lastrowid
+    cursor.executemany("""
+        INSERT INTO notification_log (run_id, recipient, channel, address, student_ids, amount, message)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(run_id, recipient, channel, address, json.dumps(ids), amount, text)
+          for recipient, channel, address, ids, amount, text in messages])
+    conn.commit()
+    conn.close()
+    return run_id, len(messages), unreachable
+
+# --- Gateways ---
+
+class StubGateway:
+    """Sends nothing: waits like a provider would, fails now and then, and appends each message to an outbox file."""
+    def __init__(self, settings=None, outbox=STUB_OUTBOX, latency=(0.05, 0.4), failure_rate=0.05, seed=None):
+        self.outbox = outbox
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.file = None
+
+    async def send(self, channel, address, message, reference):
+        await asyncio.sleep(self.rng.uniform(*self.latency))
+        if self.rng.random() < self.failure_rate:
+            raise TemporaryError("stub: simulated provider timeout")
+        if self.file is None:
+            self.file = open(self.outbox, "a", encoding="utf-8")
+        self.file.write(json.dumps({"channel": channel, "to": address, "message": message, "reference": reference,
+                                    "at": datetime.datetime.now().isoformat(timespec="seconds")}) + "\n")
+        return f"stub-{reference}"
+
+    def close(self):
+        if self.file: self.file.close()
+
+class HttpGateway:
+    """
+    POSTs {"channel", "to", "message", "reference"} as JSON to an SMS/email
+    provider or relay and returns the "id" of its JSON reply. Network errors,
+    429 and 5xx responses are retried; other 4xx fail the message.
+    """
+    def __init__(self, settings):
+        self.url = urllib.parse.urlsplit(settings["notify_gateway_url"])
+        if not self.url.hostname:
+            raise ValueError("Set notify_gateway_url in the settings to use the http gateway.")
+
+    def _post(self, body):
+        # One connection per request: this runs on the default executor's threads
+        cls = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+        conn = cls(self.url.hostname, self.url.port, timeout=SEND_TIMEOUT)
+        try:
+            conn.request("POST", self.url.path or "/", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    async def send(self, channel, address, message, reference):
+        body = json.dumps({"channel": channel, "to": address, "message": message, "reference": reference})
+        try:
+            status, data = await asyncio.get_running_loop().run_in_executor(None, self._post, body)
+        except (OSError, http.client.HTTPException) as e:
+            raise TemporaryError(f"{type(e).__name__}: {e}")
+        if status == 429 or status >= 500:
+            raise TemporaryError(f"HTTP {status}")
+        if status >= 400:
+            raise ValueError(f"HTTP {status}: {data[:200].decode('utf-8', 'replace')}")
+        try:
+            return str(json.loads(data).get("id", ""))
+        except (ValueError, AttributeError):
+            return ""
+
+GATEWAYS = {"stub": StubGateway, "http": HttpGateway}
+
+def make_gateway(name, settings=None):
+    """A gateway by name ("stub", "http") or "package.module:Class"."""
+    settings = settings or load_settings()
+    if name in GATEWAYS:
+        return GATEWAYS[name](settings)
+    module, _, cls = name.partition(":")
+    if not cls:
+        raise ValueError(f"Unknown gateway {name!r}; use stub, http or package.module:Class.")
+    return getattr(importlib.import_module(module), cls)(settings)
+
+# --- Sending ---
+
+class RateLimiter:
+    """Token bucket: on average rate acquisitions per second, in bursts of at most rate."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _write_outcomes(outcomes):
+    conn = database.connect_db()
+    conn.executemany("""
+        UPDATE notification_log SET status = ?, attempts = ?, gateway_ref = ?, error = ?, sent_at = ?
+        WHERE run_id = ? AND recipient = ?
+    """, outcomes)
+    conn.commit()
+    conn.close()
+
+async def _send_all(run_id, jobs, gateway, concurrency, rate, progress):
+    """Sends [(recipient, channel, address, message, attempts)]; outcomes are logged as they complete."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    for job in jobs: queue.put_nowait(job)
+    limiter = RateLimiter(rate)
+    counts = {"sent": 0, "failed": 0, "retries": 0}
+    outcomes = []
+    remaining = len(jobs)
+    all_done = asyncio.Event()
+    stopping = False
+
+    def finish(job, attempts, status, ref=None, error=None):
+        nonlocal remaining
+        sent_at = datetime.datetime.now().isoformat(sep=" ", timespec="seconds") if status == "sent" else None
+        outcomes.append((status, attempts, ref, error, sent_at, run_id, job[0]))
+        counts[status] += 1
+        remaining -= 1
+        if progress: progress(dict(counts, remaining=remaining))
+        if not remaining: all_done.set()
+
+    def flush():
+        if outcomes:
+            _write_outcomes(outcomes[:])
+            outcomes.clear()
+
+    async def worker():
+        # The flag as well as cancel(): wait_for() can swallow a cancellation
+        # that arrives as the send completes
+        while not stopping:
+            job = await queue.get()
+            recipient, channel, address, message, attempts = job
+            attempts += 1
+            try:
+                await limiter.acquire()
+                ref = await asyncio.wait_for(gateway.send(channel, address, message, f"{run_id}-{recipient}"), SEND_TIMEOUT)
+            except (TemporaryError, asyncio.TimeoutError) as e:
+                if attempts < MAX_ATTEMPTS:
+                    # Requeued after the backoff, so the slot serves other messages meanwhile
+                    counts["retries"] += 1
+                    loop.call_later(RETRY_DELAY * 2 ** (attempts - 1), queue.put_nowait, job[:4] + (attempts,))
+                    continue
+                finish(job, attempts, "failed", error=str(e) or type(e).__name__)
+            except Exception as e:
+                finish(job, attempts, "failed", error=f"{type(e).__name__}: {e}")
+            else:
+                finish(job, attempts, "sent", ref=ref)
+            if len(outcomes) >= FLUSH_ROWS: flush()
+
+    if not jobs:
+        return counts
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    waiter = asyncio.create_task(all_done.wait())
+    try:
+        while remaining:
+            await asyncio.wait([waiter], timeout=FLUSH_SECONDS)
+            flush()
+    finally:
+        stopping = True
+        waiter.cancel()
+        for w in workers: w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        flush() # what finished before an interruption is kept; the rest stays pending
+    return counts
+
+def send_run(run_id, gateway=None, concurrency=None, rate=None, retry_failed=False, progress=None):
+    """
+    Sends the pending messages of a run (and its failed ones with
+    retry_failed). Returns {"sent", "failed", "retries", "seconds"}.
+    progress(counts) is called after each message.
+    """
+    settings = load_settings()
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT gateway FROM notification_runs WHERE run_id = ?", (run_id,))
+    run = cursor.fetchone()
+    if run is None:
+        conn.close()
+        raise ValueError(f"No notification run {run_id}.")
+    statuses = ("pending", "failed") if retry_failed else ("pending",)
+    cursor.execute(f"""
+        SELECT recipient, channel, address, message, CASE WHEN status = 'failed' THEN 0 ELSE attempts END
+        FROM notification_log WHERE run_id = ? AND status IN ({", ".join("?" * len(statuses))}) ORDER BY recipient
+    """, (run_id,) + statuses)
+    jobs = [tuple(row) for row in cursor.fetchall()]
+    conn.close()
+    gateway = gateway or make_gateway(run[0] or settings["notify_gateway"], settings)
+    concurrency = int(concurrency or settings["notify_concurrency"] or 20)
+    rate = float(settings["notify_rate"] or 0) if rate is None else float(rate)
+    started = time.perf_counter()
+    try:
+        counts = asyncio.run(_send_all(run_id, jobs, gateway, concurrency, rate, progress))
+    finally:
+        if hasattr(gateway, "close"): gateway.close()
+    conn = database.connect_db()
+    conn.execute("""
+        UPDATE notification_runs SET finished_at = datetime('now', 'localtime')
+        WHERE run_id = ? AND NOT EXISTS (SELECT 1 FROM notification_log WHERE run_id = ? AND status = 'pending')
+    """, (run_id, run_id))
+    conn.commit()
+    conn.close()
+    return dict(counts, seconds=round(time.perf_counter() - started, 1))
+
+def get_runs():
+    """[(run_id, created_at, gateway, recipients, sent, failed, pending, finished_at)], newest first."""
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT r.run_id, r.created_at, r.gateway, r.recipients,
+               COUNT(CASE WHEN l.status = 'sent' THEN 1 END), COUNT(CASE WHEN l.status = 'failed' THEN 1 END),
+               COUNT(CASE WHEN l.status = 'pending' THEN 1 END), r.finished_at
+        FROM notification_runs r LEFT JOIN notification_log l ON l.run_id = r.run_id
+        GROUP BY r.run_id ORDER BY r.run_id DESC
+    """)
+    runs = cursor.fetchall()
+    conn.close()
+    return runs
+
+def get_failed_messages(run_id):
+    """[(recipient, attempts, error)] of a run's failed messages."""
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT recipient, attempts, error FROM notification_log WHERE run_id = ? AND status = 'failed' ORDER BY recipient", (run_id,))
+    failed = cursor.fetchall()
+    conn.close()
+    return failed
@@ -0,0 +1,74 @@
+"""
+Payment reconciliation import. Reads a bank/collection file (CSV or XLSX with
+a header row: student id, amount, date, and optionally reference and method)
+and applies every payment through allocate_payments_bulk in one transaction.
+Rows with a reference that is already recorded are skipped, so the same file
+can be imported again safely.
+"""
+import csv
+import datetime
+import os
+
+from database import allocate_payments_bulk
+from student_import import iter_spreadsheet, _norm_header, _parse_date
+
+HEADER_ALIASES = {
+    "student_id": ("studentid", "id", "rollno", "roll"),
+    "amount": ("amount", "paid", "amountpaid"),
+    "payment_date": ("paymentdate", "date", "paidon"),
+    "reference": ("reference", "ref", "transactionid", "receiptno"),
+    "method": ("method", "mode", "paymentmethod"),
+}
+
+def import_payments(path, error_report=None, default_method="Bank"):
+    """Applies the payments in the file. Returns the allocate_payments_bulk summary plus 'errors' and 'error_report'."""
+    error_report = error_report or os.path.splitext(path)[0] + "_payment_errors.csv"
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    rows = iter_spreadsheet(path)
+    try:
+        headers = next(rows)
+    except StopIteration:
+        headers = []
+    lookup = {alias: field for field, aliases in HEADER_ALIASES.items() for alias in aliases}
+    positions = {}
+    for i, header in enumerate(headers):
+        field = lookup.get(_norm_header(header))
+        if field and field not in positions:
+            positions[field] = i
+    missing = [f for f in ("student_id", "amount") if f not in positions]
+    if missing:
+        raise ValueError(f"Payment file has no column for: {', '.join(missing)}")
+
+    def cell(raw, field):
+        i = positions.get(field)
+        value = raw[i] if i is not None and i < len(raw) else None
+        return value.strip() if isinstance(value, str) else value
+
+    payments = []
+    errors = []
+    for row_no, raw in enumerate(rows, start=2):
+        if not any(v not in (None, "") for v in raw):
+            continue
+        try:
+            student_id = int(float(cell(raw, "student_id")))
+            amount = float(str(cell(raw, "amount")).replace(",", ""))
+            if amount <= 0: raise ValueError("amount must be positive")
+            payment_date = _parse_date(cell(raw, "payment_date")) or today
+        except (TypeError, ValueError) as e:
+            errors.append((row_no, str(e), raw))
+            continue
+        reference = cell(raw, "reference")
+        payments.append((student_id, amount, payment_date, cell(raw, "method") or default_method,
+                         str(reference) if reference not in (None, "") else None))
+
+    summary = allocate_payments_bulk(payments)
+    summary["errors"] = len(errors)
+    summary["error_report"] = None
+    if errors:
+        with open(error_report, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Row", "Error"] + list(headers))
+            for row_no, message, raw in errors:
+                writer.writerow([row_no, message] + list(raw))
+        summary["error_report"] = error_report
+    return summary
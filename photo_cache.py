@@ -0,0 +1,85 @@
+"""
+Student photo storage. Uploads are normalized (EXIF orientation, RGB JPEG)
+and stored once under a content hash, so the same picture uploaded twice is
+kept once. Each stored photo gets two precomputed renditions:
+
+    student_photos/preview/<name>.jpg  - 140x180 for the admissions form preview
+    student_photos/print/<name>.jpg    - 300 dpi for the printed admission form
+
+The UI and PDFs read the renditions instead of decoding the original.
+"""
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+PHOTO_DIR = "student_photos"
+PREVIEW_SIZE = (140, 180)
+PRINT_SIZE = (417, 500) # 100 x 120 pt photo box at 300 dpi
+RENDITIONS = {"preview": PREVIEW_SIZE, "print": PRINT_SIZE}
+
+# One background worker keeps ingestion off the Tk thread and serializes file writes
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photo-ingest")
+
+def _digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _save_jpeg(img, dest, quality):
+    tmp = dest + ".tmp"
+    img.save(tmp, "JPEG", quality=quality, optimize=True)
+    os.replace(tmp, dest)
+
+def ingest_photo(src_path):
+    """Stores an uploaded photo under its content hash and builds its renditions. Returns the stored path."""
+    os.makedirs(PHOTO_DIR, exist_ok=True)
+    dest = os.path.join(PHOTO_DIR, f"{_digest(src_path)[:32]}.jpg")
+    if not os.path.exists(dest):
+        with Image.open(src_path) as img:
+            _save_jpeg(ImageOps.exif_transpose(img).convert("RGB"), dest, 92)
+    for kind in RENDITIONS:
+        ensure_rendition(dest, kind)
+    return dest.replace(os.sep, "/")
+
+def ingest_photo_async(src_path, on_done=None):
+    """Runs ingest_photo on the background worker; on_done(stored_path) is called from that thread."""
+    def job():
+        stored = ingest_photo(src_path)
+        if on_done: on_done(stored)
+        return stored
+    return _executor.submit(job)
+
+def rendition_path(photo_path, kind):
+    stem = os.path.splitext(os.path.basename(photo_path))[0]
+    return os.path.join(PHOTO_DIR, kind, f"{stem}.jpg")
+
+def ensure_rendition(photo_path, kind):
+    """
+    Returns the path of the requested rendition, creating it if it is missing
+    or older than the photo (older uploads stored as student_<id>.<ext> can be
+    overwritten in place). Falls back to the original if it cannot be decoded.
+    """
+    if not photo_path or not os.path.exists(photo_path):
+        return None
+    dest = rendition_path(photo_path, kind)
+    try:
+        if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(photo_path):
+            return dest
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with Image.open(photo_path) as img:
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail(RENDITIONS[kind], Image.LANCZOS)
+            _save_jpeg(img, dest, 85)
+        return dest
+    except Exception:
+        return photo_path
+
+def preview_path(photo_path):
+    return ensure_rendition(photo_path, "preview")
+
+def print_path(photo_path):
+    return ensure_rendition(photo_path, "print")
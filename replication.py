@@ -0,0 +1,595 @@
+"""
+Offline replication between copies of school.db on campus laptops that are
+synced by USB instead of a network. Each copy is a site with its own id. A
+changeset file carries the students, challans (with their items) and payments
+(with their allocations) changed since the last file sent to a peer, as whole
+rows in a compact binary format, and is applied on the other copy in one
+transaction:
+
+    python manage.py sync export office-2 --out to_office2.chg
+    python manage.py sync import from_office1.chg
+
+Rows are matched across copies by the site and id they were created with, so
+the autoincrement ids of two laptops never have to agree. Every copy settles
+conflicts the same way:
+    - the newer version of a row wins (change time, then site id);
+    - a deletion wins over any update, but a student with payments is kept;
+    - a challan for the same student, billing period and kind, or a payment
+      with the same bank reference, is the same row on both copies;
+    - a challan paid on both copies keeps both payments: its amount_paid is
+      never less than its allocations add up to.
+
+Only change_log entries after the peer's watermark are read, so a day's work
+exports and applies in seconds whatever the size of the database. A laptop
+started from a copy of another laptop's file must run `sync clone` once
+before its first changeset, so the two are different sites.
+"""
+import datetime
+import json
+import secrets
+import sqlite3
+import struct
+import zlib
+
+import database
+
+MAGIC = b"SCHG"
+FORMAT = 1
+
+# entity -> (table, key column, replicated columns, [(reference column, entity)])
+# Derived columns (balance, family_id, identity keys, family vouchers) are
+# rebuilt on the receiving copy instead of being sent.
+ENTITIES = {
+    "student": ("students", "student_id", database.STUDENT_COLUMNS, []),
+    "challan": ("challans", "challan_id", ("issue_date", "due_date", "status", "payment_date", "total_amount", "arrears", "arrears_due_date",
+                                           "fine", "fine_as_of", "amount_paid", "billing_period", "kind"),
+                [("student_id", "student"), ("carried_forward_to", "challan")]),
+    "payment": ("payments", "payment_id", ("payment_date", "amount", "unapplied", "method", "reference"),
+                [("student_id", "student")]),
+}
+ORDER = ("student", "challan", "payment") # parents first; deletes run in reverse
+
+UPSERT, DELETE = 1, 0
+
+# --- Binary encoding: tagged values, varint lengths and zigzag integers, zlib-compressed ---
+
+_NONE, _INT, _FLOAT, _STR, _BYTES, _LIST = range(6)
+
+def _varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _pack(value, out):
+    if value is None:
+        out.append(_NONE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _varint(value * 2 if value >= 0 else -value * 2 - 1, out)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += struct.pack("<d", value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(_STR)
+        _varint(len(data), out)
+        out += data
+    elif isinstance(value, bytes):
+        out.append(_BYTES)
+        _varint(len(value), out)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _varint(len(value), out)
+        for item in value: _pack(item, out)
+    else:
+        raise TypeError(f"cannot encode {type(value).__name__}")
+
+def _unpack(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _FLOAT:
+        return struct.unpack_from("<d", data, pos)[0], pos + 8
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80: break
+    if tag == _INT:
+        return (n >> 1) ^ -(n & 1), pos
+    if tag == _STR:
+        return data[pos:pos + n].decode("utf-8"), pos + n
+    if tag == _BYTES:
+        return bytes(data[pos:pos + n]), pos + n
+    if tag == _LIST:
+        items = []
+        for _ in range(n):
+            item, pos = _unpack(data, pos)
+            items.append(item)
+        return items, pos
+    raise ValueError(f"bad tag {tag} at {pos - 1}")
+
+def dumps(value):
+    out = bytearray()
+    _pack(value, out)
+    return MAGIC + bytes([FORMAT]) + zlib.compress(bytes(out), 9)
+
+def loads(data):
+    if data[:4] != MAGIC:
+        raise ValueError("not a changeset file")
+    if data[4] != FORMAT:
+        raise ValueError(f"changeset format {data[4]} is not supported by this version")
+    payload = zlib.decompress(data[5:])
+    value, pos = _unpack(payload, 0)
+    if pos != len(payload):
+        raise ValueError("trailing data in changeset")
+    return value
+
+# --- Sites and peers ---
+
+def _site(cursor):
+    cursor.execute("SELECT site_id, name FROM replica_site WHERE id = 1")
+    return cursor.fetchone()
+
+def _change_seq(cursor):
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def _find_peer(cursor, peer):
+    """(site_id, name, sent_seq, acked_seq, received_seq) of a peer given by site id, id prefix or name."""
+    cursor.execute("""
+        SELECT site_id, name, sent_seq, acked_seq, received_seq FROM replica_peers
+        WHERE site_id = ? OR lower(name) = lower(?) OR (length(?) >= 4 AND site_id LIKE ? || '%')
+    """, (peer, peer, peer, peer))
+    found = cursor.fetchall()
+    if len(found) != 1:
+        raise ValueError(f"{'No' if not found else 'More than one'} peer matches {peer!r}; see `manage.py sync peers`.")
+    return found[0]
+
+def get_site():
+    """(site_id, name, change seq) of this copy."""
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    site_id, name = _site(cursor)
+    seq = _change_seq(cursor)
+    conn.close()
+    return site_id, name, seq
+
+def get_peers():
+    """[(site_id, name, sent_seq, acked_seq, received_seq, last_sync)] ordered by name."""
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT site_id, name, sent_seq, acked_seq, received_seq, last_sync FROM replica_peers ORDER BY name")
+    peers = cursor.fetchall()
+    conn.close()
+    return peers
+
+def add_peer(site_id, name):
+    """Registers a site to export to before any changeset has come from it (it will get everything)."""
+    conn = database.connect_db()
+    conn.execute("""
+        INSERT INTO replica_peers (site_id, name) VALUES (?, ?)
+        ON CONFLICT (site_id) DO UPDATE SET name = excluded.name
+    """, (site_id.lower(), name))
+    conn.commit()
+    conn.close()
+
+def clone_site(name=None):
+    """
+    Makes this copy a new site after its file was copied from another laptop.
+    Rows already here keep that laptop's identity, and it is registered as a
+    peer this copy has received everything from up to now. Nothing is counted
+    as sent to it: the other laptop's add_peer starts from 0 too, and the rows
+    it already has are left out of the first changeset by their version.
+    Returns the new site id.
+    """
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        old_site, old_name = _site(cursor)
+        seq = _change_seq(cursor)
+        for entity, (table, key, _, _) in ENTITIES.items():
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO replica_rows (entity, local_id, origin_site, origin_id, version_at, version_site, applied_seq)
+                SELECT ?, {key}, ?, {key}, '', ?, ? FROM {table}
+            """, (entity, old_site, old_site, seq))
+            cursor.execute("""
+                INSERT OR IGNORE INTO replica_aliases (entity, origin_site, origin_id, local_id)
+                SELECT entity, origin_site, origin_id, local_id FROM replica_rows WHERE entity = ? AND origin_site = ?
+            """, (entity, old_site))
+        site_id = secrets.token_hex(8)
+        cursor.execute("UPDATE replica_site SET site_id = ?, name = COALESCE(?, name) WHERE id = 1", (site_id, name))
+        cursor.execute("""
+            INSERT OR REPLACE INTO replica_peers (site_id, name, sent_seq, acked_seq, received_seq, last_sync)
+            VALUES (?, ?, 0, 0, ?, datetime('now', 'localtime'))
+        """, (old_site, old_name, seq))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return site_id
+
+# --- Row identities and versions ---
+
+def _ids_json(ids):
+    return json.dumps(list(ids))
+
+def _identities(cursor, entity, ids, site):
+    """[origin site, origin id] of local rows; rows created here are (this site, id)."""
+    cursor.execute("""
+        SELECT local_id, origin_site, origin_id FROM replica_rows
+        WHERE entity = ? AND local_id IN (SELECT value FROM json_each(?))
+    """, (entity, _ids_json(ids)))
+    found = {local_id: [origin_site, origin_id] for local_id, origin_site, origin_id in cursor.fetchall()}
+    return {i: found.get(i, [site, i]) for i in ids}
+
+def _versions(cursor, entity, ids, site):
+    """
+    (changed_at, site) of local rows: the version last applied from a peer,
+    unless the row changed here after that (or was never received).
+    """
+    cursor.execute("""
+        SELECT entity_id, MAX(seq), changed_at FROM change_log
+        WHERE entity = ? AND entity_id IN (SELECT value FROM json_each(?)) GROUP BY entity_id
+    """, (entity, _ids_json(ids)))
+    latest = {entity_id: (seq, changed_at) for entity_id, seq, changed_at in cursor.fetchall()}
+    cursor.execute("""
+        SELECT local_id, version_at, version_site, applied_seq FROM replica_rows
+        WHERE entity = ? AND local_id IN (SELECT value FROM json_each(?))
+    """, (entity, _ids_json(ids)))
+    applied = {local_id: (at, vsite, seq) for local_id, at, vsite, seq in cursor.fetchall()}
+    versions = {}
+    for i in ids:
+        seq, changed_at = latest.get(i, (None, ""))
+        if i in applied and (seq is None or applied[i][2] >= seq):
+            versions[i] = applied[i][:2]
+        else:
+            versions[i] = (changed_at, site)
+    return versions
+
+# --- Export ---
+
+def _archived_challans(challan_ids):
+    # Archiving deletes paid challans from the live tables; those are not deletions to send
+    if not challan_ids or not database.list_archives():
+        return set()
+    conn = database.connect_history()
+    cursor = conn.cursor()
+    cursor.execute("SELECT challan_id FROM all_challans WHERE challan_id IN (SELECT value FROM json_each(?))", (_ids_json(challan_ids),))
+    archived = set(row[0] for row in cursor.fetchall())
+    conn.close()
+    return archived
+
+def _children(cursor, entity, ids, site):
+    """Items of challans / allocations of payments, keyed by parent id."""
+    children = {i: [] for i in ids}
+    if entity == "challan":
+        cursor.execute("""
+            SELECT challan_id, description, amount FROM challan_items
+            WHERE challan_id IN (SELECT value FROM json_each(?)) ORDER BY item_id
+        """, (_ids_json(ids),))
+        for challan_id, description, amount in cursor.fetchall():
+            children[challan_id].append([description, amount])
+    elif entity == "payment":
+        cursor.execute("""
+            SELECT payment_id, challan_id, amount FROM payment_allocations
+            WHERE payment_id IN (SELECT value FROM json_each(?)) ORDER BY challan_id
+        """, (_ids_json(ids),))
+        allocations = cursor.fetchall()
+        challans = _identities(cursor, "challan", set(a[1] for a in allocations), site)
+        for payment_id, challan_id, amount in allocations:
+            children[payment_id].append(challans[challan_id] + [amount])
+    return children
+
+def _export_entity(cursor, entity, ids, site, peer_site):
+    table, key, columns, references = ENTITIES[entity]
+    ids = sorted(ids)
+    ref_columns = [column for column, _ in references]
+    cursor.execute(f"""
+        SELECT {key}, {", ".join(columns + tuple(ref_columns))} FROM {table}
+        WHERE {key} IN (SELECT value FROM json_each(?))
+    """, (_ids_json(ids),))
+    rows = {row[0]: row[1:] for row in cursor.fetchall()}
+    versions = _versions(cursor, entity, ids, site)
+    identities = _identities(cursor, entity, ids, site)
+    targets = [_identities(cursor, target, set(r[len(columns) + n] for r in rows.values()) - {None}, site)
+               for n, (_, target) in enumerate(references)]
+    children = _children(cursor, entity, list(rows), site)
+    archived = _archived_challans([i for i in ids if i not in rows]) if entity == "challan" else set()
+    records = []
+    for i in ids:
+        version = versions[i]
+        if version[1] == peer_site or i in archived:
+            continue # the peer made this version itself
+        if i in rows:
+            row = rows[i]
+            refs = [None if row[len(columns) + n] is None else found[row[len(columns) + n]] for n, found in enumerate(targets)]
+            records.append([UPSERT] + identities[i] + list(version) + [list(row[:len(columns)]), refs, children[i]])
+        else:
+            records.append([DELETE] + identities[i] + list(version) + [None, None, None])
+    return [entity, list(columns), records]
+
+def export_changeset(peer, filename, resend=False):
+    """
+    Writes the rows changed since the last changeset sent to peer (site id,
+    id prefix or name) to filename; with resend, since the last one the peer
+    confirmed having applied. When the change log has been pruned past that
+    point every row is sent. Returns {"file", "peer", "rows", "deleted", "full"}.
+    """
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        site, name = _site(cursor)
+        peer_site, peer_name, sent_seq, acked_seq, received_seq = _find_peer(cursor, peer)
+        since = acked_seq if resend else sent_seq
+        upto = _change_seq(cursor)
+        cursor.execute("SELECT MIN(seq) FROM change_log")
+        oldest = cursor.fetchone()[0]
+        full = since < (oldest or upto + 1) - 1
+        changed = {entity: set() for entity in ORDER}
+        if full:
+            for entity in ORDER:
+                table, key, _, _ = ENTITIES[entity]
+                cursor.execute(f"SELECT {key} FROM {table}")
+                changed[entity].update(row[0] for row in cursor.fetchall())
+        else:
+            cursor.execute("SELECT DISTINCT entity, entity_id FROM change_log WHERE seq > ?", (since,))
+            for entity, entity_id in cursor.fetchall():
+                if entity in changed: changed[entity].add(entity_id)
+        sections = [_export_entity(cursor, entity, changed[entity], site, peer_site) for entity in ORDER]
+        header = {"from_site": site, "from_name": name, "to_site": peer_site, "since": since, "upto": upto,
+                  "ack": received_seq, "full": int(full), "created_at": datetime.datetime.now().isoformat(timespec="seconds")}
+        with open(filename, "wb") as f:
+            f.write(dumps([list(map(list, header.items())), sections]))
+        cursor.execute("""
+            UPDATE replica_peers SET sent_seq = MAX(sent_seq, ?), last_sync = datetime('now', 'localtime') WHERE site_id = ?
+        """, (upto, peer_site))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return {"file": filename, "peer": peer_name, "full": full,
+            "rows": {entity: sum(1 for r in records if r[0] == UPSERT) for entity, _, records in sections},
+            "deleted": sum(1 for _, _, records in sections for r in records if r[0] == DELETE)}
+
+# --- Apply ---
+
+class _Applier:
+    """Applies the records of one changeset on the caller's transaction."""
+    def __init__(self, cursor, site):
+        self.cursor = cursor
+        self.site = site
+        self.stats = {"applied": {entity: 0 for entity in ORDER}, "deleted": 0, "older": 0, "deleted_here": 0,
+                      "conflicts": 0, "missing_parent": 0}
+        self.touched = set() # (entity, local id) written from the changeset
+        self.paid_challans = set() # challans that received allocations
+        self.dates = set() # collection days to recount
+        self.carry_forward = [] # (challan, referenced challan identity), set once all challans are in
+
+    def local_id(self, entity, identity):
+        """Local id of a row known by its origin identity, or None if it never arrived here."""
+        origin_site, origin_id = identity
+        if origin_site == self.site:
+            return origin_id
+        self.cursor.execute("SELECT local_id FROM replica_aliases WHERE entity = ? AND origin_site = ? AND origin_id = ?",
+                            (entity, origin_site, origin_id))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def existing(self, entity, local_id, column):
+        table, key, _, _ = ENTITIES[entity]
+        self.cursor.execute(f"SELECT {column} FROM {table} WHERE {key} = ?", (local_id,))
+        return self.cursor.fetchone()
+
+    def alias(self, entity, identity, local_id):
+        self.cursor.execute("INSERT OR REPLACE INTO replica_aliases (entity, origin_site, origin_id, local_id) VALUES (?, ?, ?, ?)",
+                            (entity, identity[0], identity[1], local_id))
+
+    def record_version(self, entity, local_id, origin, version):
+        self.cursor.execute("""
+            INSERT INTO replica_rows (entity, local_id, origin_site, origin_id, version_at, version_site, applied_seq)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT (entity, local_id) DO UPDATE SET version_at = excluded.version_at, version_site = excluded.version_site
+        """, (entity, local_id, origin[0], origin[1], version[0], version[1]))
+        self.touched.add((entity, local_id))
+
+    def same_row(self, entity, row):
+        # Rows that both copies created for the same thing share a natural key
+        if entity == "challan" and row.get("billing_period") is not None:
+            self.cursor.execute("SELECT challan_id FROM challans WHERE student_id = ? AND billing_period = ? AND kind IS ?",
+                                (row["student_id"], row["billing_period"], row.get("kind")))
+        elif entity == "payment" and row.get("reference"):
+            self.cursor.execute("SELECT payment_id FROM payments WHERE reference = ?", (row["reference"],))
+        else:
+            return None
+        found = self.cursor.fetchone()
+        return found[0] if found else None
+
+    def upsert(self, entity, columns, record):
+        _, origin_site, origin_id, version_at, version_site, values, refs, children = record
+        table, key, replicated, references = ENTITIES[entity]
+        identity, version = (origin_site, origin_id), (version_at, version_site)
+        row = {column: value for column, value in zip(columns, values) if column in replicated}
+        if references:
+            student_id = self.local_id("student", refs[0])
+            if student_id is None or not self.existing("student", student_id, "1"):
+                self.stats["missing_parent"] += 1
+                return
+            row["student_id"] = student_id
+        local_id = self.local_id(entity, identity)
+        if local_id is None:
+            local_id = self.same_row(entity, row)
+            if local_id is not None: self.alias(entity, identity, local_id)
+        origin = [self.site, local_id]
+        date_column = "payment_date" if entity != "student" else "1"
+        if local_id is not None:
+            old = self.existing(entity, local_id, date_column)
+            if old is None:
+                self.stats["deleted_here"] += 1 # deletions win
+                return
+            if version <= _versions(self.cursor, entity, [local_id], self.site)[local_id]:
+                self.stats["older"] += 1
+                return
+            self.dates.add(old[0])
+            try:
+                self.cursor.execute(f"UPDATE {table} SET {', '.join(c + ' = ?' for c in row)} WHERE {key} = ?", list(row.values()) + [local_id])
+            except sqlite3.IntegrityError:
+                self.stats["conflicts"] += 1
+                return
+        else:
+            try:
+                self.cursor.execute(f"INSERT INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+            except sqlite3.IntegrityError:
+                self.stats["conflicts"] += 1
+                return
+            local_id = self.cursor.lastrowid
+            origin = list(identity)
+            self.alias(entity, identity, local_id)
+        self.record_version(entity, local_id, origin, version)
+        self.stats["applied"][entity] += 1
+        self.dates.add(row.get("payment_date"))
+        if entity == "student":
+            self.cursor.execute("UPDATE students SET identity_key = ?, contact_key = ? WHERE student_id = ?", (
+                database.make_identity_key(row.get("full_name"), row.get("father_name"), row.get("date_of_birth"), row.get("contact_details")),
+                database.contact_digits(row.get("contact_details")), local_id))
+            self.cursor.execute("SELECT father_name, contact_details FROM students WHERE student_id = ?", (local_id,))
+            database._assign_family(self.cursor, local_id, *self.cursor.fetchone())
+        elif entity == "challan":
+            self.cursor.execute("DELETE FROM challan_items WHERE challan_id = ?", (local_id,))
+            self.cursor.executemany("INSERT INTO challan_items (challan_id, description, amount) VALUES (?, ?, ?)",
+                                    [(local_id, description, amount) for description, amount in children])
+            self.carry_forward.append((local_id, refs[1]))
+        elif entity == "payment":
+            self.cursor.execute("DELETE FROM payment_allocations WHERE payment_id = ?", (local_id,))
+            for challan_site, challan_id, amount in children:
+                challan_id = self.local_id("challan", (challan_site, challan_id))
+                if challan_id is None or not self.existing("challan", challan_id, "1"): continue
+                self.cursor.execute("INSERT INTO payment_allocations (payment_id, challan_id, amount) VALUES (?, ?, ?)",
+                                    (local_id, challan_id, amount))
+                self.paid_challans.add(challan_id)
+
+    def link_carry_forward(self):
+        for challan_id, target in self.carry_forward:
+            target_id = self.local_id("challan", target) if target else None
+            self.cursor.execute("UPDATE challans SET carried_forward_to = ? WHERE challan_id = ? AND carried_forward_to IS NOT ?",
+                                (target_id, challan_id, target_id))
+
+    def delete(self, entity, record):
+        _, origin_site, origin_id, version_at, version_site = record[:5]
+        table, key, _, _ = ENTITIES[entity]
+        local_id = self.local_id(entity, (origin_site, origin_id))
+        old = self.existing(entity, local_id, "payment_date" if entity != "student" else "1") if local_id else None
+        if old is None:
+            return
+        if entity == "student":
+            self.cursor.execute("SELECT 1 FROM payments WHERE student_id = ? LIMIT 1", (local_id,))
+            if self.cursor.fetchone():
+                self.stats["conflicts"] += 1 # a student with payments is kept
+                return
+        try:
+            self.cursor.execute(f"DELETE FROM {table} WHERE {key} = ?", (local_id,))
+        except sqlite3.IntegrityError:
+            self.stats["conflicts"] += 1
+            return
+        self.dates.add(old[0])
+        self.record_version(entity, local_id, [origin_site, origin_id], (version_at, version_site))
+        self.stats["deleted"] += 1
+
+    def settle_paid_challans(self):
+        # A challan paid on both copies: amount_paid follows the union of allocations
+        for challan_id in self.paid_challans:
+            self.cursor.execute("""
+                SELECT c.total_amount, c.amount_paid, c.status, SUM(a.amount), MAX(p.payment_date)
+                FROM challans c JOIN payment_allocations a ON a.challan_id = c.challan_id
+                JOIN payments p ON p.payment_id = a.payment_id WHERE c.challan_id = ?
+            """, (challan_id,))
+            total, paid, status, allocated, last_date = self.cursor.fetchone()
+            if allocated is None or round(allocated - (paid or 0), 2) <= 0:
+                continue
+            settled = status == "Unpaid" and round(allocated - total, 2) >= 0
+            self.cursor.execute("""
+                UPDATE challans SET amount_paid = ?,
+                    status = CASE WHEN ? THEN 'Paid' ELSE status END,
+                    payment_date = CASE WHEN ? THEN ? ELSE payment_date END
+                WHERE challan_id = ?
+            """, (allocated, settled, settled, last_date, challan_id))
+            if settled:
+                self.cursor.execute(database.FAMILY_VOUCHER_SETTLE, (challan_id, last_date))
+                self.dates.add(last_date)
+
+    def finish(self):
+        """Recounts the collection days touched and marks the written rows as received."""
+        dates = set(d for d in self.dates if isinstance(d, str))
+        if dates:
+            database._rebuild_collection_daily(self.cursor, dates=dates)
+        seq = _change_seq(self.cursor)
+        self.cursor.executemany("UPDATE replica_rows SET applied_seq = ? WHERE entity = ? AND local_id = ?",
+                                [(seq, entity, local_id) for entity, local_id in self.touched])
+
+def apply_changeset(filename):
+    """
+    Applies a changeset file from another site in one transaction. Refuses a
+    file meant for another site, one of this site's own, or one that starts
+    after a changeset from the same peer that has not been applied yet.
+    Returns {"peer", "applied": {entity: rows}, "deleted", "older", "deleted_here", "conflicts", "missing_parent"}.
+    """
+    with open(filename, "rb") as f:
+        header, sections = loads(f.read())
+    header = dict(header)
+    conn = database.connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        site, _ = _site(cursor)
+        if header["from_site"] == site:
+            raise ValueError("This changeset was written by this same site. If this database was copied from the "
+                             "other laptop, run `manage.py sync clone` on the copy and export again.")
+        if header["to_site"] != site:
+            raise ValueError(f"This changeset was written for site {header['to_site']}, not this one ({site}).")
+        cursor.execute("SELECT received_seq FROM replica_peers WHERE site_id = ?", (header["from_site"],))
+        known = cursor.fetchone()
+        if known and not header["full"] and header["since"] > known[0]:
+            raise ValueError(f"This changeset starts after change {header['since']} but only {known[0]} were received "
+                             f"from {header['from_name']}; apply the earlier file first, or export it again with --resend.")
+        applier = _Applier(cursor, site)
+        by_entity = {entity: (columns, records) for entity, columns, records in sections}
+        for entity in ORDER:
+            columns, records = by_entity.get(entity, ([], []))
+            for record in records:
+                if record[0] == UPSERT: applier.upsert(entity, columns, record)
+            if entity == "challan": applier.link_carry_forward()
+        for entity in reversed(ORDER):
+            for record in by_entity.get(entity, ([], []))[1]:
+                if record[0] == DELETE: applier.delete(entity, record)
+        applier.settle_paid_challans()
+        applier.finish()
+        cursor.execute("""
+            INSERT INTO replica_peers (site_id, name, sent_seq, acked_seq, received_seq, last_sync)
+            VALUES (?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            ON CONFLICT (site_id) DO UPDATE SET
+                name = excluded.name,
+                sent_seq = MAX(sent_seq, excluded.sent_seq),
+                acked_seq = MAX(acked_seq, excluded.acked_seq),
+                received_seq = MAX(received_seq, excluded.received_seq),
+                last_sync = excluded.last_sync
+        """, (header["from_site"], header["from_name"], header["ack"], header["ack"], header["upto"]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    database._changed()
+    return dict(applier.stats, peer=header["from_name"])
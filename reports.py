@@ -0,0 +1,227 @@
+"""
+Report exporters. Rows are written as they are read from the database
+generators, so an export never holds the whole result set in memory.
+"""
+import calendar
+import csv
+import datetime
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+import database
+from database import (
+    AGING_BUCKETS, iter_receivables_aging, iter_classwise_defaulters, iter_classwise_postings,
+    get_collection_summary, get_new_admissions_list, get_struck_off_list, snapshot_database
+)
+
+MONTH_NAMES = [None, 'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+
+# Rows per Table flowable. Each chunk is laid out and dropped before the next is built.
+CHUNK_ROWS = 40
+# Flowables kept ahead of the layout engine
+FLOWABLE_WINDOW = 50
+
+def export_rows_csv(filename, header, rows):
+    """Streams any iterable of rows into a CSV file. Returns the row count."""
+    count = 0
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def export_receivables_aging(filename, as_of=None, by="class"):
+    header = ["Class"]
+    if by == "student":
+        header += ["Student ID", "Name"]
+    header += list(AGING_BUCKETS) + ["Total"]
+    return export_rows_csv(filename, header, iter_receivables_aging(as_of, by))
+
+# === STREAMING PDF REPORTS ===
+
+class _StreamingFlowables(list):
+    """
+    A list that tops itself up from a generator while platypus consumes it.
+    SimpleDocTemplate.build loops on len(flowables) and deletes from the front,
+    so only FLOWABLE_WINDOW flowables exist at any time.
+    """
+    def __init__(self, source, window=FLOWABLE_WINDOW):
+        super().__init__()
+        self._source = iter(source)
+        self._window = window
+        self._fill()
+
+    def _fill(self):
+        while self._source is not None and list.__len__(self) < self._window:
+            try: self.append(next(self._source))
+            except StopIteration: self._source = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#003366")),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ('ALIGN', (-1, 1), (-1, -1), 'RIGHT'),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor("#F5F5F5")]),
+])
+
+_SUBTOTAL_STYLE = [
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor("#E0E0E0")),
+]
+
+def _grouped_flowables(rows, header, col_widths, make_row, amount_of):
+    """
+    Turns class-ordered rows into class headings and chunked tables with a
+    repeated header row and a per-class subtotal, plus a grand total at the end.
+    """
+    styles = getSampleStyleSheet()
+    grand_total = 0
+    for s_class, class_rows in itertools.groupby(rows, key=lambda r: r[0]):
+        yield Paragraph(f"Class: {s_class or '-'}", styles['Heading2'])
+        subtotal = 0
+        count = 0
+        chunk = []
+        for row in class_rows:
+            chunk.append(make_row(row))
+            subtotal += amount_of(row) or 0
+            count += 1
+            if len(chunk) == CHUNK_ROWS:
+                yield _chunk_table(header, chunk, col_widths)
+                chunk = []
+        totals = [""] * (len(header) - 2) + [f"Subtotal ({count})", f"{subtotal:,.0f}"]
+        yield _chunk_table(header, chunk + [totals], col_widths, subtotal=True)
+        yield Spacer(1, 0.2 * inch)
+        grand_total += subtotal
+    yield Paragraph(f"<b>Grand Total: Rs. {grand_total:,.0f}</b>", styles['Heading2'])
+
+def _chunk_table(header, body, col_widths, subtotal=False):
+    table = Table([header] + body, colWidths=col_widths, repeatRows=1)
+    table.setStyle(_TABLE_STYLE)
+    if subtotal:
+        table.setStyle(TableStyle(_SUBTOTAL_STYLE))
+    return table
+
+def _page_decorator(title):
+    printed = datetime.date.today().strftime('%d-%b-%Y')
+    def draw(canvas, doc):
+        w, h = A4
+        canvas.saveState()
+        canvas.setFont("Helvetica-Bold", 11)
+        canvas.drawString(0.6 * inch, h - 0.5 * inch, f"IIUI SCHOOLS - {title}")
+        canvas.setFont("Helvetica", 8)
+        canvas.drawRightString(w - 0.6 * inch, h - 0.5 * inch, f"Printed: {printed}")
+        canvas.drawCentredString(w / 2, 0.4 * inch, f"Page {doc.page}")
+        canvas.restoreState()
+    return draw
+
+def _build_pdf(filename, title, flowables):
+    doc = SimpleDocTemplate(filename, pagesize=A4, title=title,
+                            leftMargin=0.6 * inch, rightMargin=0.6 * inch,
+                            topMargin=0.8 * inch, bottomMargin=0.7 * inch)
+    decorate = _page_decorator(title)
+    doc.build(_StreamingFlowables(flowables), onFirstPage=decorate, onLaterPages=decorate)
+    return filename
+
+def render_defaulter_report(filename="Defaulters.pdf"):
+    header = ["#", "Student Name", "Overdue (Rs)"]
+    counter = itertools.count(1)
+    flowables = _grouped_flowables(
+        iter_classwise_defaulters(), header, [0.5 * inch, 4.5 * inch, 1.8 * inch],
+        make_row=lambda r: [next(counter), r[1], f"{r[2]:,.0f}"],
+        amount_of=lambda r: r[2])
+    return _build_pdf(filename, "Class-Wise Defaulters List", flowables)
+
+def render_posting_sheet(month, year, filename=None):
+    filename = filename or f"Posting_Sheet_{year}_{month:02d}.pdf"
+    header = ["Student Name", "Challan", "Paid On", "Arrears", "Fine", "Amount (Rs)"]
+    flowables = _grouped_flowables(
+        iter_classwise_postings(month, year), header,
+        [2.3 * inch, 0.9 * inch, 1.0 * inch, 0.9 * inch, 0.7 * inch, 1.1 * inch],
+        make_row=lambda r: [r[1], r[2], r[3], f"{r[5]:,.0f}", f"{r[6]:,.0f}", f"{r[4]:,.0f}"],
+        amount_of=lambda r: r[4])
+    return _build_pdf(filename, f"Posting Sheet - {MONTH_NAMES[month]} {year}", flowables)
+
+# === MONTH-END CLOSE ===
+
+CLOSE_REPORTS = ("defaulters", "posting_sheet", "collection_summary", "new_admissions", "struck_off")
+
+def _close_report(db_path, name, out_dir, month, year):
+    """Runs one month-end report in a worker process against the snapshot file."""
+    database.DB_PATH = db_path
+    start = f"{year:04d}-{month:02d}-01"
+    end = f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+    started = time.perf_counter()
+    rows = None
+    if name == "defaulters":
+        filename = render_defaulter_report(os.path.join(out_dir, "Defaulters.pdf"))
+    elif name == "posting_sheet":
+        filename = render_posting_sheet(month, year, os.path.join(out_dir, "Posting_Sheet.pdf"))
+    elif name == "collection_summary":
+        filename = os.path.join(out_dir, "Collection_Summary.csv")
+        rows = export_rows_csv(filename, ["Date", "Challans", "Amount"], get_collection_summary(start, end))
+    elif name == "new_admissions":
+        filename = os.path.join(out_dir, "New_Admissions.csv")
+        rows = export_rows_csv(filename, ["Admission Date", "Name", "Class", "Father", "Contact"], get_new_admissions_list(start, end))
+    elif name == "struck_off":
+        filename = os.path.join(out_dir, "Struck_Off.csv")
+        rows = export_rows_csv(filename, ["Name", "Class", "Father", "Contact", "Status"], get_struck_off_list())
+    else:
+        raise ValueError(f"Unknown report: {name}")
+    return {
+        "report": name,
+        "file": os.path.basename(filename),
+        "rows": rows,
+        "bytes": os.path.getsize(filename),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+def run_month_end_close(month, year, out_root="month_end", workers=None):
+    """
+    Snapshots the database once, then builds every month-end report from that
+    snapshot in parallel worker processes. Everything, including a manifest.json
+    with per-report timings, goes to <out_root>/<YYYY-MM>/. Returns the manifest.
+    """
+    out_dir = os.path.abspath(os.path.join(out_root, f"{year:04d}-{month:02d}"))
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.perf_counter()
+    snapshot = snapshot_database(os.path.join(out_dir, "school_snapshot.db"))
+    snapshot_seconds = round(time.perf_counter() - started, 3)
+
+    results = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers or len(CLOSE_REPORTS)) as pool:
+        futures = {pool.submit(_close_report, snapshot, name, out_dir, month, year): name for name in CLOSE_REPORTS}
+        for future, name in futures.items():
+            try: results.append(future.result())
+            except Exception as e: errors.append({"report": name, "error": str(e)})
+
+    manifest = {
+        "period": f"{year:04d}-{month:02d}",
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "snapshot": os.path.basename(snapshot),
+        "snapshot_seconds": snapshot_seconds,
+        "total_seconds": round(time.perf_counter() - started, 3),
+        "reports": results,
+        "errors": errors,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    manifest["folder"] = out_dir
+    return manifest
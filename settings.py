@@ -0,0 +1,40 @@
+import json
+
+SETTINGS_FILE = "fee_settings.json"
+
+# Values are kept as strings, matching what the settings file has always stored
+DEFAULT_SETTINGS = {
+    "day": "30",
+    "amount": "5000.0",
+    "last_run": "",
+    "fine_per_day": "10",
+    "fine_cap": "0",
+    "fine_grace_days": "0",
+    "backup_dir": "backups",
+    "backup_keep": "14",
+    "backup_last_run": "",
+    "archive_after_years": "2",
+    "api_url": "",
+    "api_port": "8765",
+    "api_token": "",
+    "campus_name": "Ali Pur Chattha Campus",
+    "notify_gateway": "stub",
+    "notify_gateway_url": "",
+    "notify_rate": "20",
+    "notify_concurrency": "20",
+    "notify_template": "Dear parent, fee of Rs. {amount} is overdue for {students}. Please pay at {campus} at the earliest.",
+}
+
+def load_settings():
+    """Returns the saved fee settings merged over the defaults."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(SETTINGS_FILE) as f:
+            settings.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return settings
+
+def save_settings(settings):
+    with open(SETTINGS_FILE, "w") as f:
+        json.dump(settings, f)
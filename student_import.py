@@ -0,0 +1,225 @@
+"""
+Bulk student import from CSV or XLSX spreadsheets.
+
+Rows are streamed from the file, mapped onto the 20 student columns,
+validated, and inserted with executemany in batched transactions (through
+the API server when the app is a client of one). Rows that fail validation
+go to an error report (spreadsheet row number, field, message) instead of
+stopping the import. After each committed batch the last row number is
+written to a checkpoint file, so a crashed or cancelled import can be
+resumed with start_row / resume=True. Rows whose identity key (name, father,
+date of birth, contact) matches an existing student or an earlier row of the
+same file are rejected as duplicates. Rows that only look like an existing
+student (find_duplicate_students_bulk, checked once per batch) are imported,
+with a "possible duplicate" warning in the report. Imported students are
+linked to their families once the last batch is in.
+"""
+import csv
+import datetime
+import json
+import os
+
+from database import (
+    CLASS_LIST, STUDENT_COLUMNS, STUDENT_STATUSES, find_duplicate_students_bulk, import_students_batch,
+    make_identity_key, rebuild_families
+)
+
+BATCH_SIZE = 5000
+
+# Accepted header spellings (lower-cased, spaces/underscores/punctuation removed)
+# for each student column, besides the column name itself
+HEADER_ALIASES = {
+    "full_name": ("name", "fullname", "studentname"),
+    "date_of_birth": ("dob", "dateofbirth", "birthdate"),
+    "place_of_birth": ("placeofbirth", "birthplace"),
+    "class_into_which_admission_is_sought": ("class", "grade", "classadmitted"),
+    "last_school_attended": ("lastschool", "previousschool"),
+    "reason_for_leaving_last_school": ("reasonforleaving", "reason"),
+    "father_name": ("father", "fathername", "fathersname"),
+    "father_occupation": ("fatheroccupation",),
+    "father_office_address": ("fatheraddress", "fatherofficeaddress"),
+    "mother_name": ("mother", "mothername", "mothersname"),
+    "mother_occupation": ("motheroccupation",),
+    "mother_office_address": ("motheraddress", "motherofficeaddress"),
+    "guardian_name": ("guardian", "guardianname"),
+    "residential_address": ("address", "resaddress", "residentialaddress"),
+    "contact_details": ("contact", "phone", "mobile", "contactdetails"),
+    "brothers_sisters_applicant": ("siblings", "siblingsinschool"),
+    "medical_info": ("medical", "medicalinfo", "medicalinformation"),
+    "admission_date": ("admissiondate", "admdate", "dateofadmission"),
+    "status": ("status",),
+    "photo_path": ("photo", "photopath"),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%Y/%m/%d", "%d-%b-%Y")
+
+_CLASS_LOOKUP = {c.lower().replace(" ", ""): c for c in CLASS_LIST}
+_STATUS_LOOKUP = {s.lower(): s for s in STUDENT_STATUSES}
+
+def _norm_header(text):
+    return "".join(ch for ch in str(text or "").lower() if ch.isalnum())
+
+def map_headers(headers):
+    """Returns, per student column, the index of the matching spreadsheet column (or None)."""
+    lookup = {}
+    for column in STUDENT_COLUMNS:
+        lookup[_norm_header(column)] = column
+        for alias in HEADER_ALIASES.get(column, ()):
+            lookup.setdefault(alias, column)
+    positions = {}
+    for i, header in enumerate(headers):
+        column = lookup.get(_norm_header(header))
+        if column and column not in positions:
+            positions[column] = i
+    return [positions.get(column) for column in STUDENT_COLUMNS]
+
+def _parse_date(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try: return datetime.datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError: pass
+    raise ValueError(f"unrecognised date '{text}'")
+
+def validate_row(values, today):
+    """Cleans one mapped row. Returns (row tuple, errors) where errors is [(field, message)]."""
+    row = {}
+    for column, value in zip(STUDENT_COLUMNS, values):
+        if isinstance(value, (datetime.date, datetime.datetime)): row[column] = value
+        else: row[column] = "" if value is None else str(value).strip()
+    errors = []
+    if not row["full_name"]:
+        errors.append(("full_name", "name is required"))
+    cls = _CLASS_LOOKUP.get(row["class_into_which_admission_is_sought"].lower().replace(" ", ""))
+    if not cls:
+        errors.append(("class_into_which_admission_is_sought", f"unknown class '{row['class_into_which_admission_is_sought']}'"))
+    row["class_into_which_admission_is_sought"] = cls
+    for field in ("date_of_birth", "admission_date"):
+        try: row[field] = _parse_date(row[field])
+        except ValueError as e: errors.append((field, str(e)))
+    if not row["admission_date"] and not any(f == "admission_date" for f, _ in errors):
+        row["admission_date"] = today
+    status = _STATUS_LOOKUP.get((row["status"] or "Active").lower())
+    if not status:
+        errors.append(("status", f"unknown status '{row['status']}'"))
+    row["status"] = status
+    return tuple(row[c] if row[c] != "" else None for c in STUDENT_COLUMNS), errors
+
+def iter_spreadsheet(path):
+    """Yields the header row and then every data row of a .csv or .xlsx file."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError("openpyxl is required for Excel files. Please run: pip install openpyxl")
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for row in wb.worksheets[0].iter_rows(values_only=True):
+                yield row
+        finally:
+            wb.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f):
+                yield row
+
+def _checkpoint_path(path):
+    return path + ".import-progress.json"
+
+def import_students(path, start_row=None, resume=False, error_report=None, batch_size=BATCH_SIZE, progress=None):
+    """
+    Imports every valid row of the spreadsheet. Row numbers are spreadsheet
+    rows (the header is row 1). start_row skips everything before it;
+    resume=True continues after the last committed row in the checkpoint.
+    progress(rows_read), if given, is called after every committed batch.
+    Returns a summary dict.
+    """
+    checkpoint = _checkpoint_path(path)
+    if resume and start_row is None and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            start_row = json.load(f)["last_row"] + 1
+    start_row = start_row or 2
+    error_report = error_report or os.path.splitext(path)[0] + "_import_errors.csv"
+    today = datetime.date.today().strftime("%Y-%m-%d")
+
+    rows = iter_spreadsheet(path)
+    try:
+        headers = next(rows)
+    except StopIteration:
+        return {"imported": 0, "errors": 0, "last_row": 1, "error_report": None}
+    positions = map_headers(headers)
+    missing = [c for c in ("full_name", "class_into_which_admission_is_sought") if positions[STUDENT_COLUMNS.index(c)] is None]
+    if missing:
+        raise ValueError(f"Spreadsheet has no column for: {', '.join(missing)}")
+
+    imported = errors = warnings = 0
+    row_no = 1
+    batch = []
+    seen_keys = {}
+    # A resumed import keeps adding to the report of the earlier run
+    appending = start_row > 2 and os.path.exists(error_report)
+    err_file = open(error_report, "a" if appending else "w", newline="", encoding="utf-8")
+    err_writer = csv.writer(err_file)
+    if not appending:
+        err_writer.writerow(["Row", "Field", "Error"] + list(headers))
+
+    def flush(last_row):
+        # One lookup per batch for children already on the roll; through the
+        # database functions, so an API client imports over the server too
+        rows, near = [], 0
+        for (row_no, raw, row), matches in zip(batch, find_duplicate_students_bulk([b[2] for b in batch])):
+            if matches and matches[0][6]:
+                err_writer.writerow([row_no, "duplicate", f"same child as student ID {matches[0][0]}"] + list(raw))
+                continue
+            if matches:
+                near += 1
+                sid, name, father, _, _, score, _ = matches[0]
+                err_writer.writerow([row_no, "possible duplicate",
+                                     f"imported; similar to student ID {sid} ({name} s/o {father}, {score:.0%})"] + list(raw))
+            rows.append(row)
+        if rows: import_students_batch(rows)
+        with open(checkpoint, "w") as f:
+            json.dump({"last_row": last_row}, f)
+        if progress: progress(last_row)
+        return len(rows), len(batch) - len(rows), near
+
+    try:
+        for row_no, raw in enumerate(rows, start=2):
+            if row_no < start_row or not any(v not in (None, "") for v in raw):
+                continue
+            values = [raw[i] if i is not None and i < len(raw) else None for i in positions]
+            row, problems = validate_row(values, today)
+            if problems:
+                errors += 1
+                for field, message in problems:
+                    err_writer.writerow([row_no, field, message] + list(raw))
+                continue
+            key = make_identity_key(row[0], row[6], row[1], row[14])
+            if key in seen_keys:
+                errors += 1
+                err_writer.writerow([row_no, "duplicate", f"same child as row {seen_keys[key]}"] + list(raw))
+                continue
+            seen_keys[key] = row_no
+            batch.append((row_no, raw, row))
+            if len(batch) >= batch_size:
+                added, rejected, near = flush(row_no)
+                imported += added; errors += rejected; warnings += near
+                batch = []
+        if batch:
+            added, rejected, near = flush(row_no)
+            imported += added; errors += rejected; warnings += near
+        elif row_no >= start_row:
+            with open(checkpoint, "w") as f:
+                json.dump({"last_row": row_no}, f)
+    finally:
+        err_file.close()
+    # Imported rows are linked to families in one pass rather than row by row
+    if imported:
+        rebuild_families()
+    if not errors and not warnings and not appending:
+        os.remove(error_report)
+        error_report = None
+    return {"imported": imported, "errors": errors, "warnings": warnings, "last_row": row_no, "error_report": error_report}
@@ -0,0 +1,32 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh school.db in a temporary working directory (settings, backups and archives land there too)."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "school.db"))
+    monkeypatch.setattr(database, "_fee_plan_cache", None)
+    database.setup_database()
+    yield database
+    # Pre-operation snapshots finish on a worker, in the temporary directory
+    for thread in threading.enumerate():
+        if thread.name == "snapshot-finish": thread.join()
+
+
+@pytest.fixture
+def add_student(db):
+    def add(name, class_name="Grade 1", contact=None):
+        row = dict.fromkeys(database.STUDENT_COLUMNS)
+        row.update(full_name=name, father_name=f"Father of {name}", class_into_which_admission_is_sought=class_name,
+                   contact_details=contact or f"0300-{abs(hash(name)) % 10**7:07d}", admission_date="2024-04-01", status="Active")
+        return db.add_student(*(row[c] for c in database.STUDENT_COLUMNS))
+    return add
@@ -0,0 +1,25 @@
+import api_server
+
+
+def _half_written(class_name):
+    # Writes a row, then fails: the write must not survive in the group's transaction
+    api_server.database.set_fee_plan_item(class_name, "Half Written", 100)
+    raise ValueError("bad request")
+
+
+def test_failing_call_rolls_back_without_losing_the_group(db):
+    api_server._start_writer()
+    try:
+        results = api_server._run_group([
+            (db.set_fee_plan_item, ("Grade 1", "Tuition Fee", 1000), {}),
+            (_half_written, ("Grade 1",), {}),
+            (db.set_fee_plan_item, ("Grade 1", "Lab Fee", 200), {}),
+        ])
+    finally:
+        db.pin_connection(None)
+    assert [ok for ok, _ in results] == [True, False, True]
+    assert isinstance(results[1][1], ValueError)
+    conn = db.connect_db()
+    items = conn.execute("SELECT description, amount FROM fee_plans WHERE class_name = 'Grade 1' ORDER BY description").fetchall()
+    conn.close()
+    assert items == [("Lab Fee", 200), ("Tuition Fee", 1000)]
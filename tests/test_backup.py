@@ -0,0 +1,24 @@
+import datetime
+import os
+
+import backup
+
+ITEMS = [("Tuition Fee", 1000.0)]
+
+
+def test_archived_history_survives_losing_the_archive(db, add_student):
+    sid = add_student("Ali")
+    issued = (datetime.date.today() - datetime.timedelta(days=800)).strftime("%Y-%m-%d")
+    cid = db.create_challan(sid, issued, issued, "Unpaid", ITEMS)
+    db.allocate_payment(sid, 1000, issued)
+    year = int(issued[:4])
+    assert db.archive_paid_challans(datetime.date.today().strftime("%Y-%m-%d")) == {year: 1}
+
+    [snapshot] = [path for path, label, _, _ in backup.list_snapshots() if label == f"archive-{year}"]
+    os.remove(db.archive_path(year))
+    assert backup.restore_snapshot(snapshot) == db.archive_path(year)
+
+    conn = db.connect_history()
+    rows = conn.execute("SELECT challan_id, status FROM all_challans").fetchall()
+    conn.close()
+    assert rows == [(cid, "Paid")]
@@ -0,0 +1,56 @@
+import datetime
+
+ITEMS = [("Tuition Fee", 1000.0)]
+
+
+def _day(offset):
+    return (datetime.date.today() + datetime.timedelta(days=offset)).strftime("%Y-%m-%d")
+
+
+def _generate(db, student_ids, issue_offset, due_offset):
+    issue = _day(issue_offset)
+    return db.create_challans_bulk(student_ids, issue, _day(due_offset), ITEMS, billing_period=issue[:7])
+
+
+def test_carry_forward_moves_balance_into_arrears(db, add_student):
+    sid = add_student("Ali")
+    [first] = _generate(db, [sid], -200, -190)
+    [second] = _generate(db, [sid], 0, 15)
+    conn = db.connect_db()
+    status, target = conn.execute("SELECT status, carried_forward_to FROM challans WHERE challan_id = ?", (first,)).fetchone()
+    total, arrears, owed_since = conn.execute(
+        "SELECT total_amount, arrears, arrears_due_date FROM challans WHERE challan_id = ?", (second,)).fetchone()
+    conn.close()
+    assert (status, target) == ("Carried Forward", second)
+    assert (total, arrears, owed_since) == (2000, 1000, _day(-190))
+    assert db.get_student_balance(sid) == 2000
+
+
+def test_second_run_for_the_same_month_is_a_no_op(db, add_student):
+    sid = add_student("Ali")
+    assert len(_generate(db, [sid], 0, 15)) == 1
+    assert _generate(db, [sid], 0, 15) == []
+
+
+def test_carried_arrears_stay_overdue(db, add_student):
+    sid = add_student("Ali")
+    _generate(db, [sid], -200, -190)
+    _generate(db, [sid], 0, 15)
+
+    [(_, _, _, _, overdue, pending)] = db.get_student_fee_summary([sid])
+    assert (overdue, pending) == (1000, 1000)
+    assert db.get_classwise_defaulter_list() == {"Grade 1": [("Ali", 1000)]}
+    [(class_name, current, d30, d60, d90, older, total)] = db.get_receivables_aging()
+    assert (current, d30, d60, d90, older, total) == (1000, 0, 0, 0, 1000, 2000)
+
+
+def test_part_payment_settles_carried_arrears_first(db, add_student):
+    sid = add_student("Ali")
+    _generate(db, [sid], -200, -190)
+    _generate(db, [sid], 0, 15)
+    db.allocate_payment(sid, 600, _day(0))
+
+    [(_, _, _, _, overdue, pending)] = db.get_student_fee_summary([sid])
+    assert (overdue, pending) == (400, 1000)
+    [(_, current, _, _, _, older, total)] = db.get_receivables_aging()
+    assert (current, older, total) == (1000, 400, 1400)
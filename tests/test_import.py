@@ -0,0 +1,25 @@
+import csv
+
+import student_import
+
+
+def test_near_matches_are_imported_with_a_warning(db, tmp_path):
+    existing = dict.fromkeys(db.STUDENT_COLUMNS)
+    existing.update(full_name="Muhammad Ali", father_name="Ahmed Khan", date_of_birth="2015-03-01",
+                    class_into_which_admission_is_sought="Grade 1", contact_details="0300-1234567", status="Active")
+    sid = db.add_student(*(existing[c] for c in db.STUDENT_COLUMNS))
+    sheet = tmp_path / "intake.csv"
+    with open(sheet, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "Father", "Class", "DOB", "Contact"])
+        writer.writerow(["Muhammad Ali", "Ahmed Khan", "Grade 1", "2015-03-01", "0300-1234567"])
+        writer.writerow(["Mohammad Aly", "Ahmad Khan", "Grade 1", "2015-03-01", "0311-7654321"])
+        writer.writerow(["Sara Bibi", "Imran Shah", "Grade 2", "2014-07-09", "0333-1112223"])
+
+    summary = student_import.import_students(str(sheet))
+
+    assert (summary["imported"], summary["errors"], summary["warnings"]) == (2, 1, 1)
+    with open(summary["error_report"], newline="") as f:
+        report = [(row[0], row[1], row[2]) for row in list(csv.reader(f))[1:]]
+    assert report[0] == ("2", "duplicate", f"same child as student ID {sid}")
+    assert report[1][:2] == ("3", "possible duplicate") and f"student ID {sid}" in report[1][2]
@@ -0,0 +1,18 @@
+import pytest
+
+import notifications
+
+
+@pytest.mark.parametrize("contact, target", [
+    ("0300-1234567", ("sms", "03001234567")),
+    ("+92 321 7654321", ("sms", "03217654321")),
+    ("923451112223", ("sms", "03451112223")),
+    ("Father 0300 1234567, Mother 0333-7654321", ("sms", "03001234567")),
+    ("House 12, Street 4, ph 042-35761234 / 0301-2345678", ("sms", "03012345678")),
+    ("PTCL 042-35761234", None),
+    ("042-35761234 parent@example.com", ("email", "parent@example.com")),
+    ("Plot 123456, 0300-12345", None),
+    ("", None),
+])
+def test_parse_contact_picks_a_mobile_number(contact, target):
+    assert notifications.parse_contact(contact) == target
@@ -0,0 +1,46 @@
+import datetime
+
+ITEMS = [("Tuition Fee", 1000.0)]
+TODAY = datetime.date.today().strftime("%Y-%m-%d")
+
+
+def _challan(db, sid):
+    return db.create_challan(sid, TODAY, TODAY, "Unpaid", ITEMS)
+
+
+def _paid(db, challan_id):
+    conn = db.connect_db()
+    row = conn.execute("SELECT amount_paid, status FROM challans WHERE challan_id = ?", (challan_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_underpayment_leaves_challan_partly_paid(db, add_student):
+    sid = add_student("Ali")
+    cid = _challan(db, sid)
+    _, allocations, unapplied = db.allocate_payment(sid, 400, TODAY)
+    assert allocations == [(cid, 400, False)]
+    assert unapplied == 0
+    assert _paid(db, cid) == (400, "Unpaid")
+    assert db.get_student_balance(sid) == 600
+
+
+def test_overpayment_is_credited_to_the_next_challan(db, add_student):
+    sid = add_student("Ali")
+    first = _challan(db, sid)
+    _, allocations, unapplied = db.allocate_payment(sid, 1500, TODAY)
+    assert allocations == [(first, 1000, True)]
+    assert unapplied == 500
+    assert _paid(db, first) == (1000, "Paid")
+
+    second = _challan(db, sid)
+    assert _paid(db, second) == (500, "Unpaid")
+    assert db.get_student_balance(sid) == 500
+
+
+def test_repeated_reference_is_recorded_once(db, add_student):
+    sid = add_student("Ali")
+    cid = _challan(db, sid)
+    assert db.allocate_payment(sid, 300, TODAY, "Bank", "TXN-1") is not None
+    assert db.allocate_payment(sid, 300, TODAY, "Bank", "TXN-1") is None
+    assert _paid(db, cid) == (300, "Unpaid")
@@ -0,0 +1,222 @@
+"""
+Fee voucher PDFs: student challans and consolidated family vouchers. Each
+voucher is one page of three copies (bank, school, student/parent). Many
+vouchers go into one PDF, loaded with a constant number of queries.
+"""
+import os
+import datetime
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+
+from database import get_family_voucher_details, get_challans_details
+from settings import load_settings
+
+LOGO_PATH = "logo.png"
+CHALLAN_COPIES = ("Bank Copy", "School Copy", "Student Copy")
+COPIES = ("Bank Copy", "School Copy", "Parent Copy")
+
+def challan_number(challan_id):
+    return f"{1000000000 + challan_id}"
+
+def voucher_number(voucher_id):
+    # Family vouchers use their own range next to the challan numbers
+    return f"{2000000000 + voucher_id}"
+
+def _draw_three_copies(c, copies, draw):
+    """Calls draw(c, w, h, y_top, copy_name) for each third of the page, with cut lines between."""
+    width, height = A4
+    h_copy = height / 3
+    for i, copy_name in enumerate(copies):
+        y_start = height - (i * h_copy)
+        draw(c, width, h_copy, y_start, copy_name)
+        if i < 2:
+            cut_y = y_start - h_copy
+            c.setDash(3, 3)
+            c.line(0, cut_y, width, cut_y)
+            c.setFont("Helvetica", 8)
+            c.drawString(10, cut_y + 2, "Cut Here -----------------------------------------------------------------")
+            c.setDash()
+
+def draw_challan_copy(c, w, h, y_top, copy_name, detail, campus="Ali Pur Chattha Campus"):
+    """Draws one copy of a student challan from a database.ChallanDetail."""
+    challan, s = detail.challan, detail.student
+    items = list(detail.items)
+    if challan.arrears > 0: items.append(("Arrears", challan.arrears))
+    if challan.fine > 0: items.append(("Fine", challan.fine))
+    unique_num = challan_number(challan.challan_id)
+    margin = 0.4 * inch
+    content_w = w - (2 * margin)
+    curr_y = y_top - 0.4 * inch
+
+    # Header
+    try:
+        if os.path.exists(LOGO_PATH):
+            c.drawImage(LOGO_PATH, margin, curr_y - 0.4*inch, width=0.6*inch, height=0.6*inch, mask='auto', preserveAspectRatio=True)
+    except: pass
+
+    c.setFont("Helvetica-Bold", 12); c.drawCentredString(w/2, curr_y, "IIUI SCHOOLS")
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica", 9); c.drawCentredString(w/2, curr_y, "International Islamic University Islamabad")
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica-Bold", 10); c.drawCentredString(w/2, curr_y, campus)
+    c.setFont("Helvetica-Bold", 9); c.drawRightString(w - margin, y_top - 0.4*inch, copy_name)
+
+    curr_y -= 0.3*inch
+    c.setFont("Helvetica-Bold", 10); c.drawString(margin, curr_y, "FEE VOUCHER")
+    c.drawRightString(w - margin, curr_y, f"Challan No: {unique_num}")
+
+    curr_y -= 0.2*inch
+    c.setFont("Helvetica", 8); c.drawString(margin, curr_y, "HBL P.M.C Branch, Faisalabad")
+    c.drawRightString(w - margin, curr_y, f"Date: {datetime.date.today().strftime('%d-%b-%Y')}")
+
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin, curr_y, "A/C No: 13497901233403")
+
+    # Student Box
+    curr_y -= 0.15*inch
+    box_top = curr_y
+    box_h = 0.7 * inch
+    c.rect(margin, box_top - box_h, content_w, box_h)
+
+    ty = box_top - 0.2*inch
+    c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Student:")
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, f"{s.full_name} S/O {s.father_name}")
+
+    ty -= 0.2*inch
+    c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Class:")
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, s.class_name or "")
+    c.drawRightString(w-margin-5, ty, f"Roll: {s.student_id:04d}")
+
+    ty -= 0.2*inch
+    due_dt = datetime.datetime.strptime(challan.due_date, "%Y-%m-%d").strftime("%d-%b-%Y")
+    c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Due Date:")
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, due_dt)
+
+    # Table
+    curr_y = box_top - box_h - 0.1*inch
+    c.setFillColor(colors.lightgrey)
+    c.rect(margin, curr_y - 0.2*inch, content_w, 0.2*inch, fill=1)
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(margin+5, curr_y - 0.14*inch, "Description")
+    c.drawRightString(w-margin-5, curr_y - 0.14*inch, "Amount (Rs)")
+
+    curr_y -= 0.2*inch
+    c.setFont("Helvetica", 9)
+    for desc, amt in items:
+        curr_y -= 0.15*inch
+        c.drawString(margin+5, curr_y, desc)
+        c.drawRightString(w-margin-5, curr_y, f"{amt:,.0f}")
+
+    curr_y -= 0.1*inch
+    c.line(margin, curr_y, w-margin, curr_y)
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(margin+5, curr_y, "Total Payable")
+    c.drawRightString(w-margin-5, curr_y, f"Rs. {challan.total_amount:,.0f}")
+
+    fy = y_top - h + 0.3*inch
+    c.setFont("Helvetica", 8)
+    c.drawString(margin, fy, "Officer Signature")
+    c.drawRightString(w-margin, fy, "Cashier")
+
+def render_challans(challan_ids, filename="Challans.pdf"):
+    """Writes one page (three copies) per challan into a single PDF."""
+    c = canvas.Canvas(filename, pagesize=A4)
+    c.setTitle(f"Fee Challans ({len(challan_ids)})")
+    campus = load_settings()["campus_name"]
+    for detail in get_challans_details(challan_ids):
+        _draw_three_copies(c, CHALLAN_COPIES, lambda *args: draw_challan_copy(*args, detail, campus))
+        c.showPage()
+    c.save()
+    return filename
+
+def _draw_family_copy(c, w, h, y_top, copy_name, voucher, children, campus):
+    voucher_id, issue_date, due_date, _, _, father_name, contact = voucher
+    margin = 0.4 * inch
+    content_w = w - (2 * margin)
+    curr_y = y_top - 0.4 * inch
+
+    try:
+        if os.path.exists(LOGO_PATH):
+            c.drawImage(LOGO_PATH, margin, curr_y - 0.4*inch, width=0.6*inch, height=0.6*inch, mask='auto', preserveAspectRatio=True)
+    except: pass
+
+    c.setFont("Helvetica-Bold", 12); c.drawCentredString(w/2, curr_y, "IIUI SCHOOLS")
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica", 9); c.drawCentredString(w/2, curr_y, "International Islamic University Islamabad")
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica-Bold", 10); c.drawCentredString(w/2, curr_y, campus)
+    c.setFont("Helvetica-Bold", 9); c.drawRightString(w - margin, y_top - 0.4*inch, copy_name)
+
+    curr_y -= 0.3*inch
+    c.setFont("Helvetica-Bold", 10); c.drawString(margin, curr_y, "FAMILY FEE VOUCHER")
+    c.drawRightString(w - margin, curr_y, f"Voucher No: {voucher_number(voucher_id)}")
+
+    curr_y -= 0.2*inch
+    c.setFont("Helvetica", 8); c.drawString(margin, curr_y, "HBL P.M.C Branch, Faisalabad")
+    c.drawRightString(w - margin, curr_y, f"Date: {datetime.datetime.strptime(issue_date, '%Y-%m-%d').strftime('%d-%b-%Y')}")
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin, curr_y, "A/C No: 13497901233403")
+
+    curr_y -= 0.15*inch
+    box_h = 0.5 * inch
+    c.rect(margin, curr_y - box_h, content_w, box_h)
+    ty = curr_y - 0.2*inch
+    c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Parent:")
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, f"{father_name or ''}  ({contact or ''})")
+    ty -= 0.2*inch
+    c.setFont("Helvetica", 9); c.drawString(margin+5, ty, "Due Date:")
+    c.setFont("Helvetica-Bold", 9); c.drawString(margin+60, ty, datetime.datetime.strptime(due_date, "%Y-%m-%d").strftime("%d-%b-%Y"))
+    c.drawRightString(w-margin-5, ty, f"Children: {len(children)}")
+
+    curr_y -= box_h + 0.1*inch
+    c.setFillColor(colors.lightgrey)
+    c.rect(margin, curr_y - 0.2*inch, content_w, 0.2*inch, fill=1)
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(margin+5, curr_y - 0.14*inch, "Student")
+    c.drawString(margin+3.2*inch, curr_y - 0.14*inch, "Class")
+    c.drawString(margin+4.6*inch, curr_y - 0.14*inch, "Challan No")
+    c.drawRightString(w-margin-5, curr_y - 0.14*inch, "Amount (Rs)")
+
+    curr_y -= 0.2*inch
+    c.setFont("Helvetica", 9)
+    # Amounts come from the live challans, so fines accrued and part payments since issue show
+    total = 0
+    for challan_id, sid, name, cls, amount, arrears, fine, status, paid in children:
+        curr_y -= 0.15*inch
+        c.drawString(margin+5, curr_y, f"{name} (Roll {sid:04d})")
+        c.drawString(margin+3.2*inch, curr_y, cls or "")
+        c.drawString(margin+4.6*inch, curr_y, challan_number(challan_id))
+        if status == "Unpaid":
+            total += amount - (paid or 0)
+            c.drawRightString(w-margin-5, curr_y, f"{amount - (paid or 0):,.0f}")
+        else:
+            c.drawRightString(w-margin-5, curr_y, status)
+
+    curr_y -= 0.1*inch
+    c.line(margin, curr_y, w-margin, curr_y)
+    curr_y -= 0.15*inch
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(margin+5, curr_y, "Total Payable")
+    c.drawRightString(w-margin-5, curr_y, f"Rs. {total:,.0f}")
+
+    fy = y_top - h + 0.3*inch
+    c.setFont("Helvetica", 8)
+    c.drawString(margin, fy, "Officer Signature")
+    c.drawRightString(w-margin, fy, "Cashier")
+
+def render_family_vouchers(voucher_ids, filename="Family_Vouchers.pdf"):
+    """Writes one page (three copies) per family voucher into a single PDF."""
+    c = canvas.Canvas(filename, pagesize=A4)
+    c.setTitle(f"Family Vouchers ({len(voucher_ids)})")
+    campus = load_settings()["campus_name"]
+    for voucher, children in get_family_voucher_details(voucher_ids):
+        _draw_three_copies(c, COPIES, lambda *args: _draw_family_copy(*args, voucher, children, campus))
+        c.showPage()
+    c.save()
+    return filename